@@ -0,0 +1,376 @@
+"""
+Offline end-to-end benchmark of the quick and deep research pipelines.
+
+Search, the web and Gemini are replaced by the stand-ins in Benchmarks.fakes, so
+runs are repeatable and cost nothing. Reports p50/p95 latency, throughput and
+peak traced memory per stage, and saves everything as JSON for comparison.
+
+Usage:
+    python -m Benchmarks.e2e --modes quick deep --jobs 8 --concurrency 4 --output bench.json
+    python -m Benchmarks.e2e --baseline bench.json --output bench_new.json
+"""
+import argparse
+import importlib
+import json
+import math
+import platform
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List
+
+from Metrics.instrumentation import (
+    GEMINI_REPAIR_SAVED_TOKENS,
+    GEMINI_REPAIRS,
+    add_stage_listener,
+    remove_stage_listener,
+    track_request,
+)
+from Metrics.deadline import track_deadline
+from Metrics.tokens import track_tokens
+from Metrics.profiling import profile_job
+from Benchmarks.fakes import (
+    FakeGeminiBackend,
+    LocalWebServer,
+    fake_gemini_factory,
+    load_canned_results,
+    stub_search_factory,
+)
+
+
+# Module attributes the pipelines resolve at call time
+SEARCH_TARGETS = [
+    "QuickResearch.quickresearch.Search",
+    "DeepResearch.deepresearch.Search",
+    "DeepResearch.streaming.Search",
+]
+GEMINI_TARGETS = [
+    "QuickResearch.quickresearch.google_structured_output",
+    "DeepResearch.deepresearch.google_structured_output",
+    "QueryPlanner.planner.google_structured_output",
+    "DeepResearch.summarizer.google_structured_output",
+    "DeepResearch.streaming.google_structured_output",
+]
+# Fixed sleeps that pace real Gemini calls; the fake backend has its own rate limit
+PACING_TARGETS = [
+    "DeepResearch.deepresearch.time",
+    "DeepResearch.streaming.time",
+]
+
+
+class _NoSleepTime:
+    """Stand-in for the time module with sleep() turned into a no-op."""
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def sleep(self, seconds):
+        pass
+
+
+@contextmanager
+def patched_attributes(replacements: Dict[str, object]):
+    originals = []
+    try:
+        for target, value in replacements.items():
+            module_name, attribute = target.rsplit(".", 1)
+            module = importlib.import_module(module_name)
+            originals.append((module, attribute, getattr(module, attribute)))
+            setattr(module, attribute, value)
+        yield
+    finally:
+        for module, attribute, value in reversed(originals):
+            setattr(module, attribute, value)
+
+
+@contextmanager
+def offline_backends(base_url: str, gemini: FakeGeminiBackend, canned=None, keep_pacing: bool = False):
+    """Route Search and Gemini calls of both pipelines to the offline stand-ins."""
+    search_cls = stub_search_factory(base_url, canned)
+    gemini_cls = fake_gemini_factory(gemini)
+    replacements = {target: search_cls for target in SEARCH_TARGETS}
+    replacements.update({target: gemini_cls for target in GEMINI_TARGETS})
+    if not keep_pacing:
+        replacements.update({target: _NoSleepTime() for target in PACING_TARGETS})
+    with patched_attributes(replacements):
+        yield
+
+
+class StageMemoryTracker:
+    def __init__(self, interval: float = 0.01):
+        """
+        Record the highest traced memory seen while each stage was running.
+
+        With concurrent jobs several stages are active at once, so the figure is the
+        process-wide peak during the stage, not memory owned by the stage alone.
+        """
+        self.interval = interval
+        self.active: Dict[str, int] = {}
+        self.peaks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        current = tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            for name in self.active:
+                self.peaks[name] = max(self.peaks.get(name, 0), current)
+
+    def stage_started(self, name: str) -> None:
+        with self._lock:
+            self.active[name] = self.active.get(name, 0) + 1
+        self._sample()
+
+    def stage_finished(self, name: str, seconds: float) -> None:
+        self._sample()
+        with self._lock:
+            self.active[name] -= 1
+            if not self.active[name]:
+                del self.active[name]
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        tracemalloc.start()
+        add_stage_listener(self)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        remove_stage_listener(self)
+        self.overall_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def variant_specs(count: int, args) -> List[Dict]:
+    """Alternating long and half-length variants, each with its own tone."""
+    return [
+        {
+            "name": f"variant-{i + 1}",
+            "word_count": args.word_count if i % 2 == 0 else max(100, args.word_count // 2),
+            "scrape_thumbnail": args.thumbnails,
+            "instructions": f"Write in tone number {i + 1}.",
+        }
+        for i in range(count)
+    ]
+
+
+def run_job(mode: str, topic: str, args) -> Dict:
+    from QuickResearch.quickresearch import run_quick_research, run_quick_research_variants
+    from DeepResearch.deepresearch import run_deep_research, run_deep_research_variants
+
+    with profile_job(args.profile, topic=topic, method=mode) as profile, \
+            track_request() as timings, track_deadline(args.deadline) as budget, \
+            track_tokens(args.token_budget) as usage:
+        start = time.perf_counter()
+        if args.variants and mode == "quick":
+            result = run_quick_research_variants(topic=topic, variants=variant_specs(args.variants, args),
+                                                 max_results=args.max_results,
+                                                 max_source_age_hours=args.corpus_age_hours)
+        elif args.variants:
+            result = run_deep_research_variants(topic=topic, variants=variant_specs(args.variants, args),
+                                                max_source_age_hours=args.corpus_age_hours)
+        elif mode == "quick":
+            result = run_quick_research(topic=topic, max_results=args.max_results,
+                                        word_count=args.word_count, scrape_thumbnail=args.thumbnails,
+                                        max_source_age_hours=args.corpus_age_hours)
+        else:
+            result = run_deep_research(topic=topic, word_count=args.word_count,
+                                       scrape_thumbnail=args.thumbnails,
+                                       max_source_age_hours=args.corpus_age_hours)
+        latency = time.perf_counter() - start
+    if result is not None and args.variants:
+        result = result if all(item["blog_data"] for item in result["variants"]) else None
+    report = budget.report() if budget is not None else None
+    breakdown = timings.to_dict()
+    return {"ok": result is not None, "latency": latency, "stages": breakdown["stages"],
+            "counters": breakdown.get("counters", {}), "deadline": report, "tokens": usage.report(),
+            "profile": profile["job_id"] if profile is not None else None}
+
+
+def deadline_summary(jobs: List[Dict]) -> Dict:
+    """How many jobs met the deadline, and how often each degradation was applied."""
+    degradations: Dict[str, int] = {}
+    for job in jobs:
+        for item in (job["deadline"] or {}).get("degraded", []):
+            name = f"{item['stage']}:{item['action']}"
+            degradations[name] = degradations.get(name, 0) + 1
+    return {
+        "deadline_met": sum(1 for job in jobs if job["deadline"] and job["deadline"]["met"]),
+        "degradations": degradations,
+    }
+
+
+def token_summary(jobs: List[Dict]) -> Dict:
+    """Average Gemini tokens (input plus output) per job, overall and per stage, and budget degradations."""
+    per_stage: Dict[str, int] = {}
+    degradations: Dict[str, int] = {}
+    for job in jobs:
+        for name, totals in job["tokens"]["stages"].items():
+            per_stage[name] = per_stage.get(name, 0) + totals["input_tokens"] + totals["output_tokens"]
+        for item in job["tokens"].get("degraded", []):
+            name = f"{item['stage']}:{item['action']}"
+            degradations[name] = degradations.get(name, 0) + 1
+    total = sum(job["tokens"]["total"]["input_tokens"] + job["tokens"]["total"]["output_tokens"] for job in jobs)
+    return {
+        "per_job": round(total / len(jobs), 1),
+        "per_job_by_stage": {name: round(tokens / len(jobs), 1) for name, tokens in sorted(per_stage.items())},
+        "over_budget": sum(1 for job in jobs if job["tokens"].get("exceeded")),
+        "degradations": degradations,
+    }
+
+
+def repair_summary(gemini: FakeGeminiBackend) -> Dict:
+    """Truncated fake responses, what the repair path made of them, and the tokens it saved."""
+    outcomes: Dict[str, int] = {}
+    for (_, outcome), count in GEMINI_REPAIRS.items().items():
+        outcomes[outcome] = outcomes.get(outcome, 0) + int(count)
+    return {
+        "truncated": gemini.truncated,
+        **outcomes,
+        "saved_tokens": int(sum(GEMINI_REPAIR_SAVED_TOKENS.items().values())),
+    }
+
+
+def run_mode(mode: str, args) -> Dict:
+    topics = [f"{args.topic} {i}" for i in range(args.jobs)]
+    with StageMemoryTracker() as memory:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            jobs = list(pool.map(lambda topic: run_job(mode, topic, args), topics))
+        wall = time.perf_counter() - start
+
+    latencies = [job["latency"] for job in jobs]
+    stage_names = sorted({name for job in jobs for name in job["stages"]})
+    stages = {}
+    for name in stage_names:
+        values = [job["stages"][name] for job in jobs if name in job["stages"]]
+        stages[name] = {
+            "p50_seconds": round(percentile(values, 50), 4),
+            "p95_seconds": round(percentile(values, 95), 4),
+            "peak_memory_mb": round(memory.peaks.get(name, 0) / (1024 * 1024), 2),
+        }
+    return {
+        "jobs": len(jobs),
+        "failed": sum(1 for job in jobs if not job["ok"]),
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_jobs_per_minute": round(len(jobs) / wall * 60.0, 2) if wall else 0.0,
+        "latency_p50_seconds": round(percentile(latencies, 50), 4),
+        "latency_p95_seconds": round(percentile(latencies, 95), 4),
+        "peak_memory_mb": round(memory.overall_peak / (1024 * 1024), 2),
+        "stages": stages,
+        # e.g. boilerplate_tokens_removed, averaged over all jobs
+        "per_job_counters": {
+            name: round(sum(job["counters"].get(name, 0) for job in jobs) / len(jobs), 1)
+            for name in sorted({name for job in jobs for name in job["counters"]})
+        },
+        **(deadline_summary(jobs) if args.deadline is not None else {}),
+        "tokens": token_summary(jobs),
+        **({"profiles": [job["profile"] for job in jobs]} if args.profile else {}),
+    }
+
+
+def compare(current: Dict, baseline: Dict) -> None:
+    print("\nComparison against baseline (negative is faster):")
+    for mode, result in current["results"].items():
+        base = baseline.get("results", {}).get(mode)
+        if not base:
+            continue
+        for key in ("latency_p50_seconds", "latency_p95_seconds", "throughput_jobs_per_minute", "peak_memory_mb"):
+            old, new = base.get(key), result.get(key)
+            if old:
+                print(f"  {mode:>5} {key:<28} {old:>10} -> {new:>10} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["quick", "deep"], choices=["quick", "deep"])
+    parser.add_argument("--jobs", type=int, default=8, help="Jobs per mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs running at the same time")
+    parser.add_argument("--topic", default="benchmark topic")
+    parser.add_argument("--max-results", type=int, default=5)
+    parser.add_argument("--word-count", type=int, default=1000)
+    parser.add_argument("--thumbnails", action="store_true", help="Also run featured image extraction")
+    parser.add_argument("--fixtures", help="Directory of recorded HTML/images to serve instead of generated pages")
+    parser.add_argument("--canned-results", help="JSON file mapping topic -> search results")
+    parser.add_argument("--site-latency", type=float, default=0.05, help="Seconds added to every local HTTP response")
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="Seconds per fake Gemini call")
+    parser.add_argument("--gemini-latency-per-1k", type=float, default=0.0, help="Extra seconds per 1000 output tokens")
+    parser.add_argument("--gemini-latency-per-1k-input", type=float, default=0.0,
+                        help="Extra seconds per 1000 prompt tokens not served from a context cache")
+    parser.add_argument("--gemini-rpm", type=int, default=None, help="Fake Gemini requests per minute")
+    parser.add_argument("--gemini-truncate-rate", type=float, default=0.0,
+                        help="Share of fake Gemini responses cut off part-way through the JSON")
+    parser.add_argument("--gemini-rate-limit-mode", choices=["wait", "error"], default="wait")
+    parser.add_argument("--keep-pacing", action="store_true", help="Keep the fixed sleeps between Gemini calls")
+    parser.add_argument("--deadline", type=float, default=None, help="Run every job with this deadline_seconds")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="Run every job with this token_budget (default: JOB_TOKEN_BUDGET, 0 for unlimited)")
+    parser.add_argument("--corpus-age-hours", type=float, default=0,
+                        help="Reuse local corpus documents up to this age; 0 (default) always uses the local web server")
+    parser.add_argument("--variants", type=int, default=0,
+                        help="Research once per job and write this many variants of the post")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile every job; profiles are saved under PROFILE_DIR")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a previous JSON result")
+    args = parser.parse_args()
+
+    gemini = FakeGeminiBackend(
+        latency=args.gemini_latency,
+        latency_per_1k_output_tokens=args.gemini_latency_per_1k,
+        latency_per_1k_input_tokens=args.gemini_latency_per_1k_input,
+        truncate_rate=args.gemini_truncate_rate,
+        requests_per_minute=args.gemini_rpm,
+        rate_limit_mode=args.gemini_rate_limit_mode,
+        content_words=args.word_count,
+    )
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": {},
+    }
+    with LocalWebServer(fixtures_dir=args.fixtures, latency=args.site_latency) as server:
+        with offline_backends(server.base_url, gemini, load_canned_results(args.canned_results), args.keep_pacing):
+            for mode in args.modes:
+                print(f"Running {args.jobs} {mode} jobs at concurrency {args.concurrency}")
+                report["results"][mode] = run_mode(mode, args)
+    report["gemini_calls"] = gemini.calls
+    report["gemini_tokens"] = {
+        "input": gemini.input_tokens,
+        "cached": gemini.cached_tokens,
+        "caches_created": gemini.caches_created,
+    }
+    report["gemini_repairs"] = repair_summary(gemini)
+
+    print(json.dumps(report["results"], indent=2))
+    print(f"Gemini: {report['gemini_calls']} calls, {json.dumps(report['gemini_tokens'])}")
+    print(f"Repairs: {json.dumps(report['gemini_repairs'])}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
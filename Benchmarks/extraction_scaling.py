@@ -0,0 +1,63 @@
+"""
+Benchmark HTML extraction throughput with the parse step inline vs. in a process pool.
+
+Several scrape jobs share one uvicorn worker, so extraction is driven from a
+thread pool here the same way concurrent jobs would drive it.
+
+Usage:
+    python -m Benchmarks.extraction_scaling --docs 64 --workers 0 1 2 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Tools.scraper import ExtractionExecutor
+
+
+def build_document(index: int, paragraphs: int = 200) -> bytes:
+    """Build a synthetic article page large enough to make parsing dominate."""
+    body = "\n".join(
+        f"<p>Paragraph {i} of article {index}. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 6 + "</p>"
+        for i in range(paragraphs)
+    )
+    html = f"""<html><head><title>Benchmark article {index}</title>
+<meta property="article:published_time" content="2025-01-01T00:00:00Z"></head>
+<body><nav>Home | About | Contact</nav><article><h1>Benchmark article {index}</h1>{body}</article>
+<footer>Copyright</footer></body></html>"""
+    return html.encode("utf-8")
+
+
+def run(docs: list, workers: int, concurrency: int) -> float:
+    executor = ExtractionExecutor(max_workers=workers, task_timeout=120)
+    try:
+        # Warm the pool so process start-up is not counted
+        executor.extract("https://bench.local/warmup", docs[0], "utf-8")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as threads:
+            list(threads.map(lambda item: executor.extract(f"https://bench.local/{item[0]}", item[1], "utf-8"), enumerate(docs)))
+        return time.perf_counter() - start
+    finally:
+        executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=64, help="Number of documents to parse")
+    parser.add_argument("--paragraphs", type=int, default=200, help="Paragraphs per document")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, os.cpu_count() or 1],
+                        help="Pool sizes to compare (0 = inline)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Threads submitting documents")
+    args = parser.parse_args()
+
+    docs = [build_document(i, args.paragraphs) for i in range(args.docs)]
+    baseline = None
+    print(f"{'workers':>8} {'seconds':>9} {'docs/s':>8} {'speedup':>8}")
+    for workers in args.workers:
+        elapsed = run(docs, workers, args.concurrency)
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {len(docs) / elapsed:>8.1f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Offline stand-ins for the external services used by the pipelines.
+
+- StubSearch: a Search that returns canned results pointing at the local web server
+- LocalWebServer: serves recorded (or generated) article HTML and images over HTTP
+- FakeGeminiBackend: replaces the Gemini network calls of google_structured_output
+  with schema-valid output, configurable latency, a rate limit and context caches
+"""
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import typing
+import zlib
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
+
+from Tools.search import Search
+from Google_Genai.googlegenai import google_structured_output
+
+
+LOREM = (
+    "Researchers and practitioners keep revisiting this topic because the trade-offs change as tools mature. "
+    "Teams that measure before they optimise tend to make better decisions and avoid costly rewrites. "
+    "Practical guides recommend starting small, validating assumptions early and documenting the results. "
+)
+
+
+def slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "topic"
+
+
+# ---------------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------------
+
+class StubSearch(Search):
+    def __init__(self, base_url: str, canned: Optional[Dict[str, List[dict]]] = None, scoreboard=None):
+        """
+        Search stand-in that never leaves the machine.
+
+        Args:
+            base_url (str): Root of the LocalWebServer the results point to
+            canned (dict): Optional mapping of topic -> list of {title, href, body}. Relative
+                hrefs are resolved against base_url. Topics not listed get generated results.
+            scoreboard (DomainScoreboard): Domain health used for ranking, as in Search
+        """
+        super().__init__(scoreboard)
+        self.base_url = base_url.rstrip("/") + "/"
+        self.canned = canned or {}
+
+    def search_complete(self, topic, max_results=10) -> list[dict]:
+        if topic in self.canned:
+            results = [dict(item, href=urljoin(self.base_url, item["href"])) for item in self.canned[topic]]
+        else:
+            slug = slugify(topic)
+            results = [
+                {
+                    "title": f"{topic} - source {i}",
+                    "href": f"{self.base_url}articles/{slug}-{i}.html",
+                    "body": f"Snippet {i} about {topic}. {LOREM[:160]}",
+                }
+                for i in range(max_results)
+            ]
+        return [item for item in results[:max_results] if not item["href"].lower().endswith(".pdf")]
+
+    def search(self, topic, max_results=10) -> list:
+        return self._rank([item["href"] for item in self.search_complete(topic, max_results)])
+
+
+def stub_search_factory(base_url: str, canned: Optional[Dict[str, List[dict]]] = None):
+    """Return a StubSearch subclass that can be built with no arguments, like Search()."""
+    class ConfiguredStubSearch(StubSearch):
+        def __init__(self):
+            super().__init__(base_url, canned)
+    return ConfiguredStubSearch
+
+
+# ---------------------------------------------------------------------------
+# Web server
+# ---------------------------------------------------------------------------
+
+def make_png(width: int, height: int) -> bytes:
+    """Build a valid, highly compressible greyscale PNG of the given size."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    raw = b"".join(b"\x00" + b"\x80" * width for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+# Paragraphs every generated page repeats inside its article, like real sites' cookie
+# notices and newsletter pitches that content extraction picks up
+SITE_BOILERPLATE = (
+    "We use cookies to improve your experience on our site. By continuing to browse, you agree to our use of cookies.",
+    "Enjoyed this article? Subscribe to our weekly newsletter and get the latest guides straight to your inbox.",
+    "Related articles: Ten mistakes to avoid | A beginner's checklist | What the experts say about it",
+    "About the author: Sam Writer has covered technology and business for over a decade.",
+)
+
+
+def make_article(slug: str, paragraphs: int = 40) -> bytes:
+    """Build a synthetic article page with the markup the scraper and image extractor look for."""
+    title = slug.replace("-", " ").title()
+    body = "\n".join(f"<p>{title}, paragraph {i}. {LOREM}</p>" for i in range(paragraphs))
+    body = f"<p>{SITE_BOILERPLATE[0]}</p>\n{body}\n" + "\n".join(f"<p>{text}</p>" for text in SITE_BOILERPLATE[1:])
+    html = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<meta property="og:title" content="{title}">
+<meta property="og:image" content="/images/{slug}.png">
+<meta property="article:published_time" content="2025-01-01T00:00:00Z"></head>
+<body><nav>Home | Topics | About</nav>
+<article><h1>{title}</h1>{body}</article>
+<footer>Subscribe to our newsletter</footer></body></html>"""
+    return html.encode("utf-8")
+
+
+class LocalWebServer:
+    def __init__(self, fixtures_dir: Optional[str] = None, latency: float = 0.0, paragraphs: int = 40, image_size=(1200, 630)):
+        """
+        Threaded HTTP server on 127.0.0.1 for WebScraper and FeaturedImageExtractor.
+
+        Args:
+            fixtures_dir (str): Directory of recorded pages and images to serve. When None,
+                /articles/<slug>.html and /images/<slug>.png are generated on the fly
+            latency (float): Seconds to wait before answering each request
+            paragraphs (int): Paragraphs per generated article
+            image_size (tuple): Width and height of generated images
+        """
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.paragraphs = paragraphs
+        self.png = make_png(*image_size)
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _handler(self):
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=server.fixtures_dir or os.getcwd(), **kwargs)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _dispatch(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.fixtures_dir:
+                    return super().do_GET() if self.command == "GET" else super().do_HEAD()
+                path = self.path.split("?")[0]
+                if path.startswith("/articles/") and path.endswith(".html"):
+                    return self._send(make_article(path[len("/articles/"):-5], server.paragraphs), "text/html; charset=utf-8")
+                if path.startswith("/images/") and path.endswith(".png"):
+                    return self._send(server.png, "image/png")
+                self.send_error(404)
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_HEAD(self):
+                self._dispatch()
+
+        return Handler
+
+    def start(self) -> "LocalWebServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+# ---------------------------------------------------------------------------
+
+class FakeRateLimitError(Exception):
+    """Raised by FakeGeminiBackend when the rate limit is exceeded in 'error' mode."""
+    code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"429 RESOURCE_EXHAUSTED (fake). Retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class FakeCacheNotFoundError(Exception):
+    """Raised by FakeGeminiBackend for a cached content name that expired or never existed."""
+    code = 404
+
+
+class FakeGeminiBackend:
+    def __init__(self, latency: float = 0.5, latency_per_1k_output_tokens: float = 0.0,
+                 requests_per_minute: Optional[int] = None, rate_limit_mode: str = "wait",
+                 content_words: int = 800, list_lengths: Optional[Dict[str, int]] = None,
+                 latency_per_1k_input_tokens: float = 0.0, truncate_rate: float = 0.0):
+        """
+        Shared state of the fake Gemini service: latency model, rate limiter and context caches.
+
+        Args:
+            latency (float): Fixed seconds per call
+            latency_per_1k_output_tokens (float): Extra seconds per 1000 generated tokens
+            latency_per_1k_input_tokens (float): Extra seconds per 1000 prompt tokens not served
+                from a context cache
+            truncate_rate (float): Share of responses cut off at 90% of their JSON, as if they
+                hit max_output_tokens
+            requests_per_minute (int): Rate limit across all callers, None for unlimited
+            rate_limit_mode (str): 'wait' blocks until a slot frees up, 'error' raises FakeRateLimitError
+            content_words (int): Size of generated 'content' fields
+            list_lengths (dict): Items to generate per list field name (default 2)
+        """
+        self.latency = latency
+        self.latency_per_1k_output_tokens = latency_per_1k_output_tokens
+        self.requests_per_minute = requests_per_minute
+        self.rate_limit_mode = rate_limit_mode
+        self.content_words = content_words
+        self.list_lengths = {"queries": 5, "tags": 6}
+        self.list_lengths.update(list_lengths or {})
+        self.latency_per_1k_input_tokens = latency_per_1k_input_tokens
+        self.truncate_rate = truncate_rate
+        self.truncated = 0
+        self._random = random.Random(0)
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        # name -> (model, contents, expires at)
+        self.caches: Dict[str, tuple] = {}
+        self.caches_created = 0
+        self._serial = 0
+        self._call_times: List[float] = []
+        self._lock = threading.Lock()
+
+    def _acquire_slot(self) -> None:
+        if not self.requests_per_minute:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._call_times = [t for t in self._call_times if now - t < 60.0]
+                if len(self._call_times) < self.requests_per_minute:
+                    self._call_times.append(now)
+                    return
+                wait = 60.0 - (now - self._call_times[0])
+            if self.rate_limit_mode == "error":
+                raise FakeRateLimitError(wait)
+            time.sleep(wait)
+
+    def _fake_value(self, annotation, field_name: str):
+        origin = typing.get_origin(annotation)
+        if origin is typing.Union or type(annotation).__name__ == "UnionType":
+            args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+            return self._fake_value(args[0], field_name)
+        if origin in (list, List):
+            (item_type,) = typing.get_args(annotation) or (str,)
+            count = self.list_lengths.get(field_name, 2)
+            return [self._fake_value(item_type, f"{field_name}_{i}") for i in range(count)]
+        if annotation is int:
+            return 1
+        if annotation is bool:
+            return True
+        if field_name == "content":
+            words = LOREM.split()
+            paragraphs = []
+            for section in range(max(1, self.content_words // 120)):
+                text = " ".join(words[(section * 7 + i) % len(words)] for i in range(120))
+                paragraphs.append(f"## Section {section + 1}\n\n{text}\n\n- point one\n- point two")
+            return "\n\n".join(paragraphs)
+        with self._lock:
+            self._serial += 1
+            serial = self._serial
+        return f"Fake {field_name.rstrip('_0123456789')} #{serial}: {LOREM[:120]}"
+
+    def create_cache(self, model, contents, ttl):
+        with self._lock:
+            self._serial += 1
+            name = f"cachedContents/fake-{self._serial}"
+            self.caches[name] = (model, str(contents), time.monotonic() + ttl)
+            self.caches_created += 1
+        return name
+
+    def delete_cache(self, name):
+        with self._lock:
+            if self.caches.pop(name, None) is None:
+                raise FakeCacheNotFoundError(f"404 NOT_FOUND (fake): {name}")
+
+    def cached_prefix(self, model, config) -> str:
+        """Contents of the context cache a call refers to, empty when it refers to none."""
+        name = getattr(config, "cached_content", None)
+        if not name:
+            return ""
+        with self._lock:
+            cached = self.caches.get(name)
+            if cached is not None and cached[2] <= time.monotonic():
+                del self.caches[name]
+                cached = None
+        if cached is None or cached[0] != model:
+            raise FakeCacheNotFoundError(f"404 NOT_FOUND (fake): {name} for {model}")
+        return cached[1]
+
+    def generate_content(self, model, contents, config):
+        prefix = self.cached_prefix(model, config)
+        self._acquire_slot()
+        schema = config.response_schema
+        parsed = schema(**{name: self._fake_value(field.annotation, name) for name, field in schema.model_fields.items()})
+        text = parsed.model_dump_json()
+        cached_tokens = len(prefix) // 4
+        input_tokens = cached_tokens + len(str(contents)) // 4
+        output_tokens = len(text) // 4
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.cached_tokens += cached_tokens
+        time.sleep(self.latency + self.latency_per_1k_output_tokens * output_tokens / 1000.0
+                   + self.latency_per_1k_input_tokens * (input_tokens - cached_tokens) / 1000.0)
+        with self._lock:
+            truncate = self._random.random() < self.truncate_rate
+            self.truncated += truncate
+        if truncate:
+            # Like a MAX_TOKENS finish: the JSON stops part-way and the SDK parses nothing
+            parsed, text = None, text[:int(len(text) * 0.9)]
+        return SimpleNamespace(
+            parsed=parsed,
+            text=text,
+            usage_metadata=SimpleNamespace(prompt_token_count=input_tokens, candidates_token_count=output_tokens,
+                                           cached_content_token_count=cached_tokens or None),
+        )
+
+
+def fake_gemini_factory(backend: FakeGeminiBackend):
+    """Return a google_structured_output subclass whose network call goes to the fake backend."""
+    class FakeGemini(google_structured_output):
+        def generate_content(self, model, contents, config):
+            return backend.generate_content(model, contents, config)
+
+        def create_cache(self, model, contents, ttl):
+            return backend.create_cache(model, contents, ttl)
+
+        def delete_cache(self, name):
+            return backend.delete_cache(name)
+    return FakeGemini
+
+
+def load_canned_results(path: Optional[str]) -> Optional[Dict[str, List[dict]]]:
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
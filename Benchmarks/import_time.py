@@ -0,0 +1,66 @@
+"""
+Measure API start-up import cost with `python -X importtime`.
+
+Compares importing main.py alone (lazy pipelines, the default) with importing it
+and warming both pipelines, which is what every cold start paid before the
+pipelines were loaded lazily (and what PIPELINE_WARMUP=startup pays up front).
+
+Usage:
+    python -m Benchmarks.import_time --runs 5 --top 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+SCENARIOS = {
+    "lazy (import main)": "import main",
+    "warm (import main + pipelines)": "import main; main.warm_up_pipelines()",
+}
+
+
+def measure(statement: str) -> Tuple[float, List[Tuple[float, str]]]:
+    """Return total import seconds and (cumulative seconds, module) for top-level imports."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, check=True,
+    )
+    top_level = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented below their parent
+        if not name.startswith("  ", 1):
+            top_level.append((int(cumulative) / 1_000_000, name.strip()))
+    return sum(seconds for seconds, _ in top_level), top_level
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per scenario")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    results: Dict[str, float] = {}
+    for label, statement in SCENARIOS.items():
+        totals = []
+        slowest: List[Tuple[float, str]] = []
+        for _ in range(args.runs):
+            total, modules = measure(statement)
+            totals.append(total)
+            slowest = sorted(modules, reverse=True)[:args.top]
+        results[label] = statistics.median(totals)
+        print(f"\n{label}: median {results[label]:.3f}s over {args.runs} runs")
+        for seconds, module in slowest:
+            print(f"  {seconds:8.3f}s  {module}")
+
+    lazy, warm = results.values()
+    print(f"\nLazy start-up imports {warm / lazy:.1f}x faster ({warm - lazy:.3f}s saved per cold start)")
+
+
+if __name__ == "__main__":
+    main()
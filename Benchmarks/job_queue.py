@@ -0,0 +1,118 @@
+"""
+Run offline quick-research jobs through the shared job queue (in-process stand-in
+backend) and check lease expiry, re-delivery and checkpoint reuse.
+
+Two worker "nodes" with different concurrency consume the queue. A ghost worker
+claims some of the jobs first, runs them and disappears without heartbeating or
+completing them, as if its node had died. The check passes when:
+- every job ends up done, and the abandoned ones were re-delivered
+- re-running an abandoned job made no new Gemini calls (served from its checkpoints)
+- a job abandoned more often than JOB_MAX_DELIVERIES allows is failed, not retried forever
+
+Usage:
+    python -m Benchmarks.job_queue --jobs 8 --abandoned 3
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List
+
+from Benchmarks.e2e import offline_backends
+from Benchmarks.fakes import FakeGeminiBackend, LocalWebServer
+from Metrics.instrumentation import CACHE_LOOKUPS, JOB_EVENTS
+from Tools.scraper import get_extraction_executor
+
+
+def wait_for(queue, job_ids: List[str], timeout: float) -> Dict[str, Dict]:
+    give_up = time.monotonic() + timeout
+    while True:
+        jobs = {job_id: queue.get(job_id) for job_id in job_ids}
+        if all(job["status"] in ("done", "failed") for job in jobs.values()) or time.monotonic() > give_up:
+            return jobs
+        time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--abandoned", type=int, default=3, help="Jobs the ghost worker claims and abandons")
+    parser.add_argument("--lease", type=float, default=1.0, help="Lease seconds; abandoned jobs wait this long")
+    parser.add_argument("--gemini-latency", type=float, default=0.05, help="Seconds per fake Gemini call")
+    args = parser.parse_args()
+
+    os.environ["JOB_BACKEND"] = "memory"
+    from main import BlogRequest, run_queued_job
+    from Server.backend import MemoryBackend, get_backend, job_scope
+    from Server.jobqueue import JobQueue
+    from Server.worker import Worker
+
+    queue = JobQueue(get_backend(), name="check", lease_seconds=args.lease, max_deliveries=3)
+    gemini = FakeGeminiBackend(latency=args.gemini_latency, content_words=300)
+    errors = []
+
+    with LocalWebServer(latency=0.02) as server, offline_backends(server.base_url, gemini):
+        job_ids = [
+            queue.enqueue("blog", BlogRequest(topic=f"queue topic {i}", max_results=3, word_count=300,
+                                              max_source_age_hours=0).model_dump())
+            for i in range(args.jobs)
+        ]
+
+        # The ghost runs its jobs to the end (so their Gemini outputs are checkpointed) and vanishes
+        abandoned = []
+        for _ in range(args.abandoned):
+            job = queue.claim("ghost/0")
+            with job_scope(job["id"]):
+                run_queued_job(job)
+            abandoned.append(job["id"])
+        ghost_calls = gemini.calls
+
+        nodes = [Worker(queue, run_queued_job, concurrency=2, poll_interval=0.05, node="node-a"),
+                 Worker(queue, run_queued_job, concurrency=1, poll_interval=0.05, node="node-b")]
+        for node in nodes:
+            node.start()
+        jobs = wait_for(queue, job_ids, timeout=60 + args.lease * 3)
+        for node in nodes:
+            node.stop()
+
+        # A job nobody finishes: with one delivery allowed it is failed once its lease runs out
+        strict = JobQueue(MemoryBackend(), name="strict", lease_seconds=0.2, max_deliveries=1)
+        dead_id = strict.enqueue("blog", {"topic": "never finished"})
+        strict.claim("ghost/1")
+        time.sleep(0.3)
+        strict.requeue_expired()
+        dead = strict.get(dead_id)
+    get_extraction_executor().shutdown()
+
+    for job_id, job in jobs.items():
+        if job["status"] != "done" or not job.get("result"):
+            errors.append(f"job {job_id}: {job['status']} {job.get('error', '')}")
+        if job_id in abandoned and job.get("deliveries") != 2:
+            errors.append(f"job {job_id}: abandoned but delivered {job.get('deliveries')} time(s)")
+    # Jobs not abandoned make their own calls; the abandoned ones should make none the second time
+    fresh_jobs = args.jobs - args.abandoned
+    calls_per_job = ghost_calls / args.abandoned if args.abandoned else 0
+    redo_calls = gemini.calls - ghost_calls - fresh_jobs * calls_per_job
+    if redo_calls > 0:
+        errors.append(f"re-delivered jobs made {redo_calls:.0f} Gemini call(s) instead of reusing checkpoints")
+    if dead["status"] != "failed":
+        errors.append(f"job delivered past JOB_MAX_DELIVERIES is {dead['status']}, not failed")
+
+    lookups = CACHE_LOOKUPS.items()
+    per_node: Dict[str, int] = {}
+    for job in jobs.values():
+        node = (job.get("worker") or "?").split("/")[0]
+        per_node[node] = per_node.get(node, 0) + 1
+    print(f"Jobs per node: {per_node}")
+    print(f"Re-delivered: {int(sum(v for (kind, event), v in JOB_EVENTS.items().items() if event == 'redelivered'))}, "
+          f"checkpoint hits: {int(lookups.get(('gemini_checkpoint', 'hit'), 0))}, "
+          f"shared scrape hits: {int(lookups.get(('scrape', 'hit'), 0))}")
+    for error in errors:
+        print(f"FAIL {error}")
+    print(f"{args.jobs - sum(1 for job in jobs.values() if job['status'] != 'done')}/{args.jobs} jobs done, "
+          f"{len(abandoned)} abandoned job(s) re-delivered")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
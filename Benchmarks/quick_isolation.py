@@ -0,0 +1,129 @@
+"""
+Run many offline quick-research jobs in parallel threads of one process and check
+that no job sees another job's search results, scraped data or timings.
+
+Each job has its own topic, and the stub search points every topic at its own
+articles. A job passes when:
+- its Gemini prompt contains only the article URLs found for its topic
+- its featured image comes from one of those articles
+- its stage breakdown covers search, scrape and generate exactly once
+
+Usage:
+    python -m Benchmarks.quick_isolation --jobs 16 --concurrency 8
+"""
+import argparse
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from Benchmarks.e2e import offline_backends
+from Benchmarks.fakes import FakeGeminiBackend, LocalWebServer, slugify
+from Metrics.instrumentation import add_stage_listener, remove_stage_listener, track_request
+from Tools.scraper import get_extraction_executor
+
+
+ARTICLE_URL = re.compile(r"articles/([a-z0-9-]+?)-\d+\.html")
+PIPELINE_STAGES = ("search", "scrape", "generate")
+
+
+class RecordingGeminiBackend(FakeGeminiBackend):
+    """Fake Gemini that keeps every prompt it was sent."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prompts: List[str] = []
+
+    def generate_content(self, model, contents, config):
+        prompt = self.cached_prefix(model, config) + str(contents)
+        with self._lock:
+            self.prompts.append(prompt)
+        return super().generate_content(model, contents, config)
+
+
+class StageCounter:
+    """Count stage completions per thread, so each job's counts can be read back."""
+    def __init__(self):
+        self.local = threading.local()
+
+    def counts(self) -> Dict[str, int]:
+        if not hasattr(self.local, "counts"):
+            self.local.counts = {}
+        return self.local.counts
+
+    def stage_started(self, name: str) -> None:
+        pass
+
+    def stage_finished(self, name: str, seconds: float) -> None:
+        counts = self.counts()
+        counts[name] = counts.get(name, 0) + 1
+
+
+def run_job(topic: str, args, gemini: RecordingGeminiBackend, stages: StageCounter) -> List[str]:
+    from QuickResearch.quickresearch import run_quick_research
+
+    stages.counts().clear()
+    with track_request() as timings:
+        # Web only: topics here deliberately overlap, so the corpus index would share documents
+        result = run_quick_research(topic=topic, max_results=args.max_results,
+                                    word_count=args.word_count, scrape_thumbnail=True, max_source_age_hours=0)
+    if result is None:
+        return [f"{topic}: pipeline failed"]
+
+    errors = []
+    slug = slugify(topic)
+    with gemini._lock:
+        prompts = [prompt for prompt in gemini.prompts if f"Topic: {topic}  " in prompt]
+    if len(prompts) != 1:
+        errors.append(f"{topic}: expected 1 blog prompt, found {len(prompts)}")
+    for prompt in prompts:
+        foreign = sorted({found for found in ARTICLE_URL.findall(prompt) if found != slug})
+        if foreign:
+            errors.append(f"{topic}: prompt contains data scraped for {foreign}")
+
+    image_url = result["featured_image"].get("image_url") or ""
+    if f"/images/{slug}-" not in image_url:
+        errors.append(f"{topic}: featured image {image_url!r} does not belong to this topic")
+
+    counts = stages.counts()
+    recorded = timings.to_dict()["stages"]
+    for name in PIPELINE_STAGES:
+        if counts.get(name) != 1 or name not in recorded:
+            errors.append(f"{topic}: stage {name} ran {counts.get(name, 0)} times")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8, help="Threads running jobs at the same time")
+    parser.add_argument("--max-results", type=int, default=3)
+    parser.add_argument("--word-count", type=int, default=300)
+    parser.add_argument("--site-latency", type=float, default=0.02, help="Seconds added to every local HTTP response")
+    parser.add_argument("--gemini-latency", type=float, default=0.05, help="Seconds per fake Gemini call")
+    args = parser.parse_args()
+
+    gemini = RecordingGeminiBackend(latency=args.gemini_latency, content_words=args.word_count)
+    stages = StageCounter()
+    topics = [f"isolation topic {i}" for i in range(args.jobs)]
+
+    add_stage_listener(stages)
+    try:
+        with LocalWebServer(latency=args.site_latency) as server:
+            with offline_backends(server.base_url, gemini):
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    results = list(pool.map(lambda topic: run_job(topic, args, gemini, stages), topics))
+    finally:
+        remove_stage_listener(stages)
+        get_extraction_executor().shutdown()
+
+    errors = [error for job_errors in results for error in job_errors]
+    for error in errors:
+        print(f"FAIL {error}")
+    print(f"{args.jobs - sum(1 for job_errors in results if job_errors)}/{args.jobs} jobs isolated "
+          f"at concurrency {args.concurrency}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,24 @@ sys.path.append(r'c:\Users\hamad\OneDrive\Desktop\FYP\AI System')
 
 from QueryPlanner.planner import QueryPlanner
 from Tools.search import Search
-from Tools.scraper import WebScraper
+from Tools.corpus import local_documents
+from Tools.scraper import WebScraper, over_fetch, SCRAPE_DEADLINE_SECONDS
 from Tools.featuredimage import FeaturedImageExtractor
+from Tools.variants import variant_instructions, write_variants
 from Markdown.toHTML import MarkdownToHTMLConverter
 from Google_Genai.googlegenai import google_structured_output
+from Metrics.instrumentation import stage, timed
+from Metrics.deadline import current_deadline, latency_estimator, model_for
+from Metrics.tokens import current_usage, metered, output_tokens
+from Metrics.cancellation import cancellable_sleep, cancellation_point, check_cancelled
+from DeepResearch.summarizer import BlogSummary, DocumentSummarizer
 
 from langgraph.graph import StateGraph, START, END
 from langchain.prompts import PromptTemplate
 from typing import TypedDict, Optional
+import os
 import time
+import threading
 from pydantic import BaseModel, Field, field_validator
 from dotenv import load_dotenv
 load_dotenv()
@@ -20,8 +29,10 @@ load_dotenv()
 class BlogState(TypedDict):
     topic: str
     word_count: int
+    max_source_age_hours: Optional[float]
     queries: list[str]
     urls: list[str]
+    local_data: list[dict]
     data: list[dict]
     summarized_results: dict[str, str]
     facts_to_verify: list[str]
@@ -30,11 +41,8 @@ class BlogState(TypedDict):
     excerpt: str
     content: str
     tags: list[str]
-
-
-class BlogSummary(BaseModel):
-    summary: str = Field(..., description="A Comprehensive summary of the blog content, Make sure to include all the important points and details in the summary, and make it comprehensive and detailed")
-    facts_to_verify: Optional[list[str]] = Field(None, description="A list of 1 or 2 important facts from the content that may need verification. Each fact should be a clear, searchable string suitable for searching on Google or DuckDuckGo. If there are no such facts, this field can be omitted.")
+    # Extra prompt instructions of one output variant
+    instructions: Optional[str]
 
 
 class FactVerification(BaseModel):
@@ -66,106 +74,162 @@ def generate_queries(state:BlogState):
 
 def get_urls(state: BlogState):
     print("Searching for URLs based on queries")
-    search = Search()
-    urls = search.search_list(state["queries"], max_results_per_topic=2)
-
-    return {"urls": urls}
+    queries = state["queries"]
+    budget = current_deadline()
+    if budget is not None:
+        # Each query brings two documents to summarize; drop queries that would not leave time to write
+        per_run = ["search", "scrape"] + ["summarize_document"] * (2 * len(queries))
+        queries = queries[:budget.fit_count(len(queries), per_run, reserve=("generate", "html"), stage="search", what="queries")]
+
+    # Queries the local corpus already covers skip the web search
+    local_data, local_urls, web_queries = [], [], []
+    for query in queries:
+        documents = local_documents(query, 2, state.get("max_source_age_hours"))
+        for item in documents:
+            if item["url"] not in local_urls:
+                local_data.append(item)
+                local_urls.append(item["url"])
+        if len(documents) < 2:
+            web_queries.append(query)
+
+    urls = []
+    if web_queries:
+        search = Search()
+        urls = [url for url in search.search_list(web_queries, max_results_per_topic=over_fetch(2)) if url not in local_urls]
+
+    return {"queries": queries, "urls": local_urls + urls, "local_data": local_data}
     
 def scrape_data(state: BlogState):
     print("Scraping data from URLs")
-    scraper = WebScraper()
-    data = scraper.scrape_multiple_urls(state["urls"])
-    print(scraper.get_summary_stats(data))
+    local_data = state.get("local_data") or []
+    local_urls = {item["url"] for item in local_data}
+    web_urls = [url for url in state["urls"] if url not in local_urls]
+    data = list(local_data)
+    quorum = len(state.get("queries", [])) * 2 - len(local_data)
+    if web_urls and quorum > 0:
+        scraper = WebScraper()
+        budget = current_deadline()
+        deadline = SCRAPE_DEADLINE_SECONDS
+        if budget is not None:
+            deadline = budget.time_box(deadline, reserve=("summarize_document", "generate", "html"), stage="scrape")
+        scraped = scraper.scrape(web_urls, quorum=quorum, deadline=deadline)
+        print(scraper.get_summary_stats(scraped))
+        data.extend(scraped)
 
     return {"data": data}
 
+def summarize_document(summarizer: DocumentSummarizer, item: dict) -> Optional[tuple[str, BlogSummary]]:
+    """Summarize one scraped page; None when it has no title or content."""
+    title = (item.get("title") or "").strip()
+    content = (item.get("main_content") or "").strip()
+    if not title or not content:
+        return None
+    start = time.perf_counter()
+    with metered("summarize_document"):
+        summary = summarizer.summarize(content)
+    latency_estimator.observe("summarize_document", time.perf_counter() - start)
+    return title, summary
+
+
 def summarized_data(state: BlogState):
     print("Summarizing data")
-    prompt_template = PromptTemplate(
-        input_variables=["content"],
-        template=(
-            "Summarize the following content in a comprehensive and detailed manner. "
-            "Include all important points, facts, and details from the text. "
-            "Do not omit any relevant information; instead, condense and organize it clearly. "
-            "Also list 1 or 2 facts that you think are important to verify from the content. "
-            "If you include facts, make sure each is a clear, searchable string suitable for searching on Google or DuckDuckGo. "
-            "You may omit this list if there are no such facts. "
-            "Here is the content:\n\n{content}"
-        )
-    )
     # model = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
     # structured_model = model.with_structured_output(BlogSummary)
-    model = google_structured_output()
+    # Long documents are chunked and summarized map-reduce style, short ones in one call
+    summarizer = DocumentSummarizer.from_env()
+    budget = current_deadline()
+    usage = current_usage()
     summarized_results: dict[str, str] = {}
     facts_to_verify: list[str] = []
-    for item in state.get("data", []):
-        title = (item.get("title") or "").strip()
-        content = (item.get("main_content") or "").strip()
-        if not title or not content:
+    documents = state.get("data", [])
+    for item in documents:
+        check_cancelled("summarize")
+        # Always summarize at least one source; after that only while generation still fits
+        if budget is not None and summarized_results and \
+                not budget.can_afford("summarize_document", reserve=("generate", "html")):
+            budget.degrade("summarize", "fewer_sources", f"{len(summarized_results)} of {len(documents)} documents summarized")
+            break
+        if usage is not None and summarized_results and not usage.can_afford("summarize_document", reserve=("generate",)):
+            usage.degrade("summarize", "fewer_sources", f"{len(summarized_results)} of {len(documents)} documents summarized")
+            break
+        summarized = summarize_document(summarizer, item)
+        if summarized is None:
             continue 
-        prompt = prompt_template.format(content=content)
-        summary = model.call_google_structured_output(prompt=prompt, pydantic_model=BlogSummary, model="gemini-2.5-flash")
+        title, summary = summarized
         # summary = structured_model.invoke(prompt)
         summarized_results[title]  = summary.summary
         if summary.facts_to_verify:  
             facts_to_verify.extend(summary.facts_to_verify)
-        time.sleep(7)
+        # Pacing for the Gemini rate limit; with a deadline, 429s are left to the retry policy
+        if budget is None:
+            cancellable_sleep(7, "summarize")
 
     facts_to_verify = list(set(facts_to_verify))
       
     return {"summarized_results": summarized_results, "facts_to_verify": facts_to_verify}
 
+
+verification_prompt = PromptTemplate(
+    input_variables=["fact", "metadata"],
+    template = (
+        "Fact to verify: {fact}\n"
+        "Supporting information from DuckDuckGo search:\n{metadata}\n\n"
+        "Based on the above search results, comment on the validity of the fact. "
+        "Return the fact and your comments. "
+    )
+)
+
+def verify_fact(fact: str, search: Search, model: google_structured_output) -> Optional[dict]:
+    """Check one fact against fresh search results; None when the search finds nothing."""
+    start = time.perf_counter()
+    results = search.search_list_complete([fact], max_results_per_topic=5)
+    if not results:
+        return None
+    metadata_str = "\n".join([str(item) for item in results])
+    prompt = verification_prompt.format(fact=fact, metadata=metadata_str)
+    with metered("verify_fact"):
+        verification = model.call_google_structured_output(prompt=prompt, pydantic_model=FactVerification, model="gemini-2.5-flash")
+    latency_estimator.observe("verify_fact", time.perf_counter() - start)
+    return verification.model_dump()
+
+
 def verify_facts(state: BlogState):
     print("Verifying facts")
     model = google_structured_output()
-    prompt_template = PromptTemplate(
-        input_variables=["fact", "metadata"],
-        template = (
-            "Fact to verify: {fact}\n"
-            "Supporting information from DuckDuckGo search:\n{metadata}\n\n"
-            "Based on the above search results, comment on the validity of the fact. "
-            "Return the fact and your comments. "
-        )
-    )
-
     search = Search()
+    budget = current_deadline()
+    usage = current_usage()
     verified_facts = []
+    facts = [fact for fact in state.get("facts_to_verify", []) if fact]
     
-    for fact in state.get("facts_to_verify", []):
-        if not fact:
-            continue
-        results = search.search_list_complete([fact], max_results_per_topic=5)
-        if results:
-            metadata_str = "\n".join([str(item) for item in results]) if results else ""
-            prompt = prompt_template.format(fact=fact, metadata=metadata_str)
-            verification = model.call_google_structured_output(prompt=prompt, pydantic_model=FactVerification, model="gemini-2.5-flash")
-            verified_facts.append(verification.model_dump())
-            time.sleep(7)
+    for index, fact in enumerate(facts):
+        check_cancelled("verify")
+        # Verification is optional: stop as soon as it would eat into generation time
+        if budget is not None and not budget.can_afford("verify_fact", reserve=("generate", "html")):
+            action = "shortened" if index else "skipped"
+            budget.degrade("verify", action, f"{index} of {len(facts)} facts checked")
+            break
+        # Likewise once the job's token budget has to be kept for the post
+        if usage is not None and not usage.can_afford("verify_fact", reserve=("generate",)):
+            usage.degrade("verify", "shortened" if index else "skipped", f"{index} of {len(facts)} facts checked")
+            break
+        verification = verify_fact(fact, search, model)
+        if verification is not None:
+            verified_facts.append(verification)
+            if budget is None:
+                cancellable_sleep(7, "verify")
       
     return {"verified_facts": verified_facts}
 
 
-def generate_blog(state: BlogState):
-    print("Generating blog content")
-
-
-    prompt_template = PromptTemplate(
+# Static instructions first and the research last, so the whole template is a prefix
+# shared by every variant and retry of a post and can be served from a Gemini context cache
+blog_prompt = PromptTemplate(
     template="""
 ## ROLE & GOAL ##
 You are an expert content creator, seasoned blogger, and SEO strategist.
 Create an **original, engaging, and SEO-optimized blog** using the provided research data.
 Audience: Intelligent readers who prefer clarity and actionable insights.
-Aim for at least {word_count} words (you can exceed if needed).
-
----
-
-## CONTEXT ##
-Topic: {topic}  
-Summarized_Data:  
-{summarized_results}
-
-Verified Facts:
-{verified_facts}
 
 ---
 
@@ -206,40 +270,45 @@ Verified Facts:
 
 ---
 
+## CONTEXT ##
+Topic: {topic}  
+Summarized_Data:  
+{summarized_results}
+
+Verified Facts:
+{verified_facts}
+
+---
+""",
+    input_variables=["topic", "summarized_results", "verified_facts"],
+)
+
+# The part of the prompt that differs between variants of one post
+length_prompt = PromptTemplate(
+    template="""
+## LENGTH ##
+Aim for at least {word_count} words (you can exceed if needed).
 """,
-    input_variables=["topic", "summarized_results", "verified_facts", "word_count"],
+    input_variables=["word_count"],
 )
-    prompt = prompt_template.format(
+
+
+def generate_blog(state: BlogState):
+    print("Generating blog content")
+    research = blog_prompt.format(
         topic=state["topic"],
         summarized_results=state["summarized_results"],
-        verified_facts=state["verified_facts"],
-        word_count=state["word_count"]
+        verified_facts=state["verified_facts"]
     )
+    prompt = length_prompt.format(word_count=state["word_count"]) + variant_instructions(state.get("instructions"))
     model = google_structured_output()
-    blog_data = None
-    max_attempts = 4
-    for attempt in range(max_attempts):
-        try:   
-            blog_data = model.call_google_structured_output(prompt=prompt, pydantic_model=BlogData, model="gemini-2.0-flash", max_tokens=8100, thinking_budget=None)
-            
-            if (blog_data
-                    and getattr(blog_data, "title", None)
-                    and getattr(blog_data, "content", None)
-                    and getattr(blog_data, "excerpt", None)
-                    and getattr(blog_data, "tags", None)
-                    and isinstance(getattr(blog_data, "tags", None), list)
-                    and len(getattr(blog_data, "tags", [])) > 0
-                ):
-               break
-            raise ValueError("Model returned None or incomplete BlogData")
-        
-        except Exception as e:
-            print(f"Error generating blog content: {e}")
-            if attempt < max_attempts - 1:
-                print("Retrying in 5 seconds...")
-                time.sleep(5)
-            else:
-                raise e
+    # Retries, backoff and model fallback happen inside google_structured_output
+    blog_model = model_for("generate", "gemini-2.0-flash", reserve=("html",))
+    # No more output than the job's token budget has room for
+    max_tokens = output_tokens(8100, research + prompt, "generate")
+    # A post cut off at max_tokens keeps its content; missing title, excerpt or tags come from a short follow-up call
+    with metered("generate"):
+        blog_data = model.call_google_structured_output(prompt=prompt, pydantic_model=BlogData, model=blog_model, max_tokens=max_tokens, thinking_budget=None, require_complete=True, cached_prefix=research, fillable_fields=("title", "excerpt", "tags"))
 
     return {"title": blog_data.title, "excerpt": blog_data.excerpt, "content": blog_data.content, "tags": blog_data.tags}
 
@@ -249,38 +318,71 @@ def convert_output(state: BlogState):
     html_content = convert.convert_to_html(state["content"])
     return {"content": html_content}
     
-    
-graph = StateGraph(BlogState)
 
-graph.add_node('generate_queries', generate_queries)
-graph.add_node('get_urls', get_urls)
-graph.add_node('scrape_data', scrape_data)
-graph.add_node('summarized_data', summarized_data)
-graph.add_node('verify_facts', verify_facts)
-graph.add_node('generate_blog', generate_blog)
-graph.add_node('convert_output', convert_output)
+def build_workflow(research_only: bool = False):
+    """The deep research graph; with research_only it ends after verify_facts."""
+    graph = StateGraph(BlogState)
+
+    # A cancelled run stops before the next node instead of finishing the graph for nobody
+    graph.add_node('generate_queries', cancellation_point('planning', timed('planning', generate_queries)))
+    graph.add_node('get_urls', cancellation_point('search', timed('search', get_urls)))
+    graph.add_node('scrape_data', cancellation_point('scrape', timed('scrape', scrape_data)))
+    graph.add_node('summarized_data', cancellation_point('summarize', timed('summarize', summarized_data)))
+    graph.add_node('verify_facts', cancellation_point('verify', timed('verify', verify_facts)))
+    if not research_only:
+        graph.add_node('generate_blog', cancellation_point('generate', timed('generate', generate_blog)))
+        graph.add_node('convert_output', cancellation_point('html', timed('html', convert_output)))
+
 
+    graph.add_edge(START, 'generate_queries')
+    graph.add_edge('generate_queries', 'get_urls')
+    graph.add_edge('get_urls', 'scrape_data')
+    graph.add_edge('scrape_data', "summarized_data")
+    graph.add_edge('summarized_data', 'verify_facts')
+    if research_only:
+        graph.add_edge('verify_facts', END)
+        return graph.compile()
+    graph.add_edge('verify_facts', 'generate_blog')
+    graph.add_edge('generate_blog', 'convert_output')
+    graph.add_edge('convert_output', END)
+    return graph.compile()
 
-graph.add_edge(START, 'generate_queries')
-graph.add_edge('generate_queries', 'get_urls')
-graph.add_edge('get_urls', 'scrape_data')
-graph.add_edge('scrape_data', "summarized_data")
-graph.add_edge('summarized_data', 'verify_facts')
-graph.add_edge('verify_facts', 'generate_blog')
-graph.add_edge('generate_blog', 'convert_output')
-graph.add_edge('convert_output', END)
-workflow = graph.compile()
 
+# Compiled on first use (or during API warm-up) instead of at import time
+_workflows = {}
+_workflow_lock = threading.Lock()
 
+def get_workflow(research_only: bool = False):
+    with _workflow_lock:
+        if research_only not in _workflows:
+            _workflows[research_only] = build_workflow(research_only)
+        return _workflows[research_only]
 
-def run_deep_research(topic: str, max_results: int = 2, word_count: int = 1000, scrape_thumbnail: bool = False):
+
+
+def run_streaming_workflow(topic: str, word_count: int, max_source_age_hours: Optional[float] = None) -> BlogState:
+    """Overlapping-stage version of the workflow, selected with DEEP_RESEARCH_MODE=streaming."""
+    from DeepResearch.streaming import StreamingResearch
+
+    state = StreamingResearch.from_env().run(topic, word_count, max_source_age_hours)
+    state.update(cancellation_point('generate', timed('generate', generate_blog))(state))
+    state.update(cancellation_point('html', timed('html', convert_output))(state))
+    return state
+
+
+def run_deep_research(topic: str, max_results: int = 2, word_count: int = 1000, scrape_thumbnail: bool = False,
+                      max_source_age_hours: Optional[float] = None):
     print("Running Deep Research for topic:", topic)
     initial_state = {
         "topic": topic,
-        "word_count": word_count
+        "word_count": word_count,
+        "max_source_age_hours": max_source_age_hours
     }
     try:
-        results = workflow.invoke(initial_state)
+        if os.getenv("DEEP_RESEARCH_MODE", "graph") == "streaming":
+            results = run_streaming_workflow(topic, word_count, max_source_age_hours)
+        else:
+            results = get_workflow().invoke(initial_state)
 
         blog_data = {
         "title": results.get("title"),
@@ -292,8 +394,9 @@ def run_deep_research(topic: str, max_results: int = 2, word_count: int = 1000,
         # Featured image extraction
         featured_image = None
         if scrape_thumbnail:
-            extractor = FeaturedImageExtractor()
-            featured_image = extractor.get_featured_image(results.get("urls", []))
+            with stage("image"):
+                extractor = FeaturedImageExtractor()
+                featured_image = extractor.get_featured_image_within_deadline(results.get("urls", []))
 
         if featured_image is None:
             featured_image = {
@@ -310,4 +413,57 @@ def run_deep_research(topic: str, max_results: int = 2, word_count: int = 1000,
         return combined_results
     except Exception as e:
         print(f"Error in run_deep_research: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def write_variant(research: BlogState, variant: dict) -> dict:
+    """Generate and convert one variant of the post from finished research."""
+    state = {**research, "word_count": variant["word_count"], "instructions": variant.get("instructions")}
+    state.update(timed('generate', generate_blog)(state))
+    state.update(timed('html', convert_output)(state))
+    return {"title": state["title"], "excerpt": state["excerpt"], "content": state["content"], "tags": state["tags"]}
+
+
+def run_deep_research_variants(topic: str, variants: list[dict], max_source_age_hours: Optional[float] = None):
+    """
+    Plan, search, scrape, summarize and verify once, then write every variant from the same research.
+
+    Args:
+        topic (str): Topic of the post
+        variants (list[dict]): Specs with name, word_count, instructions and scrape_thumbnail
+        max_source_age_hours (float): Oldest acceptable source, None for the default policy
+
+    Returns:
+        dict: {"variants": [...]} with one entry per spec, or None when the research failed
+    """
+    print(f"Running Deep Research for topic: {topic} ({len(variants)} variants)")
+    word_count = max(variant["word_count"] for variant in variants)
+    try:
+        if os.getenv("DEEP_RESEARCH_MODE", "graph") == "streaming":
+            from DeepResearch.streaming import StreamingResearch
+            research = StreamingResearch.from_env().run(topic, word_count, max_source_age_hours)
+        else:
+            research = get_workflow(research_only=True).invoke({
+                "topic": topic,
+                "word_count": word_count,
+                "max_source_age_hours": max_source_age_hours
+            })
+    except Exception as e:
+        print(f"Error in run_deep_research_variants: {e}")
+        return None
+
+    results = write_variants(lambda variant: write_variant(research, variant), variants)
+
+    # One image search serves every variant that asked for a thumbnail
+    featured_image = None
+    if any(variant["scrape_thumbnail"] for variant in variants):
+        with stage("image"):
+            extractor = FeaturedImageExtractor()
+            featured_image = extractor.get_featured_image_within_deadline(research.get("urls", []))
+    for variant, result in zip(variants, results):
+        if variant["scrape_thumbnail"] and featured_image is not None:
+            result["featured_image"] = featured_image
+        else:
+            result["featured_image"] = {"success": False, "image_url": None}
+
+    return {"variants": results}
\ No newline at end of file
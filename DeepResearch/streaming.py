@@ -0,0 +1,299 @@
+"""
+Streaming execution of the deep research pipeline.
+
+The graph in deepresearch.py runs each stage to completion before the next one
+starts. Here the stages run at the same time and hand items over through bounded
+asyncio queues: URLs flow from search into scraping as each query's results come
+back, good documents flow into summarization as soon as they are scraped, and
+facts flow into verification as soon as a summary produces them. End-to-end time
+approaches the slowest single chain of items instead of the sum of the stages.
+
+Blocking work (search, HTTP, parsing, Gemini) runs in worker threads via
+asyncio.to_thread, so it still goes through the same clients, retry policy and
+domain health as the graph.
+"""
+import asyncio
+import os
+import time
+from typing import List, Optional
+
+from Tools.search import Search
+from Tools.corpus import local_documents
+from Tools.scraper import WebScraper, SCRAPE_CONCURRENCY, SCRAPE_DEADLINE_SECONDS, is_good_document, over_fetch
+from Google_Genai.googlegenai import google_structured_output
+from Metrics.instrumentation import stage
+from Metrics.deadline import current_deadline
+from Metrics.tokens import current_usage
+from Metrics.cancellation import cancellable_sleep, check_cancelled
+from DeepResearch.summarizer import DocumentSummarizer
+from DeepResearch.deepresearch import BlogState, generate_queries, summarize_document, verify_fact
+
+
+# Marks the end of a queue for one consumer
+_DONE = object()
+
+
+async def _close(queue: asyncio.Queue, consumers: int) -> None:
+    for _ in range(consumers):
+        await queue.put(_DONE)
+
+
+class _Progress:
+    def __init__(self, quorum: int, scrape_deadline: float, pacing: float):
+        """Bookkeeping for one run, kept off the StreamingResearch instance so runs can overlap."""
+        self.quorum = quorum
+        self.scrape_deadline = scrape_deadline
+        self.pacing = pacing
+        self.skipped_documents = 0
+        self.skipped_facts = 0
+        # Skipped to stay within the job's token budget
+        self.token_skipped_documents = 0
+        self.token_skipped_facts = 0
+        self.good_documents = 0
+        self.scrape_started: Optional[float] = None
+        self.seen_urls = set()
+        self.seen_facts = set()
+
+
+class StreamingResearch:
+    def __init__(self, queue_size: int = 8, search_workers: int = 2, scrape_workers: int = SCRAPE_CONCURRENCY,
+                 summarize_workers: int = 2, verify_workers: int = 2, pacing: float = 7.0,
+                 results_per_query: int = 2, scrape_deadline: float = SCRAPE_DEADLINE_SECONDS):
+        """
+        Run planning, search, scraping, summarization and fact verification as
+        overlapping stages connected by bounded queues.
+
+        Args:
+            queue_size (int): Capacity of each hand-off queue; a full queue slows the stage feeding it
+            search_workers (int): Queries searched at the same time
+            scrape_workers (int): Pages fetched at the same time
+            summarize_workers (int): Documents summarized at the same time
+            verify_workers (int): Facts verified at the same time
+            pacing (float): Seconds each summarize/verify worker waits after a Gemini call,
+                the streaming counterpart of the fixed sleeps in the graph
+            results_per_query (int): Good documents wanted per query; scraping stops at
+                results_per_query * len(queries)
+            scrape_deadline (float): Seconds after the first fetch starts when no new fetches begin
+        """
+        self.queue_size = queue_size
+        self.search_workers = search_workers
+        self.scrape_workers = scrape_workers
+        self.summarize_workers = summarize_workers
+        self.verify_workers = verify_workers
+        self.pacing = pacing
+        self.results_per_query = results_per_query
+        self.scrape_deadline = scrape_deadline
+
+    @classmethod
+    def from_env(cls) -> "StreamingResearch":
+        """DEEP_STREAM_QUEUE_SIZE, DEEP_STREAM_SEARCH_WORKERS, DEEP_STREAM_SUMMARIZE_WORKERS,
+        DEEP_STREAM_VERIFY_WORKERS and DEEP_STREAM_PACING_SECONDS."""
+        return cls(
+            queue_size=int(os.getenv("DEEP_STREAM_QUEUE_SIZE", "8")),
+            search_workers=int(os.getenv("DEEP_STREAM_SEARCH_WORKERS", "2")),
+            summarize_workers=int(os.getenv("DEEP_STREAM_SUMMARIZE_WORKERS", "2")),
+            verify_workers=int(os.getenv("DEEP_STREAM_VERIFY_WORKERS", "2")),
+            pacing=float(os.getenv("DEEP_STREAM_PACING_SECONDS", "7")),
+        )
+
+    def run(self, topic: str, word_count: int, max_source_age_hours: Optional[float] = None) -> BlogState:
+        """
+        Research a topic and return the state the graph would have after verify_facts.
+
+        Must be called from a thread without a running event loop (the API runs
+        pipelines in its thread pool).
+        """
+        return asyncio.run(self._run(topic, word_count, max_source_age_hours))
+
+    async def _run(self, topic: str, word_count: int, max_source_age_hours: Optional[float]) -> BlogState:
+        state: BlogState = {"topic": topic, "word_count": word_count, "max_source_age_hours": max_source_age_hours}
+        with stage("planning"):
+            state.update(await asyncio.to_thread(generate_queries, state))
+        queries = state["queries"]
+
+        state.update({"urls": [], "local_data": [], "data": [], "summarized_results": {}, "facts_to_verify": [],
+                      "verified_facts": []})
+        # With a request deadline: scraping is time-boxed, pacing is left to the retry
+        # policy, and summaries and fact checks stop when generation would no longer fit
+        budget = current_deadline()
+        scrape_deadline, pacing = self.scrape_deadline, self.pacing
+        if budget is not None:
+            scrape_deadline = budget.time_box(scrape_deadline, reserve=("summarize_document", "generate", "html"), stage="scrape")
+            pacing = 0.0
+        progress = _Progress(quorum=self.results_per_query * len(queries), scrape_deadline=scrape_deadline, pacing=pacing)
+
+        url_queue = asyncio.Queue(maxsize=self.queue_size)
+        document_queue = asyncio.Queue(maxsize=self.queue_size)
+        fact_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        # Each stage is timed from pipeline start until its last item is done,
+        # so in this mode the stage timings overlap rather than add up
+        await asyncio.gather(
+            self._stage("search", self._search_stage(queries, url_queue, document_queue, state, progress)),
+            self._stage("scrape", self._scrape_stage(url_queue, document_queue, state, progress)),
+            self._stage("summarize", self._summarize_stage(document_queue, fact_queue, state, progress)),
+            self._stage("verify", self._verify_stage(fact_queue, state, progress)),
+        )
+        print(f"Streaming research: {len(state['urls'])} URLs, {len(state['data'])} documents, "
+              f"{len(state['facts_to_verify'])} facts, {len(state['verified_facts'])} verified")
+        return state
+
+    async def _stage(self, name: str, work) -> None:
+        with stage(name):
+            await work
+
+    async def _search_stage(self, queries: List[str], url_queue: asyncio.Queue, document_queue: asyncio.Queue,
+                            state: BlogState, progress: _Progress) -> None:
+        search = Search()
+        limit = asyncio.Semaphore(max(1, self.search_workers))
+
+        async def search_query(query: str) -> None:
+            # Documents from the local corpus skip scraping and go straight to summarization
+            documents = await asyncio.to_thread(local_documents, query, self.results_per_query,
+                                                state["max_source_age_hours"])
+            covered = 0
+            for item in documents:
+                if item["url"] in progress.seen_urls:
+                    continue
+                progress.seen_urls.add(item["url"])
+                progress.good_documents += 1
+                covered += 1
+                state["urls"].append(item["url"])
+                state["local_data"].append(item)
+                state["data"].append(item)
+                await document_queue.put(item)
+            if covered >= self.results_per_query:
+                return
+
+            async with limit:
+                urls = await asyncio.to_thread(search.search, query, over_fetch(self.results_per_query - covered))
+            for url in urls:
+                if url in progress.seen_urls:
+                    continue
+                progress.seen_urls.add(url)
+                state["urls"].append(url)
+                await url_queue.put(url)
+
+        try:
+            await asyncio.gather(*(search_query(query) for query in queries))
+        finally:
+            await _close(url_queue, self.scrape_workers)
+
+    def _scraping_done(self, progress: _Progress) -> bool:
+        if progress.good_documents >= progress.quorum:
+            return True
+        started = progress.scrape_started
+        return started is not None and time.monotonic() - started > progress.scrape_deadline
+
+    async def _scrape_stage(self, url_queue: asyncio.Queue, document_queue: asyncio.Queue, state: BlogState,
+                            progress: _Progress) -> None:
+        scraper = WebScraper()
+
+        async def worker() -> None:
+            while True:
+                url = await url_queue.get()
+                if url is _DONE:
+                    return
+                check_cancelled("scrape")
+                # Keep draining after quorum or deadline so the search stage never blocks on a full queue
+                if self._scraping_done(progress):
+                    continue
+                if progress.scrape_started is None:
+                    progress.scrape_started = time.monotonic()
+                result = await asyncio.to_thread(scraper.scrape_single_url, url)
+                if is_good_document(result) and progress.good_documents < progress.quorum:
+                    progress.good_documents += 1
+                    state["data"].append(result)
+                    await document_queue.put(result)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, self.scrape_workers))))
+        finally:
+            await _close(document_queue, self.summarize_workers)
+        print(scraper.get_summary_stats(state["data"]))
+
+    def _summarize_and_pace(self, summarizer: DocumentSummarizer, item: dict, pacing: float):
+        summarized = summarize_document(summarizer, item)
+        if summarized is not None and pacing:
+            cancellable_sleep(pacing, "summarize")
+        return summarized
+
+    async def _summarize_stage(self, document_queue: asyncio.Queue, fact_queue: asyncio.Queue, state: BlogState,
+                               progress: _Progress) -> None:
+        summarizer = DocumentSummarizer.from_env()
+        budget = current_deadline()
+        usage = current_usage()
+
+        async def worker() -> None:
+            while True:
+                item = await document_queue.get()
+                if item is _DONE:
+                    return
+                check_cancelled("summarize")
+                if budget is not None and state["summarized_results"] and \
+                        not budget.can_afford("summarize_document", reserve=("generate", "html")):
+                    progress.skipped_documents += 1
+                    continue
+                if usage is not None and state["summarized_results"] and \
+                        not usage.can_afford("summarize_document", reserve=("generate",)):
+                    progress.token_skipped_documents += 1
+                    continue
+                summarized = await asyncio.to_thread(self._summarize_and_pace, summarizer, item, progress.pacing)
+                if summarized is None:
+                    continue
+                title, summary = summarized
+                state["summarized_results"][title] = summary.summary
+                for fact in summary.facts_to_verify or []:
+                    if fact and fact not in progress.seen_facts:
+                        progress.seen_facts.add(fact)
+                        state["facts_to_verify"].append(fact)
+                        await fact_queue.put(fact)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, self.summarize_workers))))
+        finally:
+            await _close(fact_queue, self.verify_workers)
+        if progress.skipped_documents:
+            budget.degrade("summarize", "fewer_sources", f"{len(state['summarized_results'])} of "
+                           f"{len(state['summarized_results']) + progress.skipped_documents} documents summarized")
+        if progress.token_skipped_documents:
+            usage.degrade("summarize", "fewer_sources", f"{len(state['summarized_results'])} of "
+                          f"{len(state['summarized_results']) + progress.token_skipped_documents} documents summarized")
+
+    def _verify_and_pace(self, fact: str, search: Search, model: google_structured_output, pacing: float) -> Optional[dict]:
+        verification = verify_fact(fact, search, model)
+        if verification is not None and pacing:
+            cancellable_sleep(pacing, "verify")
+        return verification
+
+    async def _verify_stage(self, fact_queue: asyncio.Queue, state: BlogState, progress: _Progress) -> None:
+        search = Search()
+        model = google_structured_output()
+        budget = current_deadline()
+        usage = current_usage()
+
+        async def worker() -> None:
+            while True:
+                fact = await fact_queue.get()
+                if fact is _DONE:
+                    return
+                check_cancelled("verify")
+                if budget is not None and not budget.can_afford("verify_fact", reserve=("generate", "html")):
+                    progress.skipped_facts += 1
+                    continue
+                if usage is not None and not usage.can_afford("verify_fact", reserve=("generate",)):
+                    progress.token_skipped_facts += 1
+                    continue
+                verification = await asyncio.to_thread(self._verify_and_pace, fact, search, model, progress.pacing)
+                if verification is not None:
+                    state["verified_facts"].append(verification)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, self.verify_workers))))
+        if progress.skipped_facts:
+            checked = len(state["facts_to_verify"]) - progress.skipped_facts
+            budget.degrade("verify", "shortened" if checked else "skipped",
+                           f"{checked} of {len(state['facts_to_verify'])} facts checked")
+        if progress.token_skipped_facts:
+            checked = len(state["facts_to_verify"]) - progress.skipped_facts - progress.token_skipped_facts
+            usage.degrade("verify", "shortened" if checked else "skipped",
+                          f"{checked} of {len(state['facts_to_verify'])} facts checked")
@@ -0,0 +1,180 @@
+import os
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from langchain.prompts import PromptTemplate
+from pydantic import BaseModel, Field
+
+from Google_Genai.googlegenai import google_structured_output
+
+
+class BlogSummary(BaseModel):
+    summary: str = Field(..., description="A Comprehensive summary of the blog content, Make sure to include all the important points and details in the summary, and make it comprehensive and detailed")
+    facts_to_verify: Optional[list[str]] = Field(None, description="A list of 1 or 2 important facts from the content that may need verification. Each fact should be a clear, searchable string suitable for searching on Google or DuckDuckGo. If there are no such facts, this field can be omitted.")
+
+
+summary_prompt = PromptTemplate(
+    input_variables=["content"],
+    template=(
+        "Summarize the following content in a comprehensive and detailed manner. "
+        "Include all important points, facts, and details from the text. "
+        "Do not omit any relevant information; instead, condense and organize it clearly. "
+        "Also list 1 or 2 facts that you think are important to verify from the content. "
+        "If you include facts, make sure each is a clear, searchable string suitable for searching on Google or DuckDuckGo. "
+        "You may omit this list if there are no such facts. "
+        "Here is the content:\n\n{content}"
+    )
+)
+
+chunk_prompt = PromptTemplate(
+    input_variables=["content", "part", "parts"],
+    template=(
+        "The following is part {part} of {parts} of a longer article. "
+        "Summarize this part in a comprehensive and detailed manner. "
+        "Include all important points, facts, figures and details; condense but do not omit relevant information. "
+        "Also list 1 or 2 facts from this part that are important to verify, each as a clear, searchable string "
+        "suitable for searching on Google or DuckDuckGo. You may omit this list if there are no such facts. "
+        "Here is the part:\n\n{content}"
+    )
+)
+
+reduce_prompt = PromptTemplate(
+    input_variables=["summaries", "facts"],
+    template=(
+        "The following are summaries of consecutive parts of one article, in order. "
+        "Combine them into a single comprehensive and detailed summary of the whole article. "
+        "Keep all important points, facts and details, remove repetition, and organize it clearly. "
+        "Also list the 1 or 2 most important facts to verify, each as a clear, searchable string "
+        "suitable for searching on Google or DuckDuckGo. Candidate facts from the parts:\n{facts}\n\n"
+        "Part summaries:\n\n{summaries}"
+    )
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into chunks under `max_tokens`, cutting at paragraph boundaries.
+
+    Paragraphs larger than the budget are cut at sentence ends, and sentences
+    larger than the budget are cut hard.
+    """
+    max_chars = max_tokens * 4
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n|\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > max_chars:
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                pieces.append(sentence)
+
+    chunks = []
+    current = []
+    size = 0
+    for piece in pieces:
+        if current and size + len(piece) + 2 > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class DocumentSummarizer:
+    def __init__(self, model: str = "gemini-2.5-flash", chunk_tokens: int = 6000, direct_tokens: Optional[int] = None,
+                 map_concurrency: int = 4):
+        """
+        Summarize documents of any length into a BlogSummary.
+
+        Short documents take the direct single-call path. Long ones are split at
+        paragraph boundaries, the chunks are summarized in parallel (map), and the
+        chunk summaries are merged (reduce), level by level, until one summary is left.
+
+        Args:
+            model (str): Gemini model for every call
+            chunk_tokens (int): Token budget of one map or reduce prompt's input
+            direct_tokens (int): Documents up to this size are summarized in one call, defaults to chunk_tokens
+            map_concurrency (int): Chunk summaries requested at the same time
+        """
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.direct_tokens = direct_tokens or chunk_tokens
+        self.map_concurrency = map_concurrency
+        self.client = google_structured_output()
+
+    @classmethod
+    def from_env(cls) -> "DocumentSummarizer":
+        """SUMMARY_CHUNK_TOKENS, SUMMARY_DIRECT_TOKENS and SUMMARY_MAP_CONCURRENCY."""
+        direct = os.getenv("SUMMARY_DIRECT_TOKENS")
+        return cls(
+            chunk_tokens=int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000")),
+            direct_tokens=int(direct) if direct else None,
+            map_concurrency=int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4")),
+        )
+
+    def _call(self, prompt: str) -> BlogSummary:
+        return self.client.call_google_structured_output(prompt=prompt, pydantic_model=BlogSummary, model=self.model)
+
+    def summarize(self, content: str) -> BlogSummary:
+        if estimate_tokens(content) <= self.direct_tokens:
+            return self._call(summary_prompt.format(content=content))
+
+        chunks = split_into_chunks(content, self.chunk_tokens)
+        print(f"Summarizing long document in {len(chunks)} chunks")
+        summaries = self._map(
+            [chunk_prompt.format(content=chunk, part=i + 1, parts=len(chunks)) for i, chunk in enumerate(chunks)]
+        )
+        return self._reduce(summaries)
+
+    def _map(self, prompts: List[str]) -> List[BlogSummary]:
+        if len(prompts) == 1:
+            return [self._call(prompts[0])]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.map_concurrency, len(prompts)))) as pool:
+            # Copy the context so stage timings and metrics still reach the current request
+            futures = [pool.submit(contextvars.copy_context().run, self._call, prompt) for prompt in prompts]
+            return [future.result() for future in futures]
+
+    def _reduce(self, summaries: List[BlogSummary]) -> BlogSummary:
+        while len(summaries) > 1:
+            # Group consecutive summaries so each reduce prompt fits the budget
+            groups, current, size = [], [], 0
+            for summary in summaries:
+                tokens = estimate_tokens(summary.summary)
+                if current and size + tokens > self.chunk_tokens:
+                    groups.append(current)
+                    current, size = [], 0
+                current.append(summary)
+                size += tokens
+            groups.append(current)
+
+            if len(groups) == len(summaries) and len(groups) > 1:
+                # Every summary alone fills the budget; pair them up so the loop terminates
+                groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+
+            prompts = []
+            for group in groups:
+                facts = [fact for summary in group for fact in (summary.facts_to_verify or [])]
+                prompts.append(reduce_prompt.format(
+                    summaries="\n\n".join(f"Part {i + 1}:\n{summary.summary}" for i, summary in enumerate(group)),
+                    facts="\n".join(f"- {fact}" for fact in facts) or "(none)",
+                ))
+            summaries = [group[0] if len(group) == 1 else None for group in groups]
+            pending = [prompt for prompt, summary in zip(prompts, summaries) if summary is None]
+            reduced = iter(self._map(pending)) if pending else iter(())
+            summaries = [summary if summary is not None else next(reduced) for summary in summaries]
+        return summaries[0]
@@ -10,17 +10,20 @@ class SearchTool(BaseModel):
     max_results: Optional[int] = Field(10, description="The maximum number of results to return.")
 
 
-search = Search()
+# Search and WebScraper are built when a tool runs, not at import time
+def search_complete(topic: str, max_results: Optional[int] = 10) -> list[dict]:
+    return Search().search_complete(topic, max_results)
+
 
 web_search_tool = StructuredTool(
     name="WebSearch",
     description="Perform a DuckDuckGo search for the given topic and return the complete search results in a structured format.",
-    func=search.search_complete,
+    func=search_complete,
     args_schema=SearchTool,
 )
 # Example
 # results = web_search_tool.invoke({"topic": "Python programming"})
-print(web_search_tool.args)
+# print(web_search_tool.args)
 # print(results)
 
 
@@ -28,12 +31,14 @@ print(web_search_tool.args)
 class WebScraperTool(BaseModel):
     urls: list[str] = Field(..., description="List of URLs to scrape.")
 
-scraper = WebScraper()
+def scrape_multiple_urls(urls: list[str]) -> list[dict]:
+    return WebScraper().scrape_multiple_urls(urls)
+
 
 web_scraper_tool = StructuredTool(
     name="WebScraper",
     description="Scrapes the content of the provided URLs and returns the scraped data in a structured format.",
-    func=scraper.scrape_multiple_urls,
+    func=scrape_multiple_urls,
     args_schema=WebScraperTool,
 )
 
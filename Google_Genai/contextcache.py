@@ -0,0 +1,246 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from Metrics.instrumentation import record_cache_lookup, registry
+
+OFF = "off"
+REUSE = "reuse"
+ALWAYS = "always"
+MODES = (OFF, REUSE, ALWAYS)
+
+# Smallest prefix each model family accepts for explicit caching, in tokens
+MIN_CACHE_TOKENS = {
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 4096,
+}
+DEFAULT_MIN_CACHE_TOKENS = 4096
+
+# Status codes Gemini answers with when a cached content name is unknown or expired
+STALE_CACHE_STATUS = {403, 404}
+
+
+def estimate_tokens(text: str) -> int:
+    # Same rough 4-characters-per-token rule the summarizer uses
+    return len(text) // 4
+
+
+def min_tokens_for(model: str) -> int:
+    for family, tokens in MIN_CACHE_TOKENS.items():
+        if model.startswith(family):
+            return tokens
+    return DEFAULT_MIN_CACHE_TOKENS
+
+
+def is_stale_cache_error(error: Exception, cache_name: Optional[str] = None) -> bool:
+    """Whether a call failed because its cached content is gone, rather than for any other reason."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code in STALE_CACHE_STATUS:
+        return True
+    # Other invalid-argument errors are not about the cache and are not retried inline
+    return code == 400 and bool(cache_name) and cache_name in str(error)
+
+
+class ContextCache:
+    def __init__(self, mode: str = REUSE, ttl: float = 600.0, min_tokens: Optional[int] = None,
+                 max_entries: int = 32, expiry_margin: float = 30.0):
+        """
+        Gemini explicit context caches for prompt prefixes that are sent more than once.
+
+        A prefix (the static instructions plus a research bundle) is uploaded once
+        per model as cached content. Later calls send only the rest of the prompt
+        and reference the cache by name, so the prefix is billed at the cached rate
+        and does not have to be processed again.
+
+        Lifecycle: a cache is created on the second sighting of a prefix in REUSE
+        mode, as long as it comes from a different caller (another post or variant,
+        not a retry of the same call), and on the first in ALWAYS mode. It is reused
+        until `expiry_margin` seconds before its TTL runs out, and then left to
+        expire on the server. When more than
+        `max_entries` caches are live, the oldest is deleted. Caches the server no
+        longer knows are dropped by `invalidate`.
+
+        Args:
+            mode (str): OFF, REUSE or ALWAYS
+            ttl (float): Seconds a cache lives on the server
+            min_tokens (int): Smallest prefix worth caching, defaults to the model's minimum
+            max_entries (int): Live caches kept before the oldest is deleted
+            expiry_margin (float): Seconds before expiry when a cache stops being handed out
+        """
+        self.mode = mode
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self.expiry_margin = expiry_margin
+        self._entries: Dict[Tuple[str, str], Dict] = {}
+        # Who first sent each prefix, and when it was last sent
+        self._sightings: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._creating: Dict[Tuple[str, str], threading.Event] = {}
+        # Prefixes the server refused to cache, not tried again until this time
+        self._refused: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ContextCache":
+        """GEMINI_CONTEXT_CACHE, GEMINI_CONTEXT_CACHE_TTL, GEMINI_CONTEXT_CACHE_MIN_TOKENS and
+        GEMINI_CONTEXT_CACHE_MAX_ENTRIES."""
+        min_tokens = os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS")
+        mode = os.getenv("GEMINI_CONTEXT_CACHE", REUSE).lower()
+        if mode not in MODES:
+            # Caches are billed, so a typo must not turn them on
+            print(f"Unknown GEMINI_CONTEXT_CACHE value {mode!r}, expected one of {', '.join(MODES)}; context caching is off")
+            mode = OFF
+        return cls(
+            mode=mode,
+            ttl=float(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "600")),
+            min_tokens=int(min_tokens) if min_tokens else None,
+            max_entries=int(os.getenv("GEMINI_CONTEXT_CACHE_MAX_ENTRIES", "32")),
+        )
+
+    @staticmethod
+    def key_for(model: str, prefix: str) -> Tuple[str, str]:
+        return model, hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    def lookup(self, model: str, prefix: str, client, caller: str = "") -> Optional[str]:
+        """
+        Name of a live cache holding `prefix` for `model`, creating it when the policy says so.
+
+        Args:
+            model (str): Model the call goes to; caches are per model
+            prefix (str): Leading part of the prompt
+            client: google_structured_output used to create the cache
+            caller (str): What the call is for, e.g. its job and the rest of its prompt. Repeated
+                sightings from the same caller (its retries) do not count towards REUSE
+
+        Returns:
+            str: Cached content name, or None to send the prefix inline
+        """
+        if self.mode == OFF or estimate_tokens(prefix) < (self.min_tokens or min_tokens_for(model)):
+            return None
+        key = self.key_for(model, prefix)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry["uses"] += 1
+                    record_cache_lookup("gemini_context", True)
+                    return entry["name"]
+                if self._refused.get(key, 0.0) > now:
+                    return None
+                creating = self._creating.get(key)
+                if creating is None:
+                    caller_hash = hashlib.sha256(caller.encode("utf-8")).hexdigest()
+                    first_caller = self._sightings.get(key, (caller_hash, now))[0]
+                    self._sightings[key] = (first_caller, now)
+                    if self.mode == REUSE and first_caller == caller_hash:
+                        record_cache_lookup("gemini_context", False)
+                        return None
+                    creating = self._creating[key] = threading.Event()
+                    break
+            # Another call is uploading the same prefix; wait for it instead of uploading twice
+            creating.wait(timeout=30)
+
+        record_cache_lookup("gemini_context", False)
+        try:
+            name = client.create_cache(model=model, contents=prefix, ttl=self.ttl)
+        except Exception as e:
+            print(f"Could not create Gemini context cache for {model}: {e}")
+            with self._lock:
+                self._refused[key] = time.monotonic() + self.ttl
+            return None
+        else:
+            evicted = self._add(key, name, client)
+            for entry in evicted:
+                self._delete(entry)
+            print(f"Created Gemini context cache {name} for {model} (~{estimate_tokens(prefix)} tokens)")
+            return name
+        finally:
+            with self._lock:
+                self._creating.pop(key).set()
+
+    def _add(self, key: Tuple[str, str], name: str, client) -> list:
+        with self._lock:
+            self._entries[key] = {
+                "name": name,
+                "client": client,
+                "expires_at": time.monotonic() + self.ttl,
+                "uses": 1,
+            }
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k]["expires_at"])
+                evicted.append(self._entries.pop(oldest))
+            return evicted
+
+    def _expire(self, now: float) -> None:
+        # Expired caches are already gone on the server; only forget them here
+        for key in [k for k, entry in self._entries.items() if entry["expires_at"] - self.expiry_margin <= now]:
+            del self._entries[key]
+        for key in [k for k, (_, seen) in self._sightings.items() if now - seen > self.ttl]:
+            del self._sightings[key]
+        for key in [k for k, until in self._refused.items() if until <= now]:
+            del self._refused[key]
+
+    def _delete(self, entry: Dict) -> None:
+        try:
+            entry["client"].delete_cache(entry["name"])
+        except Exception as e:
+            print(f"Could not delete Gemini context cache {entry['name']}: {e}")
+
+    def invalidate(self, model: str, prefix: str) -> None:
+        """Forget the cache for a prefix, e.g. after the server reported it unknown."""
+        with self._lock:
+            self._entries.pop(self.key_for(model, prefix), None)
+
+    def clear(self) -> None:
+        """Delete every live cache, e.g. on shutdown, so none is billed until its TTL runs out."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._sightings.clear()
+        for entry in entries:
+            self._delete(entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "live": len(self._entries),
+                "uses": sum(entry["uses"] for entry in self._entries.values()),
+            }
+
+    def render_metrics(self) -> List[str]:
+        stats = self.stats()
+        return [
+            "# HELP gemini_context_caches_live Gemini context caches currently handed out",
+            "# TYPE gemini_context_caches_live gauge",
+            f"gemini_context_caches_live {stats['live']}",
+            "# HELP gemini_context_cache_uses Calls served by the live Gemini context caches",
+            "# TYPE gemini_context_cache_uses gauge",
+            f"gemini_context_cache_uses {stats['uses']}",
+        ]
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_context_cache() -> ContextCache:
+    """
+    Return the process-wide context cache configured from the environment.
+
+    GEMINI_CONTEXT_CACHE: "reuse" (default) caches a prefix once a second post or variant sends it,
+        "always" caches it on first use, "off" never caches
+    GEMINI_CONTEXT_CACHE_TTL: seconds a cache lives (default: 600)
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS: smallest prefix cached (default: the model's minimum)
+    GEMINI_CONTEXT_CACHE_MAX_ENTRIES: live caches kept (default: 32)
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ContextCache.from_env()
+            registry.register_collector(_default_cache.render_metrics)
+        return _default_cache
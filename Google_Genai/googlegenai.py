@@ -1,32 +1,237 @@
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+from pydantic import Field, ValidationError, create_model
+from Metrics.instrumentation import record_gemini_call, record_gemini_repair
+from Metrics.tokens import record_tokens
+from Google_Genai.resilience import RetryPolicy, OutputParseError, IncompleteOutputError, call_with_retry
+from Google_Genai.contextcache import get_context_cache, is_stale_cache_error
+from Google_Genai.repair import repair_json, trim_truncated
+from Server.backend import current_job_id, shared_cache
+from Metrics.cancellation import check_cancelled
 load_dotenv()
+import json
 import os
+import time
+
+
+def _supports_thinking(model: str) -> bool:
+    # Only 2.5 and later models accept a thinking config; fallbacks may be older
+    return not model.startswith(("gemini-1.", "gemini-2.0"))
+
+
+# Follow-up call that fills in fields missing from an otherwise usable output
+fill_prompt = (
+    "An earlier answer was cut short. These fields of it are final:\n{present}\n\n"
+    "Write only the missing fields ({missing}), consistent with the fields above."
+)
+# Characters of each recovered field shown to the follow-up call
+FILL_CONTEXT_CHARS = 6000
+FILL_MAX_TOKENS = 1024
 
 
 class google_structured_output:
-    def __init__(self):
-        pass
+    def __init__(self, retry_policy: RetryPolicy = None, repair: bool = None):
+        """
+        Args:
+            retry_policy (RetryPolicy): Retries, backoff and model fallback, defaults to GEMINI_* settings
+            repair (bool): Repair truncated or malformed JSON before retrying, defaults to GEMINI_REPAIR
+                ("on" unless set to "off")
+        """
+        self.retry_policy = retry_policy or RetryPolicy.from_env()
+        self.repair = repair if repair is not None else os.getenv("GEMINI_REPAIR", "on").lower() != "off"
     
-    def call_google_structured_output(self, prompt, pydantic_model, model="gemini-2.5-flash", max_tokens=15000, temperature=0.7, thinking_budget=0):
-        client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+    def call_google_structured_output(self, prompt, pydantic_model, model="gemini-2.5-flash", max_tokens=15000, temperature=0.7, thinking_budget=0, require_complete=False, cached_prefix=None, fillable_fields=()):
+        """
+        Generate structured output, retrying transient failures and falling back to other models.
+
+        Args:
+            require_complete (bool): Treat a result with an empty required field as a failure and retry
+            cached_prefix (str): Leading part of the prompt, sent before `prompt`, that is likely to be
+                sent again (static instructions, shared research). Served from a Gemini context cache
+                when the GEMINI_CONTEXT_CACHE policy allows
+            fillable_fields (tuple): Small fields (e.g. tags, excerpt) that, when they are all that is
+                missing, are written by a short follow-up call instead of regenerating everything
+        """
+        # A queued job handed to a new worker after its first one died reuses the outputs it already paid for.
+        # The research prefix is left out of the key: a re-run scrapes slightly different text, but a
+        # post already written from the first run's research is just as good an answer for this job
+        job_id = current_job_id()
+        checkpoints = shared_cache("gemini_checkpoint", "JOB_CHECKPOINT_TTL", 3600) if job_id else None
+        checkpoint = (job_id, model, pydantic_model.__name__, str(prompt))
+        if checkpoints:
+            saved = checkpoints.get(*checkpoint)
+            if saved is not None:
+                return pydantic_model.model_validate(saved)
+
+        result = call_with_retry(
+            lambda candidate: self._call_once(prompt, pydantic_model, candidate, max_tokens, temperature, thinking_budget, require_complete, cached_prefix, fillable_fields),
+            model,
+            self.retry_policy,
+        )
+        if checkpoints:
+            checkpoints.set(result.model_dump(mode="json"), *checkpoint)
+        return result
+
+    def _call_once(self, prompt, pydantic_model, model, max_tokens, temperature, thinking_budget, require_complete, cached_prefix=None, fillable_fields=(), repair=True):
+        # Every attempt, retry, fallback and repair call is a cancellation point
+        check_cancelled("gemini")
         config = types.GenerateContentConfig(
         response_mime_type="application/json",
         response_schema=pydantic_model,
         temperature=temperature,
         max_output_tokens=max_tokens,
-        thinking_config=types.ThinkingConfig(thinking_budget=thinking_budget)
+        thinking_config=types.ThinkingConfig(thinking_budget=thinking_budget) if _supports_thinking(model) else None
         )
 
-        response = client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=config,
+        contents = prompt
+        if cached_prefix:
+            # Retries of this call send the same job and prompt, and are not a reason to cache the prefix
+            cache_name = get_context_cache().lookup(model, cached_prefix, self, caller=f"{current_job_id()}\n{prompt}")
+            if cache_name:
+                config.cached_content = cache_name
+            else:
+                contents = cached_prefix + prompt
+
+        start = time.perf_counter()
+        try:
+            response = self.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            record_gemini_call(model, time.perf_counter() - start, None, None, success=False)
+            if not config.cached_content or not is_stale_cache_error(e, config.cached_content):
+                raise
+            # The cache expired or was deleted on the server; send the prefix inline instead
+            print(f"Gemini context cache {config.cached_content} unusable ({e}), sending the prompt inline")
+            get_context_cache().invalidate(model, cached_prefix)
+            config.cached_content = None
+            start = time.perf_counter()
+            try:
+                response = self.generate_content(model=model, contents=cached_prefix + prompt, config=config)
+            except Exception:
+                record_gemini_call(model, time.perf_counter() - start, None, None, success=False)
+                raise
+
+        usage = getattr(response, "usage_metadata", None)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        record_gemini_call(
+            model,
+            time.perf_counter() - start,
+            getattr(usage, "prompt_token_count", None),
+            output_tokens,
+            cached_tokens=getattr(usage, "cached_content_token_count", None),
         )
+        # Rolled up per stage, and per job when the call runs inside track_tokens()
+        record_tokens(getattr(usage, "prompt_token_count", None), output_tokens,
+                      getattr(usage, "cached_content_token_count", None))
+        # Cancelled while the call was in flight: the tokens are spent, but no repair or retry follows
+        check_cancelled("gemini")
 
         try:
             validated = response.parsed 
-            return validated
         except Exception as e:
-            raise ValueError(f"Error parsing Gemini output: {e}\nRaw output: {response.text}")
\ No newline at end of file
+            validated, error = None, OutputParseError(f"Error parsing Gemini output: {e}\nRaw output: {response.text}")
+        else:
+            error = OutputParseError(f"Error parsing Gemini output: no parsed result\nRaw output: {response.text}")
+
+        if validated is None:
+            if not (self.repair and repair):
+                raise error
+            return self._repair(response.text, error, pydantic_model, model, temperature, require_complete,
+                                fillable_fields, output_tokens)
+
+        if require_complete:
+            missing = [name for name, field in pydantic_model.model_fields.items()
+                       if field.is_required() and not getattr(validated, name, None)]
+            if missing:
+                error = IncompleteOutputError(f"Model returned incomplete {pydantic_model.__name__}, missing: {', '.join(missing)}")
+                if not (self.repair and repair):
+                    raise error
+                return self._repair(validated.model_dump_json(), error, pydantic_model, model, temperature,
+                                    require_complete, fillable_fields, output_tokens)
+
+        return validated
+
+    def _repair(self, text, error, pydantic_model, model, temperature, require_complete, fillable_fields, output_tokens):
+        """
+        Salvage an unparseable or incomplete output instead of regenerating it.
+
+        Truncated or slightly malformed JSON is repaired; a string field cut off mid-way
+        is kept up to its last complete paragraph. When only `fillable_fields` are still
+        missing, a short follow-up call writes them. Raises `error` when the output cannot
+        be saved, so the retry policy regenerates it as before.
+        """
+        data, truncated_key = repair_json(text)
+        if data is None:
+            record_gemini_repair(model, "failed")
+            raise error
+        if truncated_key is not None and isinstance(data.get(truncated_key), str):
+            trimmed = trim_truncated(data[truncated_key])
+            if trimmed is None:
+                del data[truncated_key]
+            else:
+                data[truncated_key] = trimmed
+
+        missing = [name for name, field in pydantic_model.model_fields.items()
+                   if field.is_required() and (name not in data or (require_complete and not data[name]))]
+        fill_tokens = 0
+        if missing:
+            if any(name not in fillable_fields for name in missing) or not any(data.get(name) for name in pydantic_model.model_fields):
+                record_gemini_repair(model, "failed")
+                raise error
+            try:
+                filled = self._fill_missing(data, missing, pydantic_model, model, temperature)
+            except Exception as e:
+                print(f"Could not fill {', '.join(missing)} for {pydantic_model.__name__}: {e}")
+                record_gemini_repair(model, "failed")
+                raise error
+            data.update(filled)
+            fill_tokens = len(json.dumps(filled)) // 4
+
+        try:
+            validated = pydantic_model.model_validate(data)
+        except ValidationError:
+            record_gemini_repair(model, "failed")
+            raise error
+
+        # A retry would have generated roughly the same number of tokens again
+        saved = max(0, (output_tokens or len(text) // 4) - fill_tokens)
+        record_gemini_repair(model, "filled" if missing else "json", saved)
+        print(f"Repaired {pydantic_model.__name__} from {model}" + (f", filled {', '.join(missing)}" if missing else "")
+              + f" (~{saved} tokens not regenerated)")
+        return validated
+
+    def _fill_missing(self, data, missing, pydantic_model, model, temperature):
+        """Ask for just the missing fields, showing the model what was already written."""
+        fields = {name: (pydantic_model.model_fields[name].annotation,
+                         Field(..., description=pydantic_model.model_fields[name].description))
+                  for name in missing}
+        partial_model = create_model(f"{pydantic_model.__name__}Missing", **fields)
+        present = {name: value[:FILL_CONTEXT_CHARS] if isinstance(value, str) else value
+                   for name, value in data.items() if value}
+        prompt = fill_prompt.format(present=json.dumps(present, indent=2), missing=", ".join(missing))
+        # One attempt without repair of its own: on failure the whole output is regenerated
+        partial = self._call_once(prompt, partial_model, model, FILL_MAX_TOKENS, temperature, 0, True, repair=False)
+        return partial.model_dump()
+
+    def generate_content(self, model, contents, config):
+        """Send one generate_content request to Gemini. Benchmarks replace this with a local fake."""
+        client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        return client.models.generate_content(
+            model=model,
+            contents=contents,
+            config=config,
+        )
+
+    def create_cache(self, model, contents, ttl):
+        """Upload a prompt prefix as Gemini cached content living `ttl` seconds and return its name."""
+        client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        cache = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(contents=contents, ttl=f"{int(ttl)}s"),
+        )
+        return cache.name
+
+    def delete_cache(self, name):
+        """Delete Gemini cached content before its TTL runs out."""
+        client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        client.caches.delete(name=name)
\ No newline at end of file
@@ -0,0 +1,137 @@
+import json
+import re
+from typing import List, Optional, Tuple
+
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_PARTIAL_UNICODE = re.compile(r"(\\+)u[0-9a-fA-F]{0,3}$")
+
+# Cut-off string values shorter than this are dropped rather than kept truncated
+MIN_TRUNCATED_CHARS = 500
+
+
+def _drop(text: str, positions: List[int]) -> str:
+    """`text` without the characters at `positions` (ascending), e.g. trailing commas."""
+    parts, last = [], 0
+    for pos in positions:
+        if pos >= len(text):
+            break
+        parts.append(text[last:pos])
+        last = pos + 1
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+def _close(text: str, stack: List[str], in_string: bool) -> str:
+    closed = text + ('"' if in_string else "")
+    closed = closed.rstrip().rstrip(",")
+    return closed + "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+
+def repair_json(text: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Parse a JSON object that may be truncated or slightly malformed.
+
+    Handles Markdown code fences, trailing commas and output cut off part-way
+    (unterminated strings, unclosed objects and arrays, a dangling key). A value
+    cut off mid-string is kept as far as it got.
+
+    Returns:
+        (dict, str): The parsed object (None when nothing could be recovered) and the
+            top-level key whose string value was cut off, if any
+    """
+    text = _FENCE.sub("", text or "").strip()
+    start = text.find("{")
+    if start < 0:
+        return None, None
+    text = text[start:]
+    try:
+        data = json.loads(text)
+        return (data, None) if isinstance(data, dict) else (None, None)
+    except json.JSONDecodeError:
+        pass
+
+    # Walk the text once, remembering the nesting and the last top-level key, every
+    # point right after a complete value where the text could be cut, and the commas
+    # right before a closing bracket (outside strings, where a comma is content)
+    stack: List[str] = []
+    in_string = escaped = False
+    string_start = 0
+    last_key: Optional[str] = None
+    expecting_key = False
+    cut_points: List[Tuple[int, List[str]]] = []
+    last_comma: Optional[int] = None
+    trailing_commas: List[int] = []
+    for i, ch in enumerate(text):
+        if not in_string and not ch.isspace():
+            if ch in "}]" and last_comma is not None:
+                trailing_commas.append(last_comma)
+            last_comma = None
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                if expecting_key and len(stack) == 1:
+                    last_key = text[string_start + 1:i]
+                elif not expecting_key:
+                    cut_points.append((i + 1, list(stack)))
+            continue
+        if ch == '"':
+            in_string = True
+            string_start = i
+        elif ch in "{[":
+            stack.append(ch)
+            expecting_key = ch == "{"
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            cut_points.append((i + 1, list(stack)))
+            expecting_key = False
+        elif ch == ",":
+            expecting_key = bool(stack) and stack[-1] == "{"
+            last_comma = i
+        elif ch == ":":
+            expecting_key = False
+
+    # Only a top-level string value is worth keeping half-written; a cut-off key or
+    # list item is dropped by falling back to the last complete value
+    truncated_key = last_key if in_string and not expecting_key and len(stack) == 1 else None
+    # Don't leave half an escape sequence before the closing quote
+    if in_string and escaped:
+        text = text[:-1]
+    elif in_string:
+        partial = _PARTIAL_UNICODE.search(text)
+        if partial and len(partial.group(1)) % 2 == 1:
+            text = text[:partial.end(1) - 1]
+    candidates = []
+    if truncated_key is not None or not in_string:
+        candidates.append((_close(_drop(text, trailing_commas), stack, in_string), truncated_key))
+    candidates += [(_close(_drop(text[:pos], trailing_commas), list(open_stack), False), None)
+                   for pos, open_stack in reversed(cut_points[-20:])]
+    for candidate, cut_key in candidates:
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data, cut_key
+    return None, None
+
+
+def trim_truncated(value: str) -> Optional[str]:
+    """
+    Cut a string value that was truncated mid-way back to its last complete paragraph.
+
+    Returns None when too little is left to be worth keeping.
+    """
+    if len(value) < MIN_TRUNCATED_CHARS:
+        return None
+    cut = value.rfind("\n\n")
+    if cut < len(value) // 2:
+        cut = max(value.rfind(". "), value.rfind(".\n"))
+        cut = cut + 1 if cut >= 0 else -1
+    if cut < len(value) // 2:
+        return None
+    return value[:cut].rstrip()
@@ -0,0 +1,262 @@
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+
+from Metrics.instrumentation import record_gemini_retry
+from Metrics.deadline import current_deadline
+from Metrics.cancellation import cancellable_sleep
+
+
+# HTTP status codes worth retrying on the same model
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Status codes where the model itself is unusable, so go straight to the next one
+FALLBACK_STATUS = {404}
+
+RETRY = "retry"
+FALLBACK = "fallback"
+FATAL = "fatal"
+
+
+class OutputParseError(ValueError):
+    """Gemini answered, but the output could not be parsed into the requested model."""
+
+
+class IncompleteOutputError(ValueError):
+    """Gemini answered with a parsed object that is missing required content."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Every candidate model has its circuit breaker open."""
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Decide how to react to a failed Gemini call.
+
+    Returns:
+        str: RETRY (back off and try the same model), FALLBACK (move to the next model)
+             or FATAL (re-raise, retrying cannot help)
+    """
+    if isinstance(error, (OutputParseError, IncompleteOutputError)):
+        return RETRY
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int):
+        if code in RETRYABLE_STATUS:
+            return RETRY
+        if code in FALLBACK_STATUS:
+            return FALLBACK
+        return FATAL
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return RETRY
+    # Transport errors of the HTTP clients used by google-genai
+    if type(error).__module__.split(".")[0] in ("httpx", "httpcore", "aiohttp", "requests", "urllib3"):
+        return RETRY
+    return FATAL
+
+
+def counts_against_model(error: Exception) -> bool:
+    """Whether a failure says something about the model's health (parse problems don't)."""
+    return not isinstance(error, (OutputParseError, IncompleteOutputError))
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the server's requested wait from the error, if it sent one."""
+    value = getattr(error, "retry_after", None)
+    if value is not None:
+        return float(value)
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        header = headers.get("retry-after")
+        if header:
+            try:
+                return float(header)
+            except ValueError:
+                pass
+
+    # Gemini puts a google.rpc.RetryInfo entry with e.g. "retryDelay": "32s" in the error details
+    details = getattr(error, "details", None)
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?([\d.]+)s", str(details)) if details else None
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        """
+        Stop sending requests to a model after repeated failures.
+
+        After `failure_threshold` consecutive failures the circuit opens for `cooldown`
+        seconds. Then one trial request is let through; success closes the circuit,
+        failure opens it again.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            cooldown (float): Seconds to stay open before a trial request
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """End a trial request that had no outcome, e.g. was cancelled, without counting a failure."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(model: str) -> CircuitBreaker:
+    """Process-wide circuit breaker for a model, configured from the environment."""
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(
+                failure_threshold=int(os.getenv("GEMINI_CIRCUIT_FAILURE_THRESHOLD", "5")),
+                cooldown=float(os.getenv("GEMINI_CIRCUIT_COOLDOWN", "30")),
+            )
+        return _breakers[model]
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 4, backoff_base: float = 2.0, backoff_max: float = 60.0,
+                 fallback_models: Optional[List[str]] = None):
+        """
+        How Gemini calls are retried.
+
+        Args:
+            max_attempts (int): Attempts per model before falling back to the next one
+            backoff_base (float): First backoff in seconds, doubled on each attempt
+            backoff_max (float): Upper bound of a single backoff
+            fallback_models (list): Ordered chain of models. A call falls back to the models
+                listed after the requested one, or to the whole chain if it is not listed
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.fallback_models = fallback_models or []
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        chain = os.getenv("GEMINI_FALLBACK_MODELS", "")
+        return cls(
+            max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", "4")),
+            backoff_base=float(os.getenv("GEMINI_BACKOFF_BASE", "2")),
+            backoff_max=float(os.getenv("GEMINI_BACKOFF_MAX", "60")),
+            fallback_models=[model.strip() for model in chain.split(",") if model.strip()],
+        )
+
+    def models_for(self, model: str) -> List[str]:
+        if model in self.fallback_models:
+            rest = self.fallback_models[self.fallback_models.index(model) + 1:]
+        else:
+            rest = self.fallback_models
+        return [model] + [candidate for candidate in rest if candidate != model]
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Exponential backoff with full jitter, never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+
+def call_with_retry(call: Callable[[str], object], model: str, policy: RetryPolicy):
+    """
+    Run `call(model)` under the retry policy, falling back along the model chain.
+
+    Args:
+        call (Callable): Performs one attempt against the given model
+        model (str): Requested model
+        policy (RetryPolicy): Attempts, backoff and fallback chain
+
+    Returns:
+        The first successful result of `call`
+    """
+    last_error = None
+    for candidate in policy.models_for(model):
+        breaker = get_circuit_breaker(candidate)
+        if not breaker.allow():
+            print(f"Circuit open for {candidate}, skipping")
+            continue
+        if candidate != model:
+            print(f"Falling back to {candidate}")
+            record_gemini_retry(candidate, "fallback")
+
+        try:
+            for attempt in range(policy.max_attempts):
+                try:
+                    result = call(candidate)
+                    breaker.record_success()
+                    return result
+                except Exception as e:
+                    last_error = e
+                    kind = classify_error(e)
+                    if counts_against_model(e):
+                        breaker.record_failure()
+                    else:
+                        # The model itself answered; let a half-open circuit close
+                        breaker.record_success()
+                    if kind == FATAL:
+                        raise
+                    if kind == FALLBACK or attempt == policy.max_attempts - 1 or not breaker.allow():
+                        print(f"Giving up on {candidate}: {e}")
+                        break
+                    delay = policy.backoff(attempt, e)
+                    budget = current_deadline()
+                    if budget is not None and budget.remaining() < delay:
+                        # Waiting would blow the request's deadline; let the caller fall back now
+                        budget.degrade("gemini", "no_retry", f"{candidate} failed with {max(budget.remaining(), 0.0):.1f}s left")
+                        raise
+                    print(f"Gemini call to {candidate} failed ({e}). Retrying in {delay:.1f} seconds...")
+                    record_gemini_retry(candidate, type(e).__name__)
+                    # Wakes up as soon as the run is cancelled
+                    cancellable_sleep(delay, "gemini")
+        except BaseException:
+            # Cancelled or given up on part-way: a trial request left in flight would keep the circuit shut for good
+            breaker.release_trial()
+            raise
+
+    if last_error is not None:
+        raise last_error
+    raise CircuitOpenError(f"No Gemini model available, circuits open for: {', '.join(policy.models_for(model))}")
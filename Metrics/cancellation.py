@@ -0,0 +1,158 @@
+import functools
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from Metrics.instrumentation import record_cancellation
+
+# Why a run was cancelled, as reported in errors and pipeline_cancellations_total
+DISCONNECTED = "client_disconnected"
+REQUESTED = "cancel_requested"
+
+
+class Cancelled(BaseException):
+    """
+    Raised at the next cancellation point of a cancelled run.
+
+    A BaseException, like asyncio.CancelledError, so that the pipelines' broad
+    `except Exception` fallbacks let it through instead of turning it into an
+    empty result or a retry.
+    """
+
+
+class CancelToken:
+    def __init__(self, job_id: Optional[str] = None, counted: bool = True):
+        """
+        Cooperative cancellation flag for one pipeline run.
+
+        Set from any thread; the run notices at its next cancellation point
+        (check_cancelled) and unwinds with Cancelled.
+
+        Args:
+            job_id (str): Id the run can be cancelled by, for logs
+            counted (bool): Count the cancellation in pipeline_cancellations_total; off for
+                tokens that only forward it to where the run happens
+        """
+        self.job_id = job_id
+        self.counted = counted
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._future: Future = Future()
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = REQUESTED) -> bool:
+        """Cancel the run. False when it was already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+        self._future.set_result(reason)
+        if self.counted:
+            record_cancellation(reason)
+        print(f"Cancelling job {self.job_id or '(unnamed)'}: {reason}")
+        return True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def future(self) -> Future:
+        """A future resolved on cancellation, to wait on alongside other futures."""
+        return self._future
+
+    def check(self, where: str = "") -> None:
+        if self._event.is_set():
+            raise Cancelled(f"Job {self.job_id or '(unnamed)'} cancelled ({self.reason})" + (f" during {where}" if where else ""))
+
+    def sleep(self, seconds: float, where: str = "") -> None:
+        """time.sleep that wakes up and raises Cancelled as soon as the run is cancelled."""
+        self._event.wait(seconds)
+        self.check(where)
+
+
+_current_token: ContextVar[Optional[CancelToken]] = ContextVar("cancel_token", default=None)
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    """Make `token` the cancel token of everything run inside the block (and in threads started with a copy of the context)."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+def check_cancelled(where: str = "") -> None:
+    """A cancellation point: raise Cancelled when the current run was cancelled; no-op outside a run."""
+    token = _current_token.get()
+    if token is not None:
+        token.check(where)
+
+
+def cancellable_sleep(seconds: float, where: str = "") -> None:
+    """time.sleep that wakes up and raises Cancelled as soon as the current run is cancelled; plain sleep outside a run."""
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds, where)
+
+
+def run_cancellable(token: CancelToken, func, *args):
+    """Call func(*args) under `token`; for handing a run to another thread."""
+    with cancel_scope(token):
+        return func(*args)
+
+
+def cancellation_point(where: str, func):
+    """Wrap a pipeline step so a cancelled run stops before it, e.g. between graph nodes."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        check_cancelled(where)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+# Runs in this process that can be cancelled by id
+_active: Dict[str, CancelToken] = {}
+_active_lock = threading.Lock()
+
+
+def register(job_id: str, counted: bool = True) -> CancelToken:
+    """
+    Create the cancel token of a run and make it reachable by `job_id` until unregister().
+
+    Raises:
+        ValueError: When a run with this id is already registered in this process
+    """
+    token = CancelToken(job_id, counted)
+    with _active_lock:
+        if job_id in _active:
+            raise ValueError(f"Job {job_id} is already running")
+        _active[job_id] = token
+    return token
+
+
+def unregister(job_id: str) -> None:
+    with _active_lock:
+        _active.pop(job_id, None)
+
+
+def cancel(job_id: str, reason: str = REQUESTED) -> bool:
+    """Cancel the run registered under `job_id` in this process. False when there is none."""
+    with _active_lock:
+        token = _active.get(job_id)
+    if token is None:
+        return False
+    token.cancel(reason)
+    return True
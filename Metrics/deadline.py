@@ -0,0 +1,187 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from Metrics.instrumentation import add_stage_listener
+
+
+# Cold-start guesses, used until a stage has been observed in this process
+DEFAULT_STAGE_SECONDS = {
+    "planning": 4.0,
+    "search": 3.0,
+    "scrape": 8.0,
+    "summarize_document": 8.0,
+    "verify_fact": 6.0,
+    "generate": 20.0,
+    "html": 0.2,
+    "image": 5.0,
+}
+
+
+class LatencyEstimator:
+    def __init__(self, alpha: float = 0.3, defaults: Optional[Dict[str, float]] = None):
+        """
+        Live per-stage latency estimates, as exponentially weighted moving averages.
+
+        Registered as a stage listener, so every stage() in the process feeds it.
+        Per-item steps (one summary, one fact check) are fed with observe().
+
+        Args:
+            alpha (float): Weight of the newest observation
+            defaults (dict): Estimates for stages not observed yet
+        """
+        self.alpha = alpha
+        self.defaults = dict(DEFAULT_STAGE_SECONDS if defaults is None else defaults)
+        self._estimates: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            previous = self._estimates.get(name)
+            self._estimates[name] = seconds if previous is None else (1 - self.alpha) * previous + self.alpha * seconds
+
+    def estimate(self, name: str) -> float:
+        with self._lock:
+            return self._estimates.get(name, self.defaults.get(name, 1.0))
+
+    def stage_started(self, name: str) -> None:
+        pass
+
+    def stage_finished(self, name: str, seconds: float) -> None:
+        self.observe(name, seconds)
+
+
+latency_estimator = LatencyEstimator()
+add_stage_listener(latency_estimator)
+
+# Model used for generation when the default one is not expected to finish in time
+DEADLINE_FAST_MODEL = os.getenv("DEADLINE_FAST_MODEL", "gemini-2.0-flash-lite")
+
+
+class DeadlineBudget:
+    def __init__(self, deadline_seconds: float, estimator: Optional[LatencyEstimator] = None):
+        """
+        A request's latency budget, and the record of what was degraded to meet it.
+
+        Args:
+            deadline_seconds (float): Seconds the caller is willing to wait for the post
+            estimator (LatencyEstimator): Stage estimates to plan with, defaults to the shared one
+        """
+        self.deadline_seconds = deadline_seconds
+        self.estimator = estimator or latency_estimator
+        self.started = time.perf_counter()
+        self.degradations: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def remaining(self) -> float:
+        return self.deadline_seconds - self.elapsed()
+
+    def estimate(self, *names: str) -> float:
+        return sum(self.estimator.estimate(name) for name in names)
+
+    def time_for(self, reserve: Iterable[str] = ()) -> float:
+        """Seconds left after keeping the estimated time of the `reserve` stages aside."""
+        return self.remaining() - self.estimate(*reserve)
+
+    def can_afford(self, *names: str, reserve: Iterable[str] = ()) -> bool:
+        """Whether `names` are expected to finish with time left for the `reserve` stages."""
+        return self.time_for(reserve) >= self.estimate(*names)
+
+    def fit_count(self, count: int, names: Iterable[str], reserve: Iterable[str] = (), stage: str = "",
+                  what: str = "sources", minimum: int = 1) -> int:
+        """
+        Scale `count` down so the `names` stages fit in the time left after `reserve`.
+
+        Assumes those stages take time in proportion to how many items they handle.
+        """
+        needed = self.estimate(*names)
+        available = self.time_for(reserve)
+        if needed <= 0 or available >= needed:
+            return count
+        fitted = max(minimum, min(count, int(count * max(available, 0.0) / needed)))
+        if fitted < count:
+            self.degrade(stage, f"fewer_{what}", f"{count} -> {fitted}")
+        return fitted
+
+    def time_box(self, default: float, reserve: Iterable[str] = (), stage: str = "", minimum: float = 1.0) -> float:
+        """A stage's time limit: `default`, or less when only that much is left after `reserve`."""
+        available = max(minimum, self.time_for(reserve))
+        if available >= default:
+            return default
+        self.degrade(stage, "time_boxed", f"{available:.1f}s instead of {default:.1f}s")
+        return available
+
+    def degrade(self, stage: str, action: str, detail: str) -> None:
+        print(f"Deadline: {stage} {action} ({detail})")
+        with self._lock:
+            self.degradations.append({"stage": stage, "action": action, "detail": detail})
+
+    def report(self) -> Dict:
+        with self._lock:
+            degraded = list(self.degradations)
+        elapsed = self.elapsed()
+        return {
+            "deadline_seconds": self.deadline_seconds,
+            "elapsed_seconds": round(elapsed, 3),
+            "met": elapsed <= self.deadline_seconds,
+            "degraded": degraded,
+        }
+
+
+_current_deadline: ContextVar[Optional[DeadlineBudget]] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def track_deadline(deadline_seconds: Optional[float]):
+    """
+    Plan everything run inside the block around a latency budget.
+
+    Yields None, and changes nothing, when deadline_seconds is None.
+    """
+    if deadline_seconds is None:
+        yield None
+        return
+    budget = DeadlineBudget(deadline_seconds)
+    token = _current_deadline.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[DeadlineBudget]:
+    return _current_deadline.get()
+
+
+def model_for(stage: str, default: str, reserve: Iterable[str] = ()) -> str:
+    """The model to call for a stage: `default`, or DEADLINE_FAST_MODEL when the deadline is too close."""
+    budget = current_deadline()
+    if budget is None or default == DEADLINE_FAST_MODEL or budget.can_afford(stage, reserve=reserve):
+        return default
+    budget.degrade(stage, "faster_model", f"{default} -> {DEADLINE_FAST_MODEL}")
+    return DEADLINE_FAST_MODEL
+
+
+def run_time_boxed(func: Callable, seconds: float, *args) -> Tuple[bool, object]:
+    """
+    Run func(*args) for at most `seconds`.
+
+    Returns (True, result), or (False, None) when time ran out. The call keeps
+    running in its thread after a timeout, but nobody waits for it.
+    """
+    pool = ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(contextvars.copy_context().run, func, *args)
+    try:
+        return True, future.result(timeout=seconds)
+    except FutureTimeoutError:
+        return False, None
+    finally:
+        pool.shutdown(wait=False)
@@ -0,0 +1,368 @@
+import os
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        """
+        Monotonic counter, rendered in the Prometheus text format.
+
+        Args:
+            name (str): Metric name
+            documentation (str): HELP text
+            labelnames (tuple): Label names, values are passed positionally to inc()
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(tuple(str(label) for label in labels), 0.0)
+
+    def items(self) -> Dict[Tuple[str, ...], float]:
+        """Current value of every label combination."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Cumulative histogram, rendered in the Prometheus text format.
+
+        Args:
+            name (str): Metric name
+            documentation (str): HELP text
+            labelnames (tuple): Label names, values are passed positionally to observe()
+            buckets (tuple): Upper bounds of the buckets, +Inf is added automatically
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], Dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self, *labels) -> Optional[Dict]:
+        """Return a copy of the count and sum for one label set, or None if never observed."""
+        with self._lock:
+            series = self._series.get(tuple(str(label) for label in labels))
+            return {"sum": series["sum"], "count": series["count"]} if series else None
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Collection of metrics exposed together on the /metrics route."""
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector) -> None:
+        """Add a callable returning already formatted metric lines, computed at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "blog_stage_duration_seconds", "Wall time spent in each pipeline stage", ("stage",))
+GEMINI_REQUESTS = registry.counter(
+    "gemini_requests_total", "Gemini generate_content calls by model and outcome", ("model", "status"))
+GEMINI_TOKENS = registry.counter(
+    "gemini_tokens_total", "Gemini tokens by model and direction (input/output, and cached: input served from a context cache)", ("model", "direction"))
+STAGE_TOKENS = registry.counter(
+    "gemini_stage_tokens_total", "Gemini tokens by pipeline stage and direction (input/output/cached)", ("stage", "direction"))
+GEMINI_RETRIES = registry.counter(
+    "gemini_retries_total", "Gemini retries and model fallbacks by model and reason", ("model", "reason"))
+GEMINI_REPAIRS = registry.counter(
+    "gemini_repairs_total", "Unparseable or incomplete Gemini outputs by model and repair outcome (json/filled/failed)",
+    ("model", "outcome"))
+GEMINI_REPAIR_SAVED_TOKENS = registry.counter(
+    "gemini_repair_saved_tokens_total", "Estimated output tokens not regenerated thanks to repairs", ("model",))
+GEMINI_LATENCY = registry.histogram(
+    "gemini_request_duration_seconds", "Latency of Gemini generate_content calls", ("model",))
+SCRAPE_REQUESTS = registry.counter(
+    "scrape_requests_total", "Scraped URLs by domain and outcome", ("domain", "status"))
+SCRAPE_BYTES = registry.counter(
+    "scrape_bytes_total", "Response bytes downloaded by the scraper per domain", ("domain",))
+BOILERPLATE_TOKENS = registry.counter(
+    "boilerplate_tokens_removed_total", "Estimated tokens of repeated per-domain boilerplate stripped from scraped pages",
+    ("domain",))
+CACHE_LOOKUPS = registry.counter(
+    "cache_lookups_total", "Cache lookups by cache name and result (hit/miss)", ("cache", "result"))
+JOB_EVENTS = registry.counter(
+    "blog_jobs_total", "Queued jobs by kind and event (enqueued/completed/failed/cancelled/redelivered/dead)", ("kind", "event"))
+CANCELLATIONS = registry.counter(
+    "pipeline_cancellations_total", "Pipeline runs cancelled, by reason (client_disconnected/cancel_requested)", ("reason",))
+ADMISSIONS = registry.counter(
+    "admission_decisions_total", "Pipeline runs admitted at once, queued or rejected, by method", ("method", "outcome"))
+
+
+class RequestTimings:
+    def __init__(self):
+        """Per-request breakdown of stage wall times (and other per-request counts), returned with the API response."""
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage_name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            stages = {name: round(seconds, 3) for name, seconds in self.stages.items()}
+            counters = dict(self.counters)
+        result = {
+            "total_seconds": round(time.perf_counter() - self.started, 3),
+            "stages": stages,
+        }
+        if counters:
+            result["counters"] = counters
+        return result
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def track_request():
+    """
+    Collect stage timings for everything run inside the block.
+
+    The RequestTimings object is shared by reference, so threads started with a
+    copy of the current context report into the same breakdown.
+    """
+    timings = RequestTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+
+_current_stage: ContextVar[Optional[str]] = ContextVar("pipeline_stage", default=None)
+
+
+def current_stage() -> Optional[str]:
+    """Name of the innermost stage() the caller runs in, None outside any."""
+    return _current_stage.get()
+
+
+_stage_listeners = []
+
+
+def add_stage_listener(listener) -> None:
+    """
+    Register an object notified around every stage.
+
+    The listener must provide stage_started(name) and stage_finished(name, seconds).
+    Used by the benchmark harness to attribute memory to stages.
+    """
+    _stage_listeners.append(listener)
+
+
+def remove_stage_listener(listener) -> None:
+    if listener in _stage_listeners:
+        _stage_listeners.remove(listener)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage into the stage histogram and the current request breakdown."""
+    for listener in list(_stage_listeners):
+        listener.stage_started(name)
+    start = time.perf_counter()
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+        for listener in list(_stage_listeners):
+            listener.stage_finished(name, elapsed)
+
+
+def timed(stage_name: str, func):
+    """Wrap a pipeline step so every call is recorded as the given stage."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(stage_name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def record_gemini_call(model: str, latency: float, input_tokens: Optional[int], output_tokens: Optional[int], success: bool = True,
+                       cached_tokens: Optional[int] = None) -> None:
+    GEMINI_REQUESTS.inc(model, "success" if success else "error")
+    GEMINI_LATENCY.observe(latency, model)
+    if input_tokens:
+        GEMINI_TOKENS.inc(model, "input", amount=input_tokens)
+    if output_tokens:
+        GEMINI_TOKENS.inc(model, "output", amount=output_tokens)
+    if cached_tokens:
+        # Part of the input tokens, served from a context cache at the cached rate
+        GEMINI_TOKENS.inc(model, "cached", amount=cached_tokens)
+
+
+def record_stage_tokens(stage_name: str, input_tokens: int, output_tokens: int, cached_tokens: int) -> None:
+    for direction, amount in (("input", input_tokens), ("output", output_tokens), ("cached", cached_tokens)):
+        if amount:
+            STAGE_TOKENS.inc(stage_name, direction, amount=amount)
+
+
+def record_gemini_retry(model: str, reason: str) -> None:
+    GEMINI_RETRIES.inc(model, reason)
+
+
+def record_gemini_repair(model: str, outcome: str, saved_tokens: int = 0) -> None:
+    GEMINI_REPAIRS.inc(model, outcome)
+    if saved_tokens > 0:
+        GEMINI_REPAIR_SAVED_TOKENS.inc(model, amount=saved_tokens)
+
+
+class DomainLabels:
+    def __init__(self, max_domains: int = 100):
+        """
+        Bounded set of domain label values, so per-domain metrics cannot grow without limit.
+
+        The first `max_domains` domains seen keep their own series; later ones are
+        counted under "other".
+
+        Args:
+            max_domains (int): Domains with their own series, 0 puts every domain under "other"
+        """
+        self.max_domains = max_domains
+        self._domains = set()
+        self._lock = threading.Lock()
+
+    def label(self, domain: str) -> str:
+        domain = domain or "unknown"
+        with self._lock:
+            if domain in self._domains:
+                return domain
+            if len(self._domains) < self.max_domains:
+                self._domains.add(domain)
+                return domain
+        return "other"
+
+
+# METRICS_MAX_DOMAINS: domains with their own series in the per-domain metrics (default 100)
+domain_labels = DomainLabels(int(os.getenv("METRICS_MAX_DOMAINS", "100")))
+
+
+def record_boilerplate(domain: str, tokens: int) -> None:
+    BOILERPLATE_TOKENS.inc(domain_labels.label(domain), amount=tokens)
+
+
+def record_scrape(url: str, num_bytes: int, success: bool) -> None:
+    domain = domain_labels.label(urlparse(url).netloc.lower())
+    SCRAPE_REQUESTS.inc(domain, "success" if success else "failure")
+    if num_bytes:
+        SCRAPE_BYTES.inc(domain, amount=num_bytes)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache, "hit" if hit else "miss")
+
+
+def record_job_event(kind: str, event: str) -> None:
+    JOB_EVENTS.inc(kind, event)
+
+
+def record_admission(method: str, outcome: str) -> None:
+    ADMISSIONS.inc(method, outcome)
+
+
+def record_cancellation(reason: str) -> None:
+    CANCELLATIONS.inc(reason)
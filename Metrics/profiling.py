@@ -0,0 +1,282 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from types import CodeType
+from typing import Dict, List, Optional, Set, Tuple
+
+# Frames from files under this directory mark a stack as the project's work; stacks made
+# only of library frames are idle pool workers or the server's event loop and are dropped
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Code object -> (folded-stack label, whether it is the project's code); the same few
+# hundred functions are seen over and over, so each is only formatted once
+_labels: Dict[CodeType, Tuple[str, bool]] = {}
+
+# Threads of every running sampler, left out of all profiles
+_sampler_threads: Set[int] = set()
+
+
+def _frame_label(code: CodeType) -> Tuple[str, bool]:
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        in_project = filename.startswith(PROJECT_ROOT)
+        filename = os.path.relpath(filename, PROJECT_ROOT) if in_project else os.path.basename(filename)
+        label = _labels[code] = (f"{code.co_name} ({filename}:{code.co_firstlineno})", in_project)
+    return label
+
+
+class StackSampler:
+    def __init__(self, interval: float = 0.02, max_depth: int = 128):
+        """
+        Wall-clock sampling profiler: every `interval` seconds, record the Python stack of every thread.
+
+        Waiting (network, Gemini, a pool future) shows up as much as computing, which is
+        what tells a slow job's parsing, network waits and Gemini calls apart. Samples
+        are aggregated as folded stacks, the input format of flamegraph.pl and speedscope.
+
+        Sampling covers the whole process. On a server running several jobs at once,
+        the profile also contains the other jobs' stacks.
+
+        Args:
+            interval (float): Seconds between samples
+            max_depth (int): Innermost frames kept per stack
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        _sampler_threads.add(threading.get_ident())
+        try:
+            while not self._stop.wait(self.interval):
+                self._sample()
+        finally:
+            _sampler_threads.discard(threading.get_ident())
+
+    def _sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in _sampler_threads:
+                continue
+            labels, in_project = [], False
+            while frame is not None and len(labels) < self.max_depth:
+                label, project_code = _frame_label(frame.f_code)
+                labels.append(label)
+                in_project = in_project or project_code
+                frame = frame.f_back
+            if in_project:
+                labels.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def folded(self) -> str:
+        """One "frame;frame;frame count" line per distinct stack, outermost frame first."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+# tracemalloc is process-wide; overlapping profiles share one tracing session, and
+# tracing someone else started (e.g. a benchmark's memory tracker) is left running
+_tracing_users = 0
+_tracing_owned = False
+_tracing_lock = threading.Lock()
+
+
+def _start_tracing() -> None:
+    global _tracing_users, _tracing_owned
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            _tracing_owned = True
+        _tracing_users += 1
+
+
+def _stop_tracing() -> None:
+    global _tracing_users, _tracing_owned
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+
+
+def top_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, limit: int = 25) -> List[Dict]:
+    """Source lines that allocated the most memory still held between two snapshots."""
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    sites = []
+    for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:limit]:
+        if stat.size_diff <= 0:
+            break
+        frame = stat.traceback[0]
+        filename = frame.filename
+        if filename.startswith(PROJECT_ROOT):
+            filename = os.path.relpath(filename, PROJECT_ROOT)
+        sites.append({
+            "site": f"{filename}:{frame.lineno}",
+            "size_kb": round(stat.size_diff / 1024, 1),
+            "blocks": stat.count_diff,
+        })
+    return sites
+
+
+class ProfileStore:
+    def __init__(self, directory: str = ".cache/profiles", max_profiles: int = 50):
+        """
+        Saved profiles, one JSON summary and one folded-stack file per job id.
+
+        Args:
+            directory (str): Where profiles are written
+            max_profiles (int): Profiles kept; the oldest are deleted first
+        """
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        # Job ids are generated here, but they also arrive in admin URLs
+        if not job_id.isalnum():
+            raise KeyError(job_id)
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def save(self, summary: Dict, folded: str) -> None:
+        with self._lock:
+            with open(self._path(summary["job_id"], ".folded"), "w", encoding="utf-8") as f:
+                f.write(folded)
+            with open(self._path(summary["job_id"], ".json"), "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+            self._prune()
+
+    def _prune(self) -> None:
+        summaries = sorted(
+            (name for name in os.listdir(self.directory) if name.endswith(".json")),
+            key=lambda name: os.path.getmtime(os.path.join(self.directory, name)),
+        )
+        for name in summaries[:max(0, len(summaries) - self.max_profiles)]:
+            job_id = name[:-len(".json")]
+            for suffix in (".json", ".folded"):
+                try:
+                    os.remove(self._path(job_id, suffix))
+                except OSError:
+                    pass
+
+    def list(self) -> List[Dict]:
+        """Newest first, without the allocation sites."""
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                summary = self.get(name[:-len(".json")])
+                if summary is not None:
+                    summary.pop("top_allocations", None)
+                    profiles.append(summary)
+        return sorted(profiles, key=lambda summary: summary["started"], reverse=True)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(job_id, ".json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def folded(self, job_id: str) -> Optional[str]:
+        try:
+            with open(self._path(job_id, ".folded"), "r", encoding="utf-8") as f:
+                return f.read()
+        except (KeyError, OSError):
+            return None
+
+
+# Share of requests profiled without asking, e.g. 0.01 for one in a hundred
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "20"))
+
+
+def should_profile(requested: bool) -> bool:
+    return requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+@contextmanager
+def profile_job(enabled: bool, **labels):
+    """
+    Profile everything run inside the block and save it under a new job id.
+
+    Yields a dict that gets the job id, or None (and costs nothing) when not enabled.
+
+    Args:
+        enabled (bool): Whether to profile at all
+        labels: Stored with the profile, e.g. topic and method
+    """
+    if not enabled:
+        yield None
+        return
+    info = {"job_id": uuid.uuid4().hex[:16]}
+    sampler = StackSampler(interval=PROFILE_INTERVAL_MS / 1000.0)
+    _start_tracing()
+    before = tracemalloc.take_snapshot()
+    started, start = time.time(), time.perf_counter()
+    sampler.start()
+    try:
+        yield info
+    finally:
+        sampler.stop()
+        duration = time.perf_counter() - start
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        _stop_tracing()
+        summary = {
+            "job_id": info["job_id"],
+            **labels,
+            "started": started,
+            "duration_seconds": round(duration, 3),
+            "samples": sampler.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            # Since tracing started, so shared with profiles that overlapped this one
+            "peak_traced_mb": round(peak / (1024 * 1024), 2),
+            "top_allocations": top_allocations(before, after),
+        }
+        try:
+            get_profile_store().save(summary, sampler.folded())
+            print(f"Profile {info['job_id']} saved ({sampler.samples} samples, {duration:.1f}s)")
+        except OSError as e:
+            print(f"Could not save profile {info['job_id']}: {e}")
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_profile_store() -> ProfileStore:
+    """
+    Return the process-wide profile store configured from the environment.
+
+    PROFILE_DIR: where profiles are saved (default: .cache/profiles)
+    PROFILE_MAX_SAVED: profiles kept (default: 50)
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ProfileStore(
+                directory=os.getenv("PROFILE_DIR", ".cache/profiles"),
+                max_profiles=int(os.getenv("PROFILE_MAX_SAVED", "50")),
+            )
+        return _default_store
@@ -0,0 +1,194 @@
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional
+
+from Metrics.instrumentation import current_stage, record_stage_tokens
+
+
+# Cold-start guesses of the Gemini tokens (input plus output) of one step, until it has been observed here
+DEFAULT_STEP_TOKENS = {
+    "summarize_document": 2400,
+    "verify_fact": 1900,
+    "generate": 9000,
+}
+
+# Output tokens per word of post, with the HTML tags and JSON around it
+OUTPUT_TOKENS_PER_WORD = 1.5
+
+# Fewest output tokens a post is asked for, however little of the budget is left
+MIN_OUTPUT_TOKENS = 1024
+
+# Default per-job token budget when a request sets none; 0 means unlimited
+JOB_TOKEN_BUDGET = int(os.getenv("JOB_TOKEN_BUDGET", "0"))
+
+
+def resolve_budget(budget: Optional[int]) -> Optional[int]:
+    """The token budget a job runs under: `budget`, JOB_TOKEN_BUDGET when None, and None (unlimited) for 0."""
+    if budget is None:
+        budget = JOB_TOKEN_BUDGET
+    return budget if budget > 0 else None
+
+
+class TokenEstimator:
+    def __init__(self, alpha: float = 0.3, defaults: Optional[Dict[str, int]] = None):
+        """
+        Live per-step token estimates, as exponentially weighted moving averages.
+
+        Fed by metered() with what one summary, fact check or post actually cost.
+
+        Args:
+            alpha (float): Weight of the newest observation
+            defaults (dict): Estimates for steps not observed yet
+        """
+        self.alpha = alpha
+        self.defaults = dict(DEFAULT_STEP_TOKENS if defaults is None else defaults)
+        self._estimates: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, tokens: int) -> None:
+        with self._lock:
+            previous = self._estimates.get(name)
+            self._estimates[name] = tokens if previous is None else (1 - self.alpha) * previous + self.alpha * tokens
+
+    def estimate(self, name: str) -> float:
+        with self._lock:
+            return self._estimates.get(name, self.defaults.get(name, 0))
+
+
+token_estimator = TokenEstimator()
+
+
+class TokenUsage:
+    def __init__(self, budget: Optional[int] = None, estimator: Optional[TokenEstimator] = None):
+        """
+        Gemini tokens one job used, per stage, and the budget they are held to.
+
+        Args:
+            budget (int): Input plus output tokens the job may use, None for no limit
+            estimator (TokenEstimator): Step estimates to plan with, defaults to the shared one
+        """
+        self.budget = budget
+        self.estimator = estimator or token_estimator
+        self.stages: Dict[str, Dict[str, int]] = {}
+        self.degradations: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, input_tokens: int, output_tokens: int, cached_tokens: int) -> None:
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0})
+            totals["calls"] += 1
+            totals["input_tokens"] += input_tokens
+            totals["output_tokens"] += output_tokens
+            totals["cached_tokens"] += cached_tokens
+
+    def used(self) -> int:
+        with self._lock:
+            return sum(totals["input_tokens"] + totals["output_tokens"] for totals in self.stages.values())
+
+    def remaining(self) -> Optional[float]:
+        return None if self.budget is None else self.budget - self.used()
+
+    def estimate(self, *names: str) -> float:
+        return sum(self.estimator.estimate(name) for name in names)
+
+    def can_afford(self, *names: str, reserve: Iterable[str] = ()) -> bool:
+        """Whether `names` are expected to fit in the budget with the `reserve` steps' tokens kept aside."""
+        if self.budget is None:
+            return True
+        return self.remaining() - self.estimate(*reserve) >= self.estimate(*names)
+
+    def cap_output(self, max_tokens: int, prompt_tokens: int, stage: str) -> int:
+        """
+        The output tokens to ask for so a call with a `prompt_tokens` prompt stays within the budget.
+
+        Never less than MIN_OUTPUT_TOKENS; a call held to less than `max_tokens` is recorded as degraded.
+        """
+        if self.budget is None:
+            return max_tokens
+        available = int(self.remaining() - prompt_tokens)
+        if available >= max_tokens:
+            return max_tokens
+        if available < MIN_OUTPUT_TOKENS:
+            self.degrade(stage, "over_budget", f"{max(available, 0)} tokens left for the output, asking for {MIN_OUTPUT_TOKENS}")
+            return min(max_tokens, MIN_OUTPUT_TOKENS)
+        self.degrade(stage, "shorter_output", f"{available} of {max_tokens} output tokens")
+        return available
+
+    def degrade(self, stage: str, action: str, detail: str) -> None:
+        print(f"Token budget: {stage} {action} ({detail})")
+        with self._lock:
+            self.degradations.append({"stage": stage, "action": action, "detail": detail})
+
+    def report(self) -> Dict:
+        with self._lock:
+            stages = {name: dict(totals) for name, totals in self.stages.items()}
+            degraded = list(self.degradations)
+        total = {key: sum(totals[key] for totals in stages.values())
+                 for key in ("calls", "input_tokens", "output_tokens", "cached_tokens")}
+        used = total["input_tokens"] + total["output_tokens"]
+        report = {"total": total, "stages": stages, "budget": self.budget}
+        if self.budget is not None:
+            report.update(remaining=self.budget - used, exceeded=used > self.budget, degraded=degraded)
+        return report
+
+
+_current_usage: ContextVar[Optional[TokenUsage]] = ContextVar("job_token_usage", default=None)
+# Tokens of the step being metered, when one is
+_current_meter: ContextVar[Optional[List[int]]] = ContextVar("token_meter", default=None)
+
+
+@contextmanager
+def track_tokens(budget: Optional[int] = None):
+    """
+    Account the Gemini tokens of everything run inside the block, and hold it to a budget.
+
+    Args:
+        budget (int): Token budget of the job; None falls back to JOB_TOKEN_BUDGET, 0 means unlimited
+    """
+    usage = TokenUsage(resolve_budget(budget))
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def current_usage() -> Optional[TokenUsage]:
+    return _current_usage.get()
+
+
+def output_tokens(max_tokens: int, prompt: str, stage: str) -> int:
+    """`max_tokens` capped to what the current job's token budget leaves after `prompt`."""
+    usage = _current_usage.get()
+    if usage is None:
+        return max_tokens
+    # Roughly 4 characters per token
+    return usage.cap_output(max_tokens, len(prompt) // 4, stage)
+
+
+def record_tokens(input_tokens: Optional[int], output_tokens: Optional[int], cached_tokens: Optional[int]) -> None:
+    """Account one Gemini call to the current stage, job and metered step."""
+    input_tokens, output_tokens, cached_tokens = input_tokens or 0, output_tokens or 0, cached_tokens or 0
+    stage_name = current_stage() or "other"
+    record_stage_tokens(stage_name, input_tokens, output_tokens, cached_tokens)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(stage_name, input_tokens, output_tokens, cached_tokens)
+    meter = _current_meter.get()
+    if meter is not None:
+        meter[0] += input_tokens + output_tokens
+
+
+@contextmanager
+def metered(step: str):
+    """Feed the tokens of the Gemini calls made inside the block to the `step` estimate."""
+    meter = [0]
+    token = _current_meter.set(meter)
+    try:
+        yield
+    finally:
+        _current_meter.reset(token)
+        if meter[0]:
+            token_estimator.observe(step, meter[0])
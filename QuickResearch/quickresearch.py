@@ -1,49 +1,100 @@
-from Tools.scraper import WebScraper
+from Tools.scraper import WebScraper, over_fetch, SCRAPE_DEADLINE_SECONDS
 from Tools.search import Search
+from Tools.corpus import local_documents
 from Tools.featuredimage import FeaturedImageExtractor
+from Tools.variants import variant_instructions, write_variants
 from Google_Genai.googlegenai import google_structured_output
 from Markdown.toHTML import MarkdownToHTMLConverter
+from Metrics.instrumentation import current_timings, stage, timed, track_request
+from Metrics.deadline import current_deadline, model_for
+from Metrics.tokens import OUTPUT_TOKENS_PER_WORD, current_usage, metered, output_tokens
+from Metrics.cancellation import cancellation_point
 
 from langchain_core.runnables import RunnableLambda, RunnableSequence
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field, field_validator
+from typing import TypedDict, Optional
+from contextlib import nullcontext
 import json
 import time
 load_dotenv()
 
 
-# WebSearch which returns URLs based on a topic
-current_urls = []
+# State passed through the chain. Everything a request produces lives here, so
+# concurrent runs in one process never see each other's URLs or data.
+class QuickResearchState(TypedDict):
+    topic: str
+    max_results: int
+    word_count: int
+    max_source_age_hours: Optional[float]
+    urls: Optional[list[str]]
+    local_data: Optional[list[dict]]
+    data: Optional[list[dict]]
+    blog: Optional["BlogData"]
+    # Extra prompt instructions of one output variant
+    instructions: Optional[str]
+
 
-def WebSearch(inputs):
+# WebSearch which returns URLs based on a topic
+def WebSearch(state: QuickResearchState):
     print("Searching for URLs related to the topic")
-    global current_urls
-    topic = inputs["topic"]
-    max_results = inputs["max_results"]
-    word_count = inputs["word_count"]
+    max_results = state["max_results"]
+    budget = current_deadline()
+    if budget is not None:
+        # Fewer sources when search and scraping would not leave time to write the post
+        max_results = budget.fit_count(max_results, ("search", "scrape"), reserve=("generate", "html"), stage="search")
+
+    # Documents already in the local corpus first, the web only for what is missing
+    local_data = local_documents(state["topic"], max_results, state.get("max_source_age_hours"))
+    local_urls = [item["url"] for item in local_data]
+    missing = max_results - len(local_data)
 
     # Search for URLs related to the topic
-    search = Search()
-    urls = search.search(topic, max_results)
-    current_urls = urls
-    return {'topic': topic, 'urls': urls, 'word_count': word_count}
+    urls = []
+    if missing > 0:
+        search = Search()
+        urls = [url for url in search.search(state["topic"], over_fetch(missing)) if url not in local_urls]
+    return {**state, "max_results": max_results, "urls": local_urls + urls, "local_data": local_data}
 
 
 # WebScrape which scrapes data from the URLs
-def WebScrape(inputs):
+def WebScrape(state: QuickResearchState):
     print("Scraping data from the URLs")
-    urls = inputs["urls"]
-    word_count = inputs["word_count"]
-    topic = inputs["topic"]
-    scraper = WebScraper()
-    data = scraper.scrape_multiple_urls(urls)
-    print(scraper.get_summary_stats(data))
+    local_data = state.get("local_data") or []
+    local_urls = {item["url"] for item in local_data}
+    web_urls = [url for url in state["urls"] if url not in local_urls]
+    data = list(local_data)
+    if web_urls:
+        scraper = WebScraper()
+        budget = current_deadline()
+        deadline = SCRAPE_DEADLINE_SECONDS
+        if budget is not None:
+            deadline = budget.time_box(deadline, reserve=("generate", "html"), stage="scrape")
+        scraped = scraper.scrape(web_urls, quorum=state["max_results"] - len(local_data), deadline=deadline)
+        print(scraper.get_summary_stats(scraped))
+        data.extend(scraped)
 
     #Temp: Save the scraped data to a JSON file
     # scraper.save_to_json(data, './Testing/blog_input_data.json')
 
-    return {"topic": topic, "data": data, "word_count": word_count}
+    usage = current_usage()
+    if usage is not None and usage.budget is not None:
+        data = fit_sources(state["topic"], data, state["word_count"], usage)
+
+    return {**state, "data": data}
+
+
+def fit_sources(topic: str, data: list, word_count: int, usage) -> list:
+    """Drop the last sources until the generation prompt and the post fit in what is left of the job's token budget."""
+    available = usage.remaining() - int(word_count * OUTPUT_TOKENS_PER_WORD)
+    kept = len(data)
+    # Roughly 4 characters per token; always keep one source to write from
+    while kept > 1 and len(blog_prompt.format(topic=topic, data=data[:kept])) // 4 > available:
+        kept -= 1
+    if kept < len(data):
+        usage.degrade("scrape", "fewer_sources", f"{kept} of {len(data)} sources kept")
+    return data[:kept]
 
 
 # Pydantic model
@@ -61,21 +112,15 @@ class BlogData(BaseModel):
         return v
    
 
-# Prompt template for generating the blog
+# Prompt template for generating the blog. Static instructions come first and the
+# research last, so the whole template is a prefix shared by every variant and retry
+# of a post and can be served from a Gemini context cache.
 blog_prompt = PromptTemplate(
     template="""
 ## ROLE & GOAL ##
 You are an expert content creator, seasoned blogger, and SEO strategist.
 Create an **original, engaging, and SEO-optimized blog** using the provided research data.
 Audience: Intelligent readers who prefer clarity and actionable insights.
-Aim for at least {word_count} words (you can exceed if needed).
-
----
-
-## CONTEXT ##
-Topic: {topic}  
-Research Data:  
-{data}
 
 ---
 
@@ -116,8 +161,23 @@ Research Data:
 
 ---
 
+## CONTEXT ##
+Topic: {topic}  
+Research Data:  
+{data}
+
+---
+""",
+    input_variables=["topic", "data"],
+)
+
+# The part of the prompt that differs between variants of one post
+length_prompt = PromptTemplate(
+    template="""
+## LENGTH ##
+Aim for at least {word_count} words (you can exceed if needed).
 """,
-    input_variables=["topic", "data", "word_count"],
+    input_variables=["word_count"],
 )
 
 
@@ -126,84 +186,149 @@ Research Data:
 # model = ChatGoogleGenerativeAI(model="gemini-2.5-pro", temperature=0.5, max_tokens=65536)
 
 # structured_model = model.with_structured_output(BlogData)
-def call_gemini_with_structured_output(inputs):
-    prompt = blog_prompt.format(**inputs)
+def call_gemini_with_structured_output(state: QuickResearchState):
+    research = blog_prompt.format(topic=state["topic"], data=state["data"])
+    prompt = length_prompt.format(word_count=state["word_count"]) + variant_instructions(state.get("instructions"))
     structured_model = google_structured_output()
     
     
     # output = structured_model.call_google_structured_output(prompt=prompt, pydantic_model=BlogData, model="gemini-2.5-flash", max_tokens=15000, temperature=0.5)
-    max_attempts = 4
-    for attempt in range(max_attempts):
-        try:   
-            blog_data = structured_model.call_google_structured_output(prompt=prompt, pydantic_model=BlogData, model="gemini-2.0-flash", max_tokens=8100, thinking_budget=None)
-            
-            if (blog_data
-                    and getattr(blog_data, "title", None)
-                    and getattr(blog_data, "content", None)
-                    and getattr(blog_data, "excerpt", None)
-                    and getattr(blog_data, "tags", None)
-                    and isinstance(getattr(blog_data, "tags", None), list)
-                    and len(getattr(blog_data, "tags", [])) > 0
-                ):
-               break
-            raise ValueError("Model returned None or incomplete BlogData")
-        
-        except Exception as e:
-            print(f"Error generating blog content: {e}")
-            if attempt < max_attempts - 1:
-                print("Retrying in 5 seconds...")
-                time.sleep(5)
-            else:
-                raise e
+    # Retries, backoff and model fallback happen inside google_structured_output
+    # A faster model when the deadline leaves too little time for the usual one
+    model = model_for("generate", "gemini-2.0-flash", reserve=("html",))
+    # No more output than the job's token budget has room for
+    max_tokens = output_tokens(8100, research + prompt, "generate")
+    # A post cut off at max_tokens keeps its content; missing title, excerpt or tags come from a short follow-up call
+    with metered("generate"):
+        blog_data = structured_model.call_google_structured_output(prompt=prompt, pydantic_model=BlogData, model=model, max_tokens=max_tokens, thinking_budget=None, require_complete=True, cached_prefix=research, fillable_fields=("title", "excerpt", "tags"))
     
-    return blog_data
+    return {**state, "blog": blog_data}
+
 
+# A cancelled run stops before the next step instead of finishing the chain for nobody
+research_steps = [
+    RunnableLambda(cancellation_point('search', timed('search', WebSearch))),
+    RunnableLambda(cancellation_point('scrape', timed('scrape', WebScrape))),
+]
+
+# Search and scraping only, shared by every variant of a post
+research_chain = RunnableSequence(*research_steps)
 
 chain = RunnableSequence(
-    RunnableLambda(WebSearch),
-    RunnableLambda(WebScrape),
-    RunnableLambda(call_gemini_with_structured_output),
+    *research_steps,
+    RunnableLambda(cancellation_point('generate', timed('generate', call_gemini_with_structured_output))),
 )
 
 
 
-def run_quick_research(topic: str, max_results: int = 2, word_count: int = 1000, scrape_thumbnail: bool = False):
+def run_quick_research(topic: str, max_results: int = 2, word_count: int = 1000, scrape_thumbnail: bool = False,
+                       max_source_age_hours: Optional[float] = None):
     print("Running Quick Research for topic:", topic)
-    inputs = {
-        "topic": topic,
-        "max_results": max_results,
-        "word_count": word_count
-    }
-    try:
-        output = chain.invoke(inputs)
+    # Stage timings go to the caller's breakdown when it tracks one, otherwise to our own
+    with nullcontext() if current_timings() is not None else track_request():
+        initial_state: QuickResearchState = {
+            "topic": topic,
+            "max_results": max_results,
+            "word_count": word_count,
+            "max_source_age_hours": max_source_age_hours,
+            "urls": None,
+            "local_data": None,
+            "data": None,
+            "blog": None,
+            "instructions": None,
+        }
+        try:
+            state = chain.invoke(initial_state)
+            output = state["blog"]
         
-        # Temp: Save the output to a JSON file before conversion
-        # with open('./Testing/blog_output_before.json', 'w') as f:
-        #     json.dump(output.model_dump(), f, indent=4)
+            # Temp: Save the output to a JSON file before conversion
+            # with open('./Testing/blog_output_before.json', 'w') as f:
+            #     json.dump(output.model_dump(), f, indent=4)
+
+            # Convert Markdown to HTML
+            with stage("html"):
+                toHTML = MarkdownToHTMLConverter()
+                content = toHTML.convert_to_html(output.content)
+                output.content = content
+
+            # Featured image extraction
+            featured_image = None
+            if scrape_thumbnail:
+                with stage("image"):
+                    extractor = FeaturedImageExtractor()
+                    featured_image = extractor.get_featured_image_within_deadline(state["urls"])
+
+            if featured_image is None:
+                featured_image = {
+                    "success": False,
+                    "image_url": None,
+                }
+        
+            combined_results = {
+                "blog_data": output.model_dump(),
+                "featured_image": featured_image
+            }
+
+            return combined_results
+        except Exception as e:
+            print(f"Error in run_quick_research: {e}")
+            return None
+
+
+def write_variant(state: QuickResearchState, variant: dict) -> dict:
+    """Generate and convert one variant of the post from already scraped data."""
+    variant_state = {**state, "word_count": variant["word_count"], "instructions": variant.get("instructions")}
+    output = timed('generate', call_gemini_with_structured_output)(variant_state)["blog"]
+    with stage("html"):
+        output.content = MarkdownToHTMLConverter().convert_to_html(output.content)
+    return output.model_dump()
+
+
+def run_quick_research_variants(topic: str, variants: list[dict], max_results: int = 2,
+                                max_source_age_hours: Optional[float] = None):
+    """
+    Search and scrape once, then write every variant from the same data.
+
+    Args:
+        topic (str): Topic of the post
+        variants (list[dict]): Specs with name, word_count, instructions and scrape_thumbnail
+        max_results (int): Sources to research
+        max_source_age_hours (float): Oldest acceptable source, None for the default policy
+
+    Returns:
+        dict: {"variants": [...]} with one entry per spec, or None when the research failed
+    """
+    print(f"Running Quick Research for topic: {topic} ({len(variants)} variants)")
+    with nullcontext() if current_timings() is not None else track_request():
+        initial_state: QuickResearchState = {
+            "topic": topic,
+            "max_results": max_results,
+            "word_count": max(variant["word_count"] for variant in variants),
+            "max_source_age_hours": max_source_age_hours,
+            "urls": None,
+            "local_data": None,
+            "data": None,
+            "blog": None,
+            "instructions": None,
+        }
+        try:
+            state = research_chain.invoke(initial_state)
+        except Exception as e:
+            print(f"Error in run_quick_research_variants: {e}")
+            return None
 
-        # Convert Markdown to HTML
-        toHTML = MarkdownToHTMLConverter()
-        content = toHTML.convert_to_html(output.content)
-        output.content = content
+        results = write_variants(lambda variant: write_variant(state, variant), variants)
 
-        # Featured image extraction
+        # One image search serves every variant that asked for a thumbnail
         featured_image = None
-        if scrape_thumbnail:
-            extractor = FeaturedImageExtractor()
-            featured_image = extractor.get_featured_image(current_urls)
-
-        if featured_image is None:
-            featured_image = {
-                "success": False,
-                "image_url": None,
-            }
-        
-        combined_results = {
-            "blog_data": output.model_dump(),
-            "featured_image": featured_image
-        }
+        if any(variant["scrape_thumbnail"] for variant in variants):
+            with stage("image"):
+                extractor = FeaturedImageExtractor()
+                featured_image = extractor.get_featured_image_within_deadline(state["urls"])
+        for variant, result in zip(variants, results):
+            if variant["scrape_thumbnail"] and featured_image is not None:
+                result["featured_image"] = featured_image
+            else:
+                result["featured_image"] = {"success": False, "image_url": None}
 
-        return combined_results
-    except Exception as e:
-        print(f"Error in run_quick_research: {e}")
-        return None
\ No newline at end of file
+        return {"variants": results}
\ No newline at end of file
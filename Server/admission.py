@@ -0,0 +1,282 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+from Metrics.instrumentation import GEMINI_REQUESTS, GEMINI_TOKENS, record_admission, registry
+from Metrics.tokens import OUTPUT_TOKENS_PER_WORD
+
+# Rough Gemini cost of one pipeline run, in tokens. Scraped sources dominate the input
+SOURCE_TOKENS = 2000
+PROMPT_TOKENS = 800
+# Deep research: planned queries, documents per query, facts checked per document
+DEEP_QUERIES = 5
+DEEP_DOCUMENTS_PER_QUERY = 2
+DEEP_FACTS_PER_DOCUMENT = 2
+SUMMARY_OUTPUT_TOKENS = 400
+VERIFICATION_TOKENS = 1700
+
+# Cold-start guesses of how long a job takes, until jobs of the method have finished here
+DEFAULT_JOB_SECONDS = {"quick": 30.0, "deep": 120.0}
+
+
+def estimate_cost(method: str, max_results: int, word_count: int, variants: int = 1) -> Dict[str, int]:
+    """
+    Gemini calls and tokens one request is expected to use.
+
+    Args:
+        method (str): "quick" or "deep"
+        max_results (int): Sources researched (quick research only)
+        word_count (int): Target length of each post
+        variants (int): Posts written from the same research
+
+    Returns:
+        Dict: gemini_calls and tokens (input plus output)
+    """
+    generate = variants * (PROMPT_TOKENS + int(word_count * OUTPUT_TOKENS_PER_WORD))
+    if method == "quick":
+        return {"gemini_calls": variants, "tokens": max_results * SOURCE_TOKENS + generate}
+    documents = DEEP_QUERIES * DEEP_DOCUMENTS_PER_QUERY
+    facts = documents * DEEP_FACTS_PER_DOCUMENT
+    return {
+        "gemini_calls": 1 + documents + facts + variants,
+        "tokens": (PROMPT_TOKENS * 2                                      # planning
+                   + documents * (SOURCE_TOKENS + SUMMARY_OUTPUT_TOKENS)  # summaries
+                   + facts * VERIFICATION_TOKENS                          # fact checks
+                   + variants * documents * SUMMARY_OUTPUT_TOKENS         # summaries in the prompt
+                   + generate),
+    }
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float, eta: float):
+        """The request was turned away; `retry_after` is when trying again is expected to work."""
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.eta = eta
+
+
+class Ticket:
+    def __init__(self, method: str, cost: Dict[str, int], eta: float):
+        self.method = method
+        self.cost = cost
+        self.eta = eta
+        self.arrived = time.monotonic()
+        self.started: Optional[float] = None
+        self.queued = False
+        self.ready = asyncio.Event()
+
+    @property
+    def waited(self) -> float:
+        return (self.started or time.monotonic()) - self.arrived
+
+    def report(self) -> Dict:
+        return {
+            "estimated_gemini_calls": self.cost["gemini_calls"],
+            "estimated_tokens": self.cost["tokens"],
+            "eta_seconds": round(self.eta, 1),
+            "queued_seconds": round(self.waited, 2),
+        }
+
+
+class AdmissionController:
+    def __init__(self, max_running: int = 8, max_queued: int = 64, max_wait: float = 300.0,
+                 tokens_per_minute: int = 0, requests_per_minute: int = 0, alpha: float = 0.3):
+        """
+        Decide which pipeline runs to start, queue or turn away under load.
+
+        Every request gets an estimated Gemini cost. It starts when a run slot is
+        free and the Gemini quota has room for it. The room is the per-minute quota,
+        minus what the process actually used in the last minute, minus what running
+        jobs are still expected to use. Otherwise it waits in line with an ETA.
+        A request is rejected (429 with Retry-After) when the line is full, or when
+        its ETA is beyond `max_wait` or leaves too little of its deadline_seconds.
+
+        Runs on the event loop; not thread-safe.
+
+        Args:
+            max_running (int): Pipeline runs at the same time
+            max_queued (int): Requests waiting for a slot before new ones are rejected
+            max_wait (float): Longest expected wait a request is queued for
+            tokens_per_minute (int): Gemini token quota, 0 when unknown
+            requests_per_minute (int): Gemini request quota, 0 when unknown
+            alpha (float): Weight of the newest job in the per-method duration averages
+        """
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.alpha = alpha
+        self._durations = dict(DEFAULT_JOB_SECONDS)
+        self._running: List[Ticket] = []
+        self._waiting: Deque[Ticket] = deque()
+        # (time, total Gemini tokens, total Gemini calls), sampled from the metrics counters
+        self._usage: Deque[Tuple[float, float, float]] = deque()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """ADMISSION_MAX_RUNNING, ADMISSION_MAX_QUEUED, ADMISSION_MAX_WAIT_SECONDS, GEMINI_QUOTA_TPM, GEMINI_QUOTA_RPM."""
+        return cls(
+            max_running=int(os.getenv("ADMISSION_MAX_RUNNING", "8")),
+            max_queued=int(os.getenv("ADMISSION_MAX_QUEUED", "64")),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "300")),
+            tokens_per_minute=int(os.getenv("GEMINI_QUOTA_TPM", "0")),
+            requests_per_minute=int(os.getenv("GEMINI_QUOTA_RPM", "0")),
+        )
+
+    def duration(self, method: str) -> float:
+        return self._durations.get(method, DEFAULT_JOB_SECONDS["deep"])
+
+    def _used_last_minute(self) -> Tuple[float, float]:
+        now = time.monotonic()
+        # "cached" tokens are already counted as input
+        tokens = sum(v for (_, direction), v in GEMINI_TOKENS.items().items() if direction != "cached")
+        sample = (now, tokens, sum(GEMINI_REQUESTS.items().values()))
+        # Samples are only ever taken inside the window, so an idle stretch does not count against it
+        while self._usage and self._usage[0][0] < now - 60:
+            self._usage.popleft()
+        baseline = self._usage[0] if self._usage else sample
+        self._usage.append(sample)
+        return sample[1] - baseline[1], sample[2] - baseline[2]
+
+    def _reserved(self) -> Tuple[float, float]:
+        """What running jobs are still expected to use, assuming they spend evenly over their usual duration."""
+        tokens = calls = 0.0
+        now = time.monotonic()
+        for ticket in self._running:
+            left = max(0.0, 1.0 - (now - ticket.started) / self.duration(ticket.method))
+            tokens += ticket.cost["tokens"] * left
+            calls += ticket.cost["gemini_calls"] * left
+        return tokens, calls
+
+    def _quota_wait(self, tokens: float, calls: float) -> float:
+        """Seconds until the per-minute quotas have room for `tokens` and `calls` more."""
+        used_tokens, used_calls = self._used_last_minute()
+        reserved_tokens, reserved_calls = self._reserved()
+        wait = 0.0
+        for quota, needed in ((self.tokens_per_minute, used_tokens + reserved_tokens + tokens),
+                              (self.requests_per_minute, used_calls + reserved_calls + calls)):
+            if quota > 0 and needed > quota:
+                wait = max(wait, (needed - quota) / quota * 60.0)
+        return wait
+
+    def eta(self, method: str, cost: Dict[str, int]) -> float:
+        """Expected seconds until a request arriving now would start."""
+        ahead = list(self._waiting)
+        slots_short = len(self._running) + len(ahead) + 1 - self.max_running
+        slot_wait = 0.0
+        if slots_short > 0:
+            jobs = self._running + ahead
+            average = sum(self.duration(ticket.method) for ticket in jobs) / len(jobs)
+            slot_wait = math.ceil(slots_short / self.max_running) * average
+        quota_wait = self._quota_wait(cost["tokens"] + sum(ticket.cost["tokens"] for ticket in ahead),
+                                      cost["gemini_calls"] + sum(ticket.cost["gemini_calls"] for ticket in ahead))
+        return max(slot_wait, quota_wait)
+
+    def _can_start(self, ticket: Ticket) -> bool:
+        if len(self._running) >= self.max_running:
+            return False
+        # With nothing running, start anyway so a quota guess that is too low cannot stall everything
+        return not self._running or self._quota_wait(ticket.cost["tokens"], ticket.cost["gemini_calls"]) == 0
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.started = time.monotonic()
+        self._running.append(ticket)
+        ticket.ready.set()
+
+    def _pump(self) -> None:
+        """Start waiting requests, in arrival order, while they fit."""
+        while self._waiting and self._can_start(self._waiting[0]):
+            self._start(self._waiting.popleft())
+
+    @asynccontextmanager
+    async def admit(self, method: str, cost: Dict[str, int], deadline_seconds: Optional[float] = None):
+        """
+        Hold a run slot for the block, waiting for one when needed.
+
+        Raises:
+            AdmissionRejected: When the request should be retried later instead
+        """
+        eta = self.eta(method, cost)
+        limit = self.max_wait
+        if deadline_seconds is not None:
+            # Leave at least half the usual run time; the deadline planner can trim a run that much
+            limit = min(limit, deadline_seconds - 0.5 * self.duration(method))
+        if len(self._waiting) >= self.max_queued or (eta > 0 and eta > limit):
+            record_admission(method, "rejected")
+            reason = "Admission queue is full" if len(self._waiting) >= self.max_queued else \
+                f"Expected to start in {eta:.0f}s, more than this request can wait"
+            raise AdmissionRejected(reason, retry_after=max(1.0, eta), eta=eta)
+
+        ticket = Ticket(method, cost, eta)
+        if not self._waiting and self._can_start(ticket):
+            self._start(ticket)
+            record_admission(method, "admitted")
+        else:
+            ticket.queued = True
+            self._waiting.append(ticket)
+            record_admission(method, "queued")
+            try:
+                # Quota frees up with time as well as when jobs finish, so look again every second
+                while not ticket.ready.is_set():
+                    try:
+                        await asyncio.wait_for(ticket.ready.wait(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        self._pump()
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                if ticket in self._running:
+                    self._running.remove(ticket)
+                    self._pump()
+                raise
+        try:
+            yield ticket
+        finally:
+            self._running.remove(ticket)
+            seconds = time.monotonic() - ticket.started
+            self._durations[method] = (1 - self.alpha) * self.duration(method) + self.alpha * seconds
+            # Sample as the job's usage lands, so the window has a data point near where it was spent
+            self._used_last_minute()
+            self._pump()
+
+    def status(self) -> Dict:
+        used_tokens, used_calls = self._used_last_minute()
+        return {
+            "running": len(self._running),
+            "waiting": len(self._waiting),
+            "max_running": self.max_running,
+            "max_queued": self.max_queued,
+            "gemini_tokens_last_minute": int(used_tokens),
+            "gemini_calls_last_minute": int(used_calls),
+            "tokens_per_minute": self.tokens_per_minute,
+            "requests_per_minute": self.requests_per_minute,
+            "typical_seconds": {method: round(seconds, 1) for method, seconds in self._durations.items()},
+        }
+
+    def render_metrics(self) -> List[str]:
+        return [
+            "# HELP admission_running Pipeline runs holding an admission slot",
+            "# TYPE admission_running gauge",
+            f"admission_running {len(self._running)}",
+            "# HELP admission_waiting Requests waiting for an admission slot",
+            "# TYPE admission_waiting gauge",
+            f"admission_waiting {len(self._waiting)}",
+        ]
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    Build the admission controller configured from the environment, or None when disabled.
+
+    ADMISSION_CONTROL: "on" (default) or "off"
+    """
+    if os.getenv("ADMISSION_CONTROL", "on").lower() == "off":
+        return None
+    controller = AdmissionController.from_env()
+    registry.register_collector(controller.render_metrics)
+    return controller
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from Metrics.instrumentation import record_cache_lookup
+
+# Optional Redis client for multi-node mode (pip install redis)
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Prefix of every key this service writes, so several deployments can share one Redis
+BACKEND_PREFIX = os.getenv("JOB_BACKEND_PREFIX", "blog")
+
+
+class MemoryBackend:
+    def __init__(self):
+        """
+        In-process stand-in for RedisBackend, with the same operations and semantics.
+
+        Runs the job queue and shared caches inside one process: for a single node
+        with embedded workers, for the benchmarks, and for trying distributed mode
+        without a Redis server.
+        """
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._pending: Dict[str, deque] = {}
+        # queue -> job id -> (worker, lease expiry)
+        self._leases: Dict[str, Dict[str, Tuple[str, float]]] = {}
+        self._deliveries: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                return None
+            if value[1] is not None and value[1] <= time.time():
+                del self._values[key]
+                return None
+            return value[0]
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+            if len(self._values) % 1000 == 0:
+                now = time.time()
+                for stale in [k for k, (_, expires) in self._values.items() if expires is not None and expires <= now]:
+                    del self._values[stale]
+
+    def push(self, queue: str, job_id: str) -> None:
+        with self._lock:
+            self._pending.setdefault(queue, deque()).appendleft(job_id)
+
+    def claim(self, queue: str, worker: str, lease: float) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            pending = self._pending.get(queue)
+            if not pending:
+                return None
+            job_id = pending.pop()
+            self._leases.setdefault(queue, {})[job_id] = (worker, time.time() + lease)
+            deliveries = self._deliveries.setdefault(queue, {})
+            deliveries[job_id] = deliveries.get(job_id, 0) + 1
+            return job_id, deliveries[job_id]
+
+    def renew(self, queue: str, job_id: str, worker: str, lease: float) -> bool:
+        with self._lock:
+            leases = self._leases.get(queue, {})
+            if leases.get(job_id, (None,))[0] != worker:
+                return False
+            leases[job_id] = (worker, time.time() + lease)
+            return True
+
+    def release(self, queue: str, job_id: str, worker: str) -> bool:
+        with self._lock:
+            leases = self._leases.get(queue, {})
+            if leases.get(job_id, (None,))[0] != worker:
+                return False
+            del leases[job_id]
+            self._deliveries.get(queue, {}).pop(job_id, None)
+            return True
+
+    def requeue_expired(self, queue: str, max_deliveries: int) -> Tuple[List[str], List[str]]:
+        with self._lock:
+            now = time.time()
+            leases = self._leases.get(queue, {})
+            deliveries = self._deliveries.get(queue, {})
+            requeued, dead = [], []
+            for job_id in [job_id for job_id, (_, expires) in leases.items() if expires <= now]:
+                del leases[job_id]
+                if deliveries.get(job_id, 0) >= max_deliveries:
+                    deliveries.pop(job_id, None)
+                    dead.append(job_id)
+                else:
+                    # Back to the head of the queue; it has waited long enough
+                    self._pending.setdefault(queue, deque()).append(job_id)
+                    requeued.append(job_id)
+            return requeued, dead
+
+    def queue_stats(self, queue: str) -> Dict[str, int]:
+        with self._lock:
+            return {"pending": len(self._pending.get(queue, ())), "leased": len(self._leases.get(queue, {}))}
+
+
+# Lease expiries use the Redis server's clock, so nodes with skewed clocks agree on them
+_NOW = "local t = redis.call('TIME') local now = tonumber(t[1]) + tonumber(t[2]) / 1000000 "
+
+# KEYS: pending, leases, owners, deliveries; ARGV: worker, lease
+_CLAIM = _NOW + """
+local job_id = redis.call('RPOP', KEYS[1])
+if not job_id then return false end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), job_id)
+redis.call('HSET', KEYS[3], job_id, ARGV[1])
+return {job_id, redis.call('HINCRBY', KEYS[4], job_id, 1)}
+"""
+
+# KEYS: leases, owners; ARGV: job id, worker, lease
+_RENEW = _NOW + """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+
+# KEYS: leases, owners, deliveries; ARGV: job id, worker
+_RELEASE = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+return 1
+"""
+
+# KEYS: pending, leases, owners, deliveries; ARGV: max deliveries
+_REQUEUE_EXPIRED = _NOW + """
+local requeued, dead = {}, {}
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], job_id)
+    redis.call('HDEL', KEYS[3], job_id)
+    if tonumber(redis.call('HGET', KEYS[4], job_id) or '0') >= tonumber(ARGV[1]) then
+        redis.call('HDEL', KEYS[4], job_id)
+        table.insert(dead, job_id)
+    else
+        redis.call('RPUSH', KEYS[1], job_id)
+        table.insert(requeued, job_id)
+    end
+end
+return {requeued, dead}
+"""
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        """
+        Job queue and shared caches in Redis (or anything speaking its protocol), shared by every node.
+
+        Per queue: a list of pending job ids, a sorted set of lease expiries, and
+        hashes of lease owners and delivery counts. Claiming, renewing, releasing and
+        re-delivering are Lua scripts, so two workers can never hold the same lease.
+
+        Args:
+            url (str): e.g. redis://redis:6379/0
+        """
+        if redis is None:
+            raise RuntimeError("JOB_BACKEND is a Redis URL but the redis package is not installed (pip install redis)")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._claim = self.client.register_script(_CLAIM)
+        self._renew = self.client.register_script(_RENEW)
+        self._release = self.client.register_script(_RELEASE)
+        self._requeue_expired = self.client.register_script(_REQUEUE_EXPIRED)
+
+    @staticmethod
+    def _keys(queue: str) -> Tuple[str, str, str, str]:
+        return f"{queue}:pending", f"{queue}:leases", f"{queue}:owners", f"{queue}:deliveries"
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def push(self, queue: str, job_id: str) -> None:
+        self.client.lpush(self._keys(queue)[0], job_id)
+
+    def claim(self, queue: str, worker: str, lease: float) -> Optional[Tuple[str, int]]:
+        claimed = self._claim(keys=self._keys(queue), args=[worker, lease])
+        return (claimed[0], int(claimed[1])) if claimed else None
+
+    def renew(self, queue: str, job_id: str, worker: str, lease: float) -> bool:
+        _, leases, owners, _ = self._keys(queue)
+        return bool(self._renew(keys=[leases, owners], args=[job_id, worker, lease]))
+
+    def release(self, queue: str, job_id: str, worker: str) -> bool:
+        return bool(self._release(keys=self._keys(queue)[1:], args=[job_id, worker]))
+
+    def requeue_expired(self, queue: str, max_deliveries: int) -> Tuple[List[str], List[str]]:
+        requeued, dead = self._requeue_expired(keys=self._keys(queue), args=[max_deliveries])
+        return list(requeued), list(dead)
+
+    def queue_stats(self, queue: str) -> Dict[str, int]:
+        pending, leases, _, _ = self._keys(queue)
+        return {"pending": self.client.llen(pending), "leased": self.client.zcard(leases)}
+
+
+class SharedCache:
+    def __init__(self, backend, namespace: str, ttl: float):
+        """
+        JSON values shared by every node through the job backend.
+
+        Args:
+            backend: MemoryBackend or RedisBackend
+            namespace (str): Key prefix, also the cache name in cache_lookups_total
+            ttl (float): Seconds an entry lives
+        """
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, parts) -> str:
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{BACKEND_PREFIX}:cache:{self.namespace}:{digest}"
+
+    def get(self, *parts):
+        try:
+            value = self.backend.get(self._key(parts))
+        except Exception as e:
+            print(f"Shared {self.namespace} cache lookup failed: {e}")
+            return None
+        record_cache_lookup(self.namespace, value is not None)
+        return json.loads(value) if value is not None else None
+
+    def set(self, value, *parts) -> None:
+        try:
+            self.backend.set(self._key(parts), json.dumps(value), self.ttl)
+        except Exception as e:
+            print(f"Shared {self.namespace} cache store failed: {e}")
+
+
+_default_backend = None
+_default_backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    Return the process-wide job/cache backend configured from the environment, or None in single-node mode.
+
+    JOB_BACKEND: unset or "off" (default) runs every job in the API process that received it,
+        "memory" uses the in-process stand-in, a redis:// or rediss:// URL shares
+        the queue and caches between nodes
+    """
+    global _default_backend
+    setting = os.getenv("JOB_BACKEND", "off").strip()
+    if setting.lower() in ("", "off"):
+        return None
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = MemoryBackend() if setting.lower() == "memory" else RedisBackend(setting)
+        return _default_backend
+
+
+def shared_cache(namespace: str, ttl_env: str, default_ttl: float) -> Optional[SharedCache]:
+    """
+    A cache shared between nodes, or None when there is no backend or its TTL is 0.
+
+    Args:
+        namespace (str): Cache name
+        ttl_env (str): Environment variable with the TTL in seconds
+        default_ttl (float): TTL when the variable is unset
+    """
+    backend = get_backend()
+    ttl = float(os.getenv(ttl_env, str(default_ttl)))
+    if backend is None or ttl <= 0:
+        return None
+    return SharedCache(backend, namespace, ttl)
+
+
+_current_job: ContextVar[Optional[str]] = ContextVar("current_job", default=None)
+
+
+@contextmanager
+def job_scope(job_id: str):
+    """Mark everything run inside the block (and in threads started with a copy of the context) as part of a queued job."""
+    token = _current_job.set(job_id)
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def current_job_id() -> Optional[str]:
+    return _current_job.get()
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from Metrics.instrumentation import record_job_event, registry
+from Server.backend import BACKEND_PREFIX, get_backend
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobQueue:
+    def __init__(self, backend, name: str = "jobs", lease_seconds: float = 60.0, max_deliveries: int = 3,
+                 result_ttl: float = 3600.0):
+        """
+        Blog jobs handed from API nodes to workers on any node.
+
+        A worker claims a job with a lease and renews it with heartbeats while the job
+        runs. When a worker dies the heartbeats stop, the lease runs out, and the job
+        goes back to the front of the queue for another worker, up to `max_deliveries`
+        times. Job records (status, result, error) live in the backend so that any API
+        node can answer for any job.
+
+        Args:
+            backend: MemoryBackend or RedisBackend
+            name (str): Queue name
+            lease_seconds (float): Seconds a claim lasts without a heartbeat
+            max_deliveries (int): Claims of one job before it is failed instead of re-delivered
+            result_ttl (float): Seconds a finished job's record is kept
+        """
+        self.backend = backend
+        self.queue = f"{BACKEND_PREFIX}:{name}"
+        self.lease_seconds = lease_seconds
+        self.max_deliveries = max_deliveries
+        self.result_ttl = result_ttl
+
+    @classmethod
+    def from_env(cls, backend) -> "JobQueue":
+        """JOB_LEASE_SECONDS, JOB_MAX_DELIVERIES and JOB_RESULT_TTL."""
+        return cls(
+            backend,
+            lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+            max_deliveries=int(os.getenv("JOB_MAX_DELIVERIES", "3")),
+            result_ttl=float(os.getenv("JOB_RESULT_TTL", "3600")),
+        )
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.queue}:job:{job_id}"
+
+    def _cancel_key(self, job_id: str) -> str:
+        return f"{self.queue}:cancel:{job_id}"
+
+    def _save(self, job: Dict, ttl: Optional[float] = None) -> None:
+        self.backend.set(self._key(job["id"]), json.dumps(job), ttl)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        value = self.backend.get(self._key(job_id))
+        return json.loads(value) if value is not None else None
+
+    def enqueue(self, kind: str, payload: Dict, job_id: Optional[str] = None) -> str:
+        """
+        Queue a job and return its id.
+
+        Args:
+            kind (str): Which pipeline runs it, e.g. "blog" or "variants"
+            payload (Dict): JSON-serializable request
+            job_id (str): Id chosen by the caller, a random one when None
+        """
+        job = {
+            "id": job_id or uuid.uuid4().hex,
+            "kind": kind,
+            "payload": payload,
+            "status": QUEUED,
+            "enqueued_at": time.time(),
+            "deliveries": 0,
+        }
+        self._save(job)
+        self.backend.push(self.queue, job["id"])
+        record_job_event(kind, "enqueued")
+        return job["id"]
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Lease the next job for `worker`, or None when the queue is empty."""
+        while True:
+            claimed = self.backend.claim(self.queue, worker, self.lease_seconds)
+            if claimed is None:
+                return None
+            job_id, deliveries = claimed
+            job = self.get(job_id)
+            # A re-delivered job may have been finished meanwhile by the worker that lost its lease
+            if job is None or job["status"] in FINISHED:
+                self.backend.release(self.queue, job_id, worker)
+                continue
+            if deliveries > 1:
+                print(f"Job {job_id} re-delivered to {worker} (delivery {deliveries})")
+                record_job_event(job["kind"], "redelivered")
+            job.update(status=RUNNING, worker=worker, deliveries=deliveries, started_at=time.time())
+            self._save(job)
+            return job
+
+    def heartbeat(self, job: Dict, worker: str) -> bool:
+        """Extend the lease. False when it was lost, i.e. the job was handed to another worker."""
+        return self.backend.renew(self.queue, job["id"], worker, self.lease_seconds)
+
+    def complete(self, job: Dict, worker: str, result) -> None:
+        self._finish(job, worker, DONE, result=result)
+
+    def fail(self, job: Dict, worker: str, error: str) -> None:
+        self._finish(job, worker, FAILED, error=error)
+
+    def cancelled(self, job: Dict, worker: str, reason: str) -> None:
+        """Record that the worker stopped the job because it was cancelled."""
+        self._finish(job, worker, CANCELLED, error=f"Cancelled ({reason})")
+
+    def cancel(self, job_id: str, reason: str) -> bool:
+        """
+        Ask for a job to be cancelled, wherever it is.
+
+        A queued job is cancelled at once. A running job is flagged; the worker
+        running it polls the flag and stops the job at its next cancellation point.
+
+        Returns:
+            bool: False when there is no such job or it already finished
+        """
+        job = self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return False
+        # Flagged first, so a worker claiming the job meanwhile still sees it
+        self.backend.set(self._cancel_key(job_id), reason, self.result_ttl)
+        if job["status"] == QUEUED:
+            job.update(status=CANCELLED, finished_at=time.time(), error=f"Cancelled ({reason})")
+            self._save(job, self.result_ttl)
+            record_job_event(job["kind"], "cancelled")
+        return True
+
+    def cancel_requested(self, job_id: str) -> Optional[str]:
+        """The reason a job was cancelled, or None when it was not."""
+        return self.backend.get(self._cancel_key(job_id))
+
+    def _finish(self, job: Dict, worker: str, status: str, **fields) -> None:
+        # The result is kept even when the lease was lost; the re-delivered copy then finds it done
+        self.backend.release(self.queue, job["id"], worker)
+        job.update(status=status, finished_at=time.time(), **fields)
+        self._save(job, self.result_ttl)
+        record_job_event(job["kind"], {DONE: "completed", FAILED: "failed", CANCELLED: "cancelled"}[status])
+
+    def requeue_expired(self) -> List[str]:
+        """
+        Re-deliver jobs whose worker stopped heartbeating, and fail those delivered too often.
+
+        Safe to call from every worker; each expired lease is handled once.
+
+        Returns:
+            List[str]: Ids of the re-queued jobs
+        """
+        requeued, dead = self.backend.requeue_expired(self.queue, self.max_deliveries)
+        for job_id in requeued:
+            print(f"Lease on job {job_id} expired, re-queued")
+        for job_id in dead:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                continue
+            print(f"Job {job_id} lost its worker {self.max_deliveries} times, giving up")
+            job.update(status=FAILED, finished_at=time.time(),
+                       error=f"Workers stopped responding on all {self.max_deliveries} deliveries")
+            self._save(job, self.result_ttl)
+            record_job_event(job["kind"], "dead")
+        return requeued
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.queue_stats(self.queue)
+
+    def render_metrics(self) -> List[str]:
+        try:
+            stats = self.stats()
+        except Exception as e:
+            # /metrics keeps working while the backend is unreachable
+            print(f"Could not read job queue stats: {e}")
+            return []
+        return [
+            "# HELP blog_jobs_pending Jobs waiting in the shared queue",
+            "# TYPE blog_jobs_pending gauge",
+            f"blog_jobs_pending {stats['pending']}",
+            "# HELP blog_jobs_leased Jobs currently leased by a worker",
+            "# TYPE blog_jobs_leased gauge",
+            f"blog_jobs_leased {stats['leased']}",
+        ]
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+def get_job_queue() -> Optional[JobQueue]:
+    """Return the process-wide job queue on the JOB_BACKEND backend, or None in single-node mode."""
+    global _default_queue
+    backend = get_backend()
+    if backend is None:
+        return None
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue.from_env(backend)
+            registry.register_collector(_default_queue.render_metrics)
+        return _default_queue
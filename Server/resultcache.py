@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from Metrics.instrumentation import record_cache_lookup
+from Server.singleflight import normalize_value
+
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+class ResultCache:
+    def __init__(self, directory: str = ".cache/results", ttl: float = 6 * 3600, stale_ttl: float = 24 * 3600,
+                 max_entries: int = 500, max_bytes: int = 200 * 1024 * 1024):
+        """
+        Finished blog results persisted on local disk, one JSON file per key.
+
+        Args:
+            directory (str): Where the entries are stored
+            ttl (float): Seconds an entry is served as fresh
+            stale_ttl (float): Further seconds an expired entry may be served while it is refreshed
+            max_entries (int): Entries kept before the least recently used are evicted
+            max_bytes (int): Total size kept before the least recently used are evicted
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """RESULT_CACHE_DIR, RESULT_CACHE_TTL, RESULT_CACHE_STALE_TTL, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_MB."""
+        return cls(
+            directory=os.getenv("RESULT_CACHE_DIR", ".cache/results"),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", str(6 * 3600))),
+            stale_ttl=float(os.getenv("RESULT_CACHE_STALE_TTL", str(24 * 3600))),
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "500")),
+            max_bytes=int(float(os.getenv("RESULT_CACHE_MAX_MB", "200")) * 1024 * 1024),
+        )
+
+    @staticmethod
+    def key_for(topic: str, method: str, word_count: int, scrape_thumbnail: bool) -> str:
+        parts = [normalize_value(topic), normalize_value(method), word_count, scrape_thumbnail]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Tuple[Optional[Dict], Optional[str], float]:
+        """
+        Look up a result.
+
+        Returns:
+            Tuple: (result, FRESH/STALE or None on a miss, age in seconds)
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            record_cache_lookup("result", False)
+            return None, None, 0.0
+
+        age = time.time() - entry["created"]
+        if age > self.ttl + self.stale_ttl:
+            record_cache_lookup("result", False)
+            return None, None, age
+
+        # Reads refresh the access time used for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        record_cache_lookup("result", True)
+        return entry["result"], FRESH if age <= self.ttl else STALE, age
+
+    def set(self, key: str, result: Dict) -> None:
+        # Created on the first write, so constructing a cache has no side effects
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "result": result}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop entries unused for longer than they could be served, then the least recently used until within bounds."""
+        with self._lock:
+            entries = []
+            now = time.time()
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            while entries and (
+                len(entries) > self.max_entries
+                or total_bytes > self.max_bytes
+                or now - entries[0][0] > self.ttl + self.stale_ttl
+            ):
+                _, size, path = entries.pop(0)
+                total_bytes -= size
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
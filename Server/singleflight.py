@@ -0,0 +1,93 @@
+import asyncio
+import copy
+import os
+import re
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from Metrics.instrumentation import record_cache_lookup
+
+
+DEFAULT_KEY_FIELDS = ("topic", "method", "max_results", "word_count", "scrape_thumbnail", "max_source_age_hours",
+                      "deadline_seconds", "token_budget")
+
+
+class TooManyWaitersError(RuntimeError):
+    """A key already has the maximum number of callers waiting on it."""
+
+
+def normalize_value(value):
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip().lower()
+    return value
+
+
+class SingleFlight:
+    def __init__(self, key_fields: Iterable[str] = DEFAULT_KEY_FIELDS, max_waiters_per_key: int = 16):
+        """
+        Coalesce concurrent identical requests into one execution.
+
+        The first caller for a key starts the job; callers arriving while it runs
+        wait for the same result instead of starting their own.
+
+        Args:
+            key_fields (Iterable[str]): Request fields that make two requests identical.
+                Empty disables coalescing
+            max_waiters_per_key (int): Callers allowed to share one job, including the first
+        """
+        self.key_fields = tuple(key_fields)
+        self.max_waiters_per_key = max_waiters_per_key
+        self._flights: Dict[Tuple, Dict] = {}
+
+    @classmethod
+    def from_env(cls) -> "SingleFlight":
+        """COALESCE_KEY_FIELDS (comma-separated, empty disables) and COALESCE_MAX_WAITERS."""
+        fields = os.getenv("COALESCE_KEY_FIELDS", ",".join(DEFAULT_KEY_FIELDS))
+        return cls(
+            key_fields=[field.strip() for field in fields.split(",") if field.strip()],
+            max_waiters_per_key=int(os.getenv("COALESCE_MAX_WAITERS", "16")),
+        )
+
+    def key_for(self, request) -> Optional[Tuple]:
+        if not self.key_fields:
+            return None
+        return tuple((field, normalize_value(getattr(request, field, None))) for field in self.key_fields)
+
+    async def run(self, key: Optional[Tuple], func: Callable[[], Awaitable]):
+        """
+        Run `func` for `key`, or join the run already in flight.
+
+        The job runs as its own task, so a caller that goes away does not cancel
+        it for the others; it is cancelled only once every caller has gone. Every
+        caller gets its own copy of the result.
+        """
+        if key is None:
+            return await func()
+
+        flight = self._flights.get(key)
+        # A finished or cancelled run is not joined; it is only waiting for its done-callback
+        if flight is None or flight["task"].done():
+            task = asyncio.ensure_future(func())
+            flight = {"task": task, "waiters": 0}
+            self._flights[key] = flight
+            task.add_done_callback(lambda _: self._drop(key, flight))
+            record_cache_lookup("singleflight", False)
+        else:
+            if flight["waiters"] >= self.max_waiters_per_key:
+                raise TooManyWaitersError(f"{flight['waiters']} requests already waiting for this job")
+            record_cache_lookup("singleflight", True)
+
+        flight["waiters"] += 1
+        try:
+            result = await asyncio.shield(flight["task"])
+        finally:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not flight["task"].done():
+                # Forget the run as it is cancelled, so the next caller starts a new one
+                self._drop(key, flight)
+                flight["task"].cancel()
+        return copy.deepcopy(result)
+
+    def _drop(self, key: Tuple, flight: Dict) -> None:
+        # Only if it is still this flight; a newer one may have taken the key
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -0,0 +1,160 @@
+"""
+Worker process for multi-node mode: claims blog jobs from the shared queue and runs them.
+
+Start any number of these, on any node, next to the API nodes. All of them need the
+same JOB_BACKEND (a Redis URL) as the API:
+
+    JOB_BACKEND=redis://redis:6379/0 python -m Server.worker --concurrency 4
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from Server.backend import RedisBackend, get_backend, job_scope
+from Metrics.cancellation import CancelToken, Cancelled, cancel_scope
+from Server.jobqueue import JobQueue, get_job_queue
+
+# Seconds between checks of a running job's cancel flag
+CANCEL_POLL_SECONDS = 1.0
+
+
+class Worker:
+    def __init__(self, queue: JobQueue, handler: Callable[[Dict], Dict], concurrency: int = 2,
+                 poll_interval: float = 0.5, node: Optional[str] = None):
+        """
+        Run queued jobs on `concurrency` threads, heartbeating each job's lease while it runs.
+
+        Every worker also re-queues jobs whose lease expired, so jobs of a dead
+        worker are picked up by whichever node notices first. A job cancelled
+        through the queue is stopped at its next cancellation point.
+
+        Args:
+            queue (JobQueue): Where jobs come from
+            handler (Callable): Runs one job record and returns its result; called from worker threads
+            concurrency (int): Jobs this node runs at the same time
+            poll_interval (float): Seconds between claim attempts while the queue is empty
+            node (str): Name of this node in lease owners and logs, defaults to host:pid
+        """
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for slot in range(self.concurrency):
+            thread = threading.Thread(target=self._run, args=(f"{self.node}/{slot}",), name=f"job-worker-{slot}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        reaper = threading.Thread(target=self._reap, name="job-reaper", daemon=True)
+        reaper.start()
+        self._threads.append(reaper)
+        print(f"Worker {self.node} running {self.concurrency} job(s) at a time")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop claiming jobs and wait for the running ones to finish."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, worker: str) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(worker)
+            except Exception as e:
+                print(f"{worker} could not claim a job: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                self._process(job, worker)
+            except Exception as e:
+                # Recording the outcome failed; the lease runs out and the job is re-delivered
+                print(f"{worker} could not finish job {job['id']}: {e}")
+
+    def _process(self, job: Dict, worker: str) -> None:
+        token = CancelToken(job["id"])
+        finished = threading.Event()
+        renew_every = self.queue.lease_seconds / 3
+
+        def heartbeat():
+            renewed = time.monotonic()
+            while not finished.wait(min(renew_every, CANCEL_POLL_SECONDS)):
+                try:
+                    reason = self.queue.cancel_requested(job["id"])
+                    if reason is not None:
+                        token.cancel(reason)
+                    if time.monotonic() - renewed >= renew_every:
+                        renewed = time.monotonic()
+                        if not self.queue.heartbeat(job, worker):
+                            print(f"{worker} lost the lease on job {job['id']}; it may run twice")
+                            return
+                except Exception as e:
+                    print(f"{worker} could not renew or check the lease on job {job['id']}: {e}")
+
+        # Cancelled before this worker got to it
+        reason = self.queue.cancel_requested(job["id"])
+        if reason is not None:
+            self.queue.cancelled(job, worker, reason)
+            return
+
+        beat = threading.Thread(target=heartbeat, name=f"heartbeat-{job['id'][:8]}", daemon=True)
+        beat.start()
+        try:
+            with job_scope(job["id"]), cancel_scope(token):
+                result = self.handler(job)
+        except Cancelled:
+            finished.set()
+            print(f"{worker} stopped cancelled job {job['id']}")
+            self.queue.cancelled(job, worker, token.reason)
+        except Exception as e:
+            traceback.print_exc()
+            finished.set()
+            self.queue.fail(job, worker, str(e))
+        else:
+            finished.set()
+            self.queue.complete(job, worker, result)
+        finally:
+            beat.join()
+
+    def _reap(self) -> None:
+        while not self._stop.wait(self.queue.lease_seconds / 2):
+            try:
+                self.queue.requeue_expired()
+            except Exception as e:
+                print(f"Could not re-queue expired jobs: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "2")),
+                        help="Jobs this node runs at the same time (default: WORKER_CONCURRENCY or 2)")
+    args = parser.parse_args()
+
+    # Imported first: it loads .env, which may be where JOB_BACKEND is set
+    from main import run_queued_job
+    if not isinstance(get_backend(), RedisBackend):
+        raise SystemExit("Set JOB_BACKEND to the Redis URL the API nodes use")
+
+    worker = Worker(get_job_queue(), run_queued_job, concurrency=args.concurrency)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    worker.start()
+    while not stopping.wait(1.0):
+        pass
+    print(f"Worker {worker.node} stopping after its running jobs")
+    worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from Metrics.instrumentation import current_timings, record_boilerplate
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def domain_of(url: str) -> str:
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def block_hash(block: str) -> str:
+    """Hash of a paragraph, ignoring case and whitespace differences."""
+    return _digest(_WHITESPACE.sub(" ", block).strip().lower())
+
+
+class BoilerplateFilter:
+    def __init__(self, path: str = ".cache/boilerplate.sqlite3", min_pages: int = 3, max_block_chars: int = 600,
+                 max_age: float = 30 * 24 * 3600, evict_every: int = 200):
+        """
+        Learns which paragraphs a site repeats on every page (cookie notices, newsletter
+        pitches, related-article lists, author bios) and strips them from scraped content.
+
+        Each scraped page records a hash of every short paragraph under its domain. A
+        paragraph found on at least `min_pages` different pages of the same domain is
+        boilerplate and removed wherever it appears on that domain.
+
+        Args:
+            path (str): SQLite file shared by all workers on the machine
+            min_pages (int): Distinct pages of a domain a paragraph must appear on to be stripped
+            max_block_chars (int): Longer paragraphs are never treated as boilerplate
+            max_age (float): Seconds after which a sighting is forgotten
+            evict_every (int): Forget old sightings after this many observed pages
+        """
+        self.path = path
+        self.min_pages = min_pages
+        self.max_block_chars = max_block_chars
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self._observed = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS block_sightings (
+                    domain TEXT NOT NULL,
+                    block TEXT NOT NULL,
+                    page TEXT NOT NULL,
+                    seen_at REAL NOT NULL,
+                    PRIMARY KEY (domain, block, page)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS block_sightings_seen_at ON block_sightings (seen_at)")
+
+    def _blocks(self, content: str) -> Dict[str, str]:
+        """Hash of every paragraph short enough to be boilerplate."""
+        return {
+            block_hash(line): line
+            for line in content.split("\n")
+            if line.strip() and len(line) <= self.max_block_chars
+        }
+
+    def observe(self, url: str, content: str) -> None:
+        """Record the paragraphs of one scraped page."""
+        blocks = self._blocks(content)
+        if not blocks:
+            return
+        domain, page, now = domain_of(url), _digest(url), time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO block_sightings (domain, block, page, seen_at) VALUES (?, ?, ?, ?)",
+                [(domain, block, page, now) for block in blocks],
+            )
+            self._observed += 1
+            evict = self._observed % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def clean(self, url: str, content: str) -> Tuple[str, int]:
+        """
+        Remove the domain's boilerplate paragraphs from `content`.
+
+        Returns:
+            (str, int): Cleaned content and the number of characters removed
+        """
+        blocks = self._blocks(content)
+        if not blocks:
+            return content, 0
+        hashes = list(blocks)
+        boilerplate = set()
+        with self._lock:
+            # Batches stay under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT block FROM block_sightings WHERE domain = ? AND page != ? AND block IN ({','.join('?' * len(batch))}) "
+                    "GROUP BY block HAVING COUNT(*) >= ?",
+                    [domain_of(url), _digest(url), *batch, self.min_pages - 1],
+                ).fetchall()
+                boilerplate.update(block for (block,) in rows)
+        if not boilerplate:
+            return content, 0
+        kept = [line for line in content.split("\n") if not line.strip() or block_hash(line) not in boilerplate]
+        cleaned = re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+        return cleaned, len(content) - len(cleaned)
+
+    def evict(self) -> int:
+        """Forget sightings older than max_age. Returns rows removed."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM block_sightings WHERE seen_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+
+
+def strip_boilerplate(url: str, content: str, learn: bool = True) -> str:
+    """
+    Learn from a page and return its content without the domain's boilerplate.
+
+    Characters removed are reported as estimated tokens to /metrics and to the
+    current request's breakdown. Returns `content` unchanged when the filter is off.
+
+    Args:
+        url (str): Page the content came from
+        content (str): Extracted main content, one paragraph per line
+        learn (bool): Record this page's paragraphs; False for content already seen,
+            like documents served from the corpus index
+    """
+    boilerplate = get_boilerplate_filter()
+    if boilerplate is None or not content:
+        return content
+    try:
+        if learn:
+            boilerplate.observe(url, content)
+        cleaned, removed = boilerplate.clean(url, content)
+    except sqlite3.Error as e:
+        print(f"Boilerplate filter failed for {url}: {e}")
+        return content
+    if removed:
+        # Same rough 4-characters-per-token rule the summarizer uses
+        tokens = removed // 4
+        record_boilerplate(domain_of(url), tokens)
+        timings = current_timings()
+        if timings is not None:
+            timings.count("boilerplate_tokens_removed", tokens)
+    return cleaned
+
+
+_default_filter = None
+_default_filter_lock = threading.Lock()
+
+def get_boilerplate_filter() -> Optional[BoilerplateFilter]:
+    """
+    Return the process-wide boilerplate filter configured from the environment, or None when disabled.
+
+    BOILERPLATE_FILTER: "on" (default) or "off"
+    BOILERPLATE_DB: SQLite file (default: .cache/boilerplate.sqlite3)
+    BOILERPLATE_MIN_PAGES: pages of a domain a paragraph must appear on to be stripped (default: 3)
+    BOILERPLATE_MAX_AGE_DAYS: days a sighting is remembered (default: 30)
+    """
+    global _default_filter
+    if os.getenv("BOILERPLATE_FILTER", "on").lower() == "off":
+        return None
+    with _default_filter_lock:
+        if _default_filter is None:
+            _default_filter = BoilerplateFilter(
+                path=os.getenv("BOILERPLATE_DB", ".cache/boilerplate.sqlite3"),
+                min_pages=int(os.getenv("BOILERPLATE_MIN_PAGES", "3")),
+                max_age=float(os.getenv("BOILERPLATE_MAX_AGE_DAYS", "30")) * 24 * 3600,
+            )
+        return _default_filter
@@ -0,0 +1,229 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from Metrics.instrumentation import record_cache_lookup
+from Tools.boilerplate import strip_boilerplate
+
+# Words too common to say anything about what a document covers
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of",
+    "on", "or", "that", "the", "this", "to", "vs", "what", "when", "where", "which", "who", "why", "with",
+}
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def query_terms(text: str) -> List[str]:
+    """Distinct lower-case words of a search query, without stopwords."""
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        if word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    return terms
+
+
+class CorpusIndex:
+    def __init__(self, path: str = ".cache/corpus.sqlite3", max_age: float = 30 * 24 * 3600,
+                 max_documents: int = 10000, min_coverage: float = 1.0, evict_every: int = 100):
+        """
+        Full-text index (SQLite FTS5) of every document the scraper extracted successfully.
+
+        Pipelines look here before searching the web, so topics close to earlier
+        jobs are researched from documents already on disk.
+
+        Args:
+            path (str): SQLite file shared by all workers on the machine
+            max_age (float): Seconds after fetching when a document is evicted
+            max_documents (int): Documents kept; the oldest fetches are evicted first
+            min_coverage (float): Share of the query's terms a document must contain to count as a hit
+            evict_every (int): Run eviction after this many inserts
+        """
+        self.path = path
+        self.max_age = max_age
+        self.max_documents = max_documents
+        self.min_coverage = min_coverage
+        self.evict_every = evict_every
+        self._inserts = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    url TEXT NOT NULL UNIQUE,
+                    title TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    publish_date TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS documents_fetched_at ON documents (fetched_at)")
+            # External-content FTS table kept in sync by triggers, so text is stored once
+            self._conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts
+                USING fts5(title, content, content='documents', content_rowid='id')
+            """)
+            self._conn.executescript("""
+                CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+                    INSERT INTO documents_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+                    INSERT INTO documents_fts (documents_fts, rowid, title, content)
+                    VALUES ('delete', old.id, old.title, old.content);
+                END;
+            """)
+
+    def add(self, result: Dict) -> None:
+        """
+        Insert or refresh one scraped document.
+
+        Args:
+            result (dict): WebScraper result with url, title, main_content and publish_date
+        """
+        url = result.get("url")
+        content = (result.get("main_content") or "").strip()
+        if not url or not content:
+            return
+        with self._lock, self._conn:
+            # Delete then insert so the FTS triggers see the old text leave
+            self._conn.execute("DELETE FROM documents WHERE url = ?", (url,))
+            self._conn.execute(
+                "INSERT INTO documents (url, title, content, publish_date, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (url, result.get("title") or "", content, result.get("publish_date") or "", time.time()),
+            )
+            self._inserts += 1
+            evict = self._inserts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def search(self, query: str, limit: int = 5, max_age: Optional[float] = None) -> List[Dict]:
+        """
+        Best matching documents fetched within max_age seconds.
+
+        Args:
+            query (str): Search topic or query
+            limit (int): Maximum documents to return
+            max_age (float): Only documents fetched this recently count, None for any age
+
+        Returns:
+            List[Dict]: Documents shaped like WebScraper results, plus publish_date
+        """
+        terms = query_terms(query)
+        if not terms or limit <= 0:
+            return []
+        match = " OR ".join('"%s"' % term.replace('"', '""') for term in terms)
+        oldest = time.time() - max_age if max_age is not None else 0.0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT d.url, d.title, d.content, d.publish_date "
+                "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+                "WHERE documents_fts MATCH ? AND d.fetched_at >= ? "
+                "ORDER BY bm25(documents_fts, 5.0, 1.0) LIMIT ?",
+                (match, oldest, limit * 5),
+            ).fetchall()
+
+        documents = []
+        for url, title, content, publish_date in rows:
+            words = set(_WORD.findall(f"{title} {content}".lower()))
+            if sum(1 for term in terms if term in words) / len(terms) < self.min_coverage:
+                continue
+            documents.append({
+                "url": url,
+                "title": title,
+                "main_content": content,
+                "publish_date": publish_date,
+            })
+            if len(documents) >= limit:
+                break
+        return documents
+
+    def evict(self) -> int:
+        """Drop documents older than max_age, then the oldest beyond max_documents. Returns rows removed."""
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM documents WHERE fetched_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM documents WHERE id IN "
+                "(SELECT id FROM documents ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_documents,),
+            ).rowcount
+        if removed:
+            print(f"Evicted {removed} document(s) from the corpus index")
+        return removed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+
+CORPUS_FRESHNESS_HOURS = float(os.getenv("CORPUS_FRESHNESS_HOURS", "168"))
+
+def freshness_seconds(max_source_age_hours: Optional[float]) -> float:
+    """A request's freshness policy in seconds; None falls back to CORPUS_FRESHNESS_HOURS."""
+    hours = CORPUS_FRESHNESS_HOURS if max_source_age_hours is None else max_source_age_hours
+    return max(0.0, hours) * 3600
+
+
+def local_documents(query: str, wanted: int, max_source_age_hours: Optional[float] = None) -> List[Dict]:
+    """
+    Documents from the corpus index that can stand in for web results.
+
+    Returns an empty list when the index is disabled or the request's freshness
+    policy is 0 (always research on the web).
+
+    Args:
+        query (str): Search topic or query
+        wanted (int): Documents needed
+        max_source_age_hours (float): Oldest acceptable fetch, None for the default policy
+    """
+    corpus = get_corpus_index()
+    max_age = freshness_seconds(max_source_age_hours)
+    if corpus is None or max_age <= 0 or wanted <= 0:
+        return []
+    try:
+        documents = corpus.search(query, limit=wanted, max_age=max_age)
+    except sqlite3.Error as e:
+        print(f"Corpus lookup failed for {query!r}: {e}")
+        return []
+    record_cache_lookup("corpus", bool(documents))
+    for document in documents:
+        # Boilerplate learned since the document was indexed is stripped on the way out
+        document["main_content"] = strip_boilerplate(document["url"], document["main_content"], learn=False)
+    if documents:
+        print(f"Corpus index: {len(documents)}/{wanted} document(s) for {query!r}")
+    return documents
+
+
+_default_corpus = None
+_default_corpus_lock = threading.Lock()
+
+def get_corpus_index() -> Optional[CorpusIndex]:
+    """
+    Return the process-wide corpus index configured from the environment, or None when disabled.
+
+    CORPUS_INDEX: "on" (default) or "off"
+    CORPUS_DB: SQLite file (default: .cache/corpus.sqlite3)
+    CORPUS_MAX_AGE_DAYS: days before a document is evicted (default: 30)
+    CORPUS_MAX_DOCUMENTS: documents kept (default: 10000)
+    CORPUS_MIN_COVERAGE: share of query terms a document must contain (default: 1.0)
+    """
+    global _default_corpus
+    if os.getenv("CORPUS_INDEX", "on").lower() == "off":
+        return None
+    with _default_corpus_lock:
+        if _default_corpus is None:
+            _default_corpus = CorpusIndex(
+                path=os.getenv("CORPUS_DB", ".cache/corpus.sqlite3"),
+                max_age=float(os.getenv("CORPUS_MAX_AGE_DAYS", "30")) * 24 * 3600,
+                max_documents=int(os.getenv("CORPUS_MAX_DOCUMENTS", "10000")),
+                min_coverage=float(os.getenv("CORPUS_MIN_COVERAGE", "1.0")),
+            )
+            _default_corpus.evict()
+        return _default_corpus
@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+
+def domain_of(url: str) -> str:
+    netloc = urlparse(url).netloc.lower().split('@')[-1].split(':')[0]
+    return netloc[4:] if netloc.startswith('www.') else netloc
+
+
+class DomainScoreboard:
+    def __init__(self, path: str = ".cache/domain_health.sqlite3", alpha: float = 0.3, min_attempts: int = 3,
+                 skip_below: float = 0.2, skip_ttl: float = 24 * 3600, unknown_score: float = 0.6):
+        """
+        Persistent per-domain scrape health, used to rank URLs and size timeouts.
+
+        Success rate, latency and extracted word count are kept as exponentially
+        weighted moving averages so recent behaviour counts most.
+
+        Args:
+            path (str): SQLite file shared by all workers on the machine
+            alpha (float): Weight of the newest observation in the moving averages
+            min_attempts (int): Attempts before a domain can be skipped
+            skip_below (float): Domains with a success rate under this are skipped
+            skip_ttl (float): Seconds after the last attempt when a skipped domain is tried again
+            unknown_score (float): Score given to domains with no history
+        """
+        self.path = path
+        self.alpha = alpha
+        self.min_attempts = min_attempts
+        self.skip_below = skip_below
+        self.skip_ttl = skip_ttl
+        self.unknown_score = unknown_score
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS domains (
+                    domain TEXT PRIMARY KEY,
+                    attempts INTEGER NOT NULL,
+                    successes INTEGER NOT NULL,
+                    success_rate REAL NOT NULL,
+                    latency REAL NOT NULL,
+                    words REAL NOT NULL,
+                    failure_reasons TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def record(self, url: str, success: bool, latency: float, words: int = 0, reason: Optional[str] = None) -> None:
+        """
+        Add one scrape outcome.
+
+        Args:
+            url (str): Scraped URL
+            success (bool): Whether a usable document came back
+            latency (float): Seconds the fetch took
+            words (int): Words extracted
+            reason (str): Failure reason, e.g. http_403, timeout, thin_content
+        """
+        domain = domain_of(url)
+        if not domain:
+            return
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT attempts, successes, success_rate, latency, words, failure_reasons FROM domains WHERE domain = ?",
+                (domain,),
+            ).fetchone()
+            if row is None:
+                attempts, successes = 1, int(success)
+                rate, avg_latency, avg_words, reasons = float(success), latency, float(words), {}
+            else:
+                attempts, successes = row[0] + 1, row[1] + int(success)
+                rate = self._ewma(row[2], float(success))
+                avg_latency = self._ewma(row[3], latency)
+                avg_words = self._ewma(row[4], float(words))
+                reasons = json.loads(row[5])
+            if reason:
+                reasons[reason] = reasons.get(reason, 0) + 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO domains VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (domain, attempts, successes, rate, avg_latency, avg_words, json.dumps(reasons), time.time()),
+            )
+
+    def _ewma(self, previous: float, value: float) -> float:
+        return (1 - self.alpha) * previous + self.alpha * value
+
+    def stats(self, urls: List[str]) -> Dict[str, Dict]:
+        """Health rows for the domains of the given URLs, keyed by domain."""
+        domains = list({domain_of(url) for url in urls})
+        if not domains:
+            return {}
+        placeholders = ",".join("?" for _ in domains)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT domain, attempts, successes, success_rate, latency, words, failure_reasons, updated_at "
+                f"FROM domains WHERE domain IN ({placeholders})",
+                domains,
+            ).fetchall()
+        return {
+            row[0]: {
+                "attempts": row[1], "successes": row[2], "success_rate": row[3], "latency": row[4],
+                "words": row[5], "failure_reasons": json.loads(row[6]), "updated_at": row[7],
+            }
+            for row in rows
+        }
+
+    def _score(self, stats: Optional[Dict]) -> float:
+        if stats is None:
+            return self.unknown_score
+        # Prefer reliable domains, then ones that yield more text
+        return stats["success_rate"] + 0.1 * min(stats["words"] / 1000.0, 1.0)
+
+    def _skipped(self, stats: Optional[Dict]) -> bool:
+        return (
+            stats is not None
+            and stats["attempts"] >= self.min_attempts
+            and stats["success_rate"] < self.skip_below
+            and time.time() - stats["updated_at"] < self.skip_ttl
+        )
+
+    def rank(self, urls: List[str]) -> List[str]:
+        """Drop URLs on chronically failing domains and order the rest by domain health."""
+        stats = self.stats(urls)
+        kept = [url for url in urls if not self._skipped(stats.get(domain_of(url)))]
+        if len(kept) < len(urls):
+            print(f"Skipping {len(urls) - len(kept)} URL(s) on failing domains")
+        # sorted() is stable, so search order breaks ties
+        return sorted(kept, key=lambda url: -self._score(stats.get(domain_of(url))))
+
+    def timeout_for(self, url: str, default: float, minimum: float = 3.0) -> float:
+        """Request timeout sized to the domain's usual latency, never above the default."""
+        stats = self.stats([url]).get(domain_of(url))
+        if stats is None or stats["successes"] == 0:
+            return default
+        return max(minimum, min(default, stats["latency"] * 3))
+
+
+_default_scoreboard = None
+_default_scoreboard_lock = threading.Lock()
+
+def get_domain_scoreboard() -> Optional[DomainScoreboard]:
+    """
+    Return the process-wide scoreboard configured from the environment, or None when disabled.
+
+    DOMAIN_HEALTH: "on" (default) or "off"
+    DOMAIN_HEALTH_DB: SQLite file (default: .cache/domain_health.sqlite3)
+    DOMAIN_HEALTH_SKIP_BELOW: success rate under which a domain is skipped (default: 0.2)
+    DOMAIN_HEALTH_SKIP_TTL: seconds before a skipped domain is retried (default: 86400)
+    """
+    global _default_scoreboard
+    if os.getenv("DOMAIN_HEALTH", "on").lower() == "off":
+        return None
+    with _default_scoreboard_lock:
+        if _default_scoreboard is None:
+            _default_scoreboard = DomainScoreboard(
+                path=os.getenv("DOMAIN_HEALTH_DB", ".cache/domain_health.sqlite3"),
+                skip_below=float(os.getenv("DOMAIN_HEALTH_SKIP_BELOW", "0.2")),
+                skip_ttl=float(os.getenv("DOMAIN_HEALTH_SKIP_TTL", str(24 * 3600))),
+            )
+        return _default_scoreboard
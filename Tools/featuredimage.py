@@ -1,8 +1,9 @@
-import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import re
 import json
+from Tools.transport import get_http_session
+from Metrics.deadline import current_deadline, run_time_boxed
 
 class FeaturedImageExtractor:
     def __init__(self, timeout=10):
@@ -13,10 +14,8 @@ class FeaturedImageExtractor:
             timeout (int): Request timeout in seconds
         """
         self.timeout = timeout
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        # Shared with the scraper, so the article page's connection is reused for its images
+        self.session = get_http_session()
         self.max_file_size = 5 * 1024 * 1024  # 5MB in bytes
         self.valid_extensions = ['jpg', 'jpeg', 'png', 'webp']
     
@@ -140,17 +139,18 @@ class FeaturedImageExtractor:
                     return None
             
             # If HEAD request doesn't give us content-length, try GET with stream
-            response = self.session.get(url, timeout=self.timeout, stream=True)
-            response.raise_for_status()
-            
-            # Check actual size by reading content
-            content = b''
-            size = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                size += len(chunk)
-                if size > self.max_file_size:
-                    return None
-                content += chunk
+            # Closing the response hands the connection back to the pool, even when we stop early
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                
+                # Check actual size by reading content
+                content = b''
+                size = 0
+                for chunk in response.iter_content(chunk_size=8192):
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        return None
+                    content += chunk
             
             # Try to get image dimensions (basic check)
             width, height = self._get_image_dimensions_from_content(content)
@@ -342,6 +342,32 @@ class FeaturedImageExtractor:
             "success": False,
             "image_url": None
         }
+
+    def get_featured_image_within_deadline(self, urls):
+        """
+        get_featured_image, time-boxed to what is left of the current request's deadline.
+
+        Without a deadline this is get_featured_image. With one, the search is skipped
+        when less than a second is left and abandoned when time runs out; both are
+        recorded as degradations.
+
+        Args:
+            urls (list): List of URLs to try
+
+        Returns:
+            dict: JSON response with success status and image URL, or None when skipped
+        """
+        budget = current_deadline()
+        if budget is None:
+            return self.get_featured_image(urls)
+        limit = budget.remaining()
+        if limit < 1.0:
+            budget.degrade("image", "skipped", f"{max(limit, 0.0):.1f}s left")
+            return None
+        finished, result = run_time_boxed(self.get_featured_image, limit, urls)
+        if not finished:
+            budget.degrade("image", "timed_out", f"gave up after {limit:.1f}s")
+        return result
     
     def _get_og_image(self, soup):
         """Extract Open Graph image"""
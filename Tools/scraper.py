@@ -1,202 +1,681 @@
 import requests
 from bs4 import BeautifulSoup
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional
 import time
-from newspaper import Article
+import os
+import math
+import re
+import codecs
+import threading
+import contextvars
+import multiprocessing
+import queue
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from Metrics.instrumentation import record_scrape
+from Tools.domainhealth import get_domain_scoreboard
+from Tools.transport import get_transport
+from Tools.corpus import get_corpus_index
+from Tools.boilerplate import strip_boilerplate
+from Server.backend import shared_cache
+from Metrics.cancellation import cancellable_sleep, check_cancelled, current_cancel_token
 
-# Handle different readability package versions
-try:
-    from readability import Document
-except ImportError:
-    Document = None
+
+# Quorum scraping: fetch more URLs than needed concurrently and stop once enough are good
+SCRAPE_MODE = os.getenv("SCRAPE_MODE", "quorum")  # "quorum" or "sequential"
+SCRAPE_OVERFETCH = float(os.getenv("SCRAPE_OVERFETCH", "1.5"))
+SCRAPE_DEADLINE_SECONDS = float(os.getenv("SCRAPE_DEADLINE_SECONDS", "20"))
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "8"))
+MIN_CONTENT_CHARS = 100
+
+# Streaming fetch: only HTML is downloaded, and never more than SCRAPE_MAX_BYTES
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(3 * 1024 * 1024)))
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?\s*([a-zA-Z0-9_\-]+)', re.IGNORECASE)
+
+
+class SkippedContentError(Exception):
+    """The response is not worth downloading: not HTML, or larger than the byte cap."""
+
+
+class RobotsDisallowedError(SkippedContentError):
+    """robots.txt disallows the URL and RESPECT_ROBOTS_TXT is on."""
+
+
+def _charset_from_content_type(content_type: str) -> Optional[str]:
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            return value.strip('"\' ')
+    return None
+
+
+def sniff_encoding(content_type: str, head: bytes) -> str:
+    """
+    Pick the charset for a page without chardet: BOM, then the Content-Type header,
+    then a <meta charset> in the first bytes, then UTF-8.
+    """
+    for bom, name in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if head.startswith(bom):
+            return name
+    meta = _META_CHARSET.search(head[:4096])
+    for candidate in (_charset_from_content_type(content_type), meta.group(1).decode('ascii') if meta else None):
+        if candidate:
+            try:
+                return codecs.lookup(candidate).name
+            except LookupError:
+                continue
+    return 'utf-8'
+
+
+def over_fetch(count: int) -> int:
+    """Number of URLs to request from Search when `count` good documents are needed."""
+    if SCRAPE_MODE != "quorum":
+        return count
+    return max(count, math.ceil(count * SCRAPE_OVERFETCH))
+
+
+def is_good_document(result: Dict) -> bool:
+    return bool(result.get('title')) and len(result.get('main_content') or '') >= MIN_CONTENT_CHARS
+
+
+def _readability_document():
+    """
+    Import readability on first use; it is slow to import and only the code that
+    parses HTML needs it. Handles different readability package versions.
+    """
+    try:
+        from readability import Document
+    except ImportError:
+        Document = None
+    return Document
+
+
+def extract_article(url: str, raw_html: bytes, encoding: Optional[str] = None) -> Dict:
+    """
+    Parse already downloaded HTML into title, content and publish date.
+
+    This is the CPU-bound part of scraping. It is a module-level function so it
+    can be sent to a worker process; it never touches the network.
+
+    Args:
+        url (str): The URL the HTML was fetched from
+        raw_html (bytes): Raw response body
+        encoding (str): Charset declared by the server, if any
+
+    Returns:
+        Dict: Compact dictionary with title, content and publish_date
+    """
+    try:
+        html = raw_html.decode(encoding or 'utf-8', errors='replace')
+    except LookupError:
+        html = raw_html.decode('utf-8', errors='replace')
+
+    # Try newspaper3k first for better content extraction
+    article_data = _extract_with_newspaper(url, html)
+
+    # Fallback to BeautifulSoup if newspaper fails
+    if not article_data['content'] or len(article_data['content']) < 100:
+        article_data = _extract_with_beautifulsoup(html, url)
+
+    return article_data
+
+
+def _extract_with_newspaper(url: str, html: str) -> Dict:
+    """Extract content using newspaper3k library."""
+    try:
+        # Imported here so only the process that parses pays for it
+        from newspaper import Article
+        article = Article(url)
+        article.download(input_html=html)
+        article.parse()
+
+        return {
+            'title': article.title or '',
+            'content': article.text or '',
+            'publish_date': str(article.publish_date) if article.publish_date else ''
+        }
+    except:
+        return {'title': '', 'content': '', 'publish_date': ''}
+
+
+def _extract_with_beautifulsoup(html: str, url: str) -> Dict:
+    """Extract content using BeautifulSoup as a fallback method."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract title
+    title = _extract_title(soup)
+
+    # Try readability for main content if available
+    content = ""
+    Document = _readability_document()
+    if Document is not None:
+        try:
+            doc = Document(html)
+            content_html = doc.summary()
+            content_soup = BeautifulSoup(content_html, 'html.parser')
+            content = _block_text(content_soup)
+        except:
+            # Fallback content extraction
+            content = _extract_main_content(soup)
+    else:
+        # Fallback content extraction when readability is not available
+        content = _extract_main_content(soup)
+
+    # Try to extract publish date
+    publish_date = _extract_publish_date(soup)
+
+    return {
+        'title': title,
+        'content': content,
+        'publish_date': publish_date
+    }
+
+
+def _extract_title(soup: BeautifulSoup) -> str:
+    """Extract the title from the webpage."""
+    # Try multiple title sources in order of preference
+    title_selectors = [
+        'h1',
+        'title',
+        '[property="og:title"]',
+        '[name="twitter:title"]',
+        '.entry-title',
+        '.post-title',
+        '.article-title'
+    ]
+
+    for selector in title_selectors:
+        element = soup.select_one(selector)
+        if element:
+            title = element.get('content') if element.get('content') else element.get_text(strip=True)
+            if title and len(title) > 5:
+                return title
+
+    return "Untitled"
+
+
+BLOCK_TAGS = ['p', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'figcaption', 'dd', 'dt']
+
+
+def _block_text(element) -> str:
+    """
+    Text of an element with one paragraph per block-level child.
+
+    Paragraph breaks let long documents be chunked at paragraph boundaries and
+    let boilerplate be recognised paragraph by paragraph. Falls back to flat
+    text when most of it sits outside block elements.
+    """
+    flat = element.get_text(strip=True, separator=' ')
+    blocks = [block.get_text(strip=True, separator=' ') for block in element.find_all(BLOCK_TAGS)
+              if block.find_parent(BLOCK_TAGS) is None]
+    text = '\n\n'.join(block for block in blocks if block)
+    return text if len(text) >= len(flat) // 2 else flat
+
+
+def _extract_main_content(soup: BeautifulSoup) -> str:
+    """Extract main content from the webpage."""
+    # Remove unwanted elements
+    for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'form']):
+        element.decompose()
+
+    # Try common content selectors
+    content_selectors = [
+        'article',
+        '[role="main"]',
+        '.entry-content',
+        '.post-content',
+        '.article-content',
+        '.content',
+        'main',
+        '.main-content'
+    ]
+
+    for selector in content_selectors:
+        content_element = soup.select_one(selector)
+        if content_element:
+            text = _block_text(content_element)
+            if len(text) > 100:  # Only return if substantial content
+                return text
+
+    # Fallback: get text from body, excluding common non-content elements
+    body = soup.find('body')
+    if body:
+        # Remove common non-content sections
+        for unwanted in body.find_all(['nav', 'footer', 'header', 'aside', '.sidebar', '.widget']):
+            unwanted.decompose()
+
+        paragraphs = body.find_all('p')
+        if paragraphs:
+            # Keep paragraph breaks so long documents can be chunked at paragraph boundaries
+            content = '\n\n'.join([p.get_text(strip=True) for p in paragraphs if len(p.get_text(strip=True)) > 20])
+            return content
+
+    return soup.get_text(strip=True, separator=' ')
+
+
+def _extract_publish_date(soup: BeautifulSoup) -> str:
+    """Extract publish date."""
+    date_selectors = [
+        '[property="article:published_time"]',
+        '[name="date"]',
+        '[pubdate]',
+        'time[datetime]',
+        '.date',
+        '.publish-date'
+    ]
+
+    for selector in date_selectors:
+        element = soup.select_one(selector)
+        if element:
+            date = element.get('datetime') or element.get('content') or element.get_text(strip=True)
+            if date:
+                return date
+
+    return ""
+
+
+class ExtractionUnavailable(Exception):
+    """The extraction pool kept breaking; says nothing about the page or its domain."""
+
+
+# Set in each extraction worker process: where it reports which task it started, and when
+_started_queue = None
+
+
+def _init_extraction_worker(started_queue) -> None:
+    global _started_queue
+    _started_queue = started_queue
+
+
+def _extract_in_worker(task_id: str, url: str, raw_html: bytes, encoding: Optional[str]) -> Dict:
+    # Wall-clock time, comparable across processes
+    _started_queue.put((task_id, os.getpid(), time.time()))
+    return extract_article(url, raw_html, encoding)
+
+
+class _ExtractionPool:
+    def __init__(self, max_workers: int):
+        """A process pool plus the start times its workers report, so parses are timed from when they start."""
+        context = multiprocessing.get_context('spawn')
+        self.started_queue = context.Queue()
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=_init_extraction_worker,
+            initargs=(self.started_queue,),
+        )
+        self.tasks = 0
+        self._processes = []
+        self._pending = set()
+        self._started: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, task_id: str, *args):
+        future = self.executor.submit(_extract_in_worker, task_id, *args)
+        with self._lock:
+            self._pending.add(task_id)
+        future.add_done_callback(lambda _: self._finished(task_id))
+        return future
+
+    def _finished(self, task_id: str) -> None:
+        with self._lock:
+            self._pending.discard(task_id)
+            self._started.pop(task_id, None)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def started(self, task_id: str) -> Optional[tuple]:
+        """(worker pid, start time) of a task, or None while it is still queued."""
+        with self._lock:
+            while True:
+                try:
+                    started_id, pid, started_at = self.started_queue.get_nowait()
+                except (queue.Empty, OSError, ValueError):
+                    break
+                if started_id in self._pending:
+                    self._started[started_id] = (pid, started_at)
+            return self._started.get(task_id)
+
+    def retire(self, cancel_queued: bool = False) -> None:
+        """Take no new parses; running ones still finish, and queued ones too unless `cancel_queued`."""
+        # shutdown() forgets the worker processes, and kill() may still need them
+        self._processes = list((getattr(self.executor, '_processes', None) or {}).values())
+        self.executor.shutdown(wait=False, cancel_futures=cancel_queued)
+
+    def kill(self, pid: int) -> None:
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in self._processes:
+            if process.pid == pid:
+                process.terminate()
+
+
+class ExtractionExecutor:
+    def __init__(self, max_workers: Optional[int] = None, task_timeout: float = 30.0, max_tasks_per_child: int = 50,
+                 poll_interval: float = 0.25):
+        """
+        Run the HTML parse step of scraping in a pool of worker processes.
+
+        newspaper3k, readability and BeautifulSoup hold the GIL while parsing, so
+        running them in the parent serializes every job in the worker. Only raw
+        bytes go to the pool and only the compact parse result comes back.
+
+        A parse that runs longer than `task_timeout` (counted from when a worker
+        starts it, not from when it was queued) retires its pool: new parses go
+        to a fresh pool, the other workers finish what they hold, and then only
+        the stuck worker is killed.
+
+        Args:
+            max_workers (int): Number of worker processes. 0 parses inline in the calling thread
+            task_timeout (float): Seconds a single parse may run before giving up
+            max_tasks_per_child (int): Recycle the worker processes after about this many parses each
+                to contain memory leaks in the parsing libraries
+            poll_interval (float): Seconds between checks of a waiting parse
+        """
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.task_timeout = task_timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.poll_interval = poll_interval
+        self._pool: Optional[_ExtractionPool] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> _ExtractionPool:
+        # Workers are recycled by swapping in a fresh pool rather than with
+        # ProcessPoolExecutor(max_tasks_per_child=...), which can deadlock on
+        # Python 3.11 once busy workers start being replaced.
+        retired = None
+        with self._lock:
+            if self._pool is not None and self.max_tasks_per_child and \
+                    self._pool.tasks >= self.max_tasks_per_child * self.max_workers:
+                retired, self._pool = self._pool, None
+            if self._pool is None:
+                self._pool = _ExtractionPool(self.max_workers)
+            self._pool.tasks += 1
+            pool = self._pool
+        if retired is not None:
+            # Parses already queued on the old pool still finish
+            retired.retire()
+        return pool
+
+    def _retire(self, pool: _ExtractionPool, stuck_pid: Optional[int] = None) -> None:
+        """
+        Stop sending parses to `pool`. Parses still queued on it are cancelled and
+        resubmitted by their callers to the next pool. With `stuck_pid`, that worker
+        is killed once the parses running on the others are done.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.retire(cancel_queued=True)
+        if stuck_pid is not None:
+            threading.Thread(target=self._reap, args=(pool, stuck_pid), name="extraction-reaper", daemon=True).start()
+
+    def _reap(self, pool: _ExtractionPool, stuck_pid: int) -> None:
+        # Let the other workers finish what they hold, as long as they keep finishing a parse
+        # per timeout; anything left after that sees a broken pool and is retried on the fresh one
+        left, progress = pool.in_flight, time.monotonic()
+        while left > 1 and time.monotonic() - progress < self.task_timeout:
+            time.sleep(self.poll_interval)
+            if pool.in_flight < left:
+                left, progress = pool.in_flight, time.monotonic()
+        pool.kill(stuck_pid)
+
+    def _run(self, pool: _ExtractionPool, url: str, raw_html: bytes, encoding: Optional[str]) -> Dict:
+        task_id = uuid.uuid4().hex
+        future = pool.submit(task_id, url, raw_html, encoding)
+        while True:
+            try:
+                return future.result(timeout=self.poll_interval)
+            except FutureTimeoutError:
+                pass
+            started = pool.started(task_id)
+            if started is not None and time.time() - started[1] > self.task_timeout:
+                print(f"Extraction timed out after {self.task_timeout}s: {url}")
+                self._retire(pool, stuck_pid=started[0])
+                return {'title': '', 'content': '', 'publish_date': ''}
+
+    def extract(self, url: str, raw_html: bytes, encoding: Optional[str] = None) -> Dict:
+        """
+        Parse raw HTML, in a worker process when the pool is enabled.
+
+        Args:
+            url (str): The URL the HTML was fetched from
+            raw_html (bytes): Raw response body
+            encoding (str): Charset declared by the server, if any
+
+        Returns:
+            Dict: Compact dictionary with title, content and publish_date
+
+        Raises:
+            ExtractionUnavailable: When the pool broke twice, e.g. a worker was killed or crashed
+        """
+        if self.max_workers <= 0:
+            return extract_article(url, raw_html, encoding)
+
+        broken = 0
+        while True:
+            pool = self._get_pool()
+            try:
+                return self._run(pool, url, raw_html, encoding)
+            except CancelledError:
+                # Still queued when its pool was retired; it has not run yet
+                continue
+            except BrokenProcessPool as e:
+                # Another parse's stuck worker was killed, or a worker died; not this page's fault
+                self._retire(pool)
+                broken += 1
+                if broken > 1:
+                    raise ExtractionUnavailable(f"Extraction pool broke twice: {e}")
+                print(f"Extraction pool broke ({e}), retrying {url} on a fresh pool")
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.executor.shutdown(wait=True, cancel_futures=True)
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+def get_extraction_executor() -> ExtractionExecutor:
+    """
+    Return the process-wide extraction executor, configured from the environment.
+
+    SCRAPER_EXTRACTION_WORKERS: worker processes (default: CPU count, 0 = parse inline)
+    SCRAPER_EXTRACTION_TIMEOUT: seconds per parse (default: 30)
+    SCRAPER_EXTRACTION_MAX_TASKS_PER_CHILD: parses before a worker is recycled (default: 50)
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            workers = os.getenv("SCRAPER_EXTRACTION_WORKERS")
+            _default_executor = ExtractionExecutor(
+                max_workers=int(workers) if workers else None,
+                task_timeout=float(os.getenv("SCRAPER_EXTRACTION_TIMEOUT", "30")),
+                max_tasks_per_child=int(os.getenv("SCRAPER_EXTRACTION_MAX_TASKS_PER_CHILD", "50")),
+            )
+        return _default_executor
 
 
 class WebScraper:
-    def __init__(self, timeout: int = 10, delay: float = 1.0):
+    def __init__(self, timeout: int = 10, delay: float = 1.0, extraction_executor: Optional[ExtractionExecutor] = None,
+                 max_concurrency: int = SCRAPE_CONCURRENCY, max_bytes: int = SCRAPE_MAX_BYTES, scoreboard=None,
+                 transport=None, corpus=None):
         """
         Initialize the WebScraper with configurable timeout and delay between requests.
         
         Args:
             timeout (int): Request timeout in seconds
             delay (float): Delay between requests to be respectful to servers
+            extraction_executor (ExtractionExecutor): Where HTML parsing runs, defaults to the shared process pool
+            max_concurrency (int): Parallel fetches in quorum mode
+            max_bytes (int): Stop downloading a page after this many bytes
+            scoreboard (DomainScoreboard): Per-domain health to record into and size timeouts from,
+                defaults to the shared scoreboard
+            transport (HttpTransport): Pooled connections, DNS cache and robots.txt policy,
+                defaults to the process-wide transport
+            corpus (CorpusIndex): Where good documents are indexed for later jobs, defaults to the shared index
         """
         self.timeout = timeout
         self.delay = delay
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.max_concurrency = max_concurrency
+        self.max_bytes = max_bytes
+        self.scoreboard = scoreboard or get_domain_scoreboard()
+        self.corpus = corpus or get_corpus_index()
+        self.extraction_executor = extraction_executor or get_extraction_executor()
+        self.transport = transport or get_transport()
+        self.session = self.transport.session
     
-    def scrape_single_url(self, url: str) -> Dict:
+    def fetch_html(self, url: str, timeout: Optional[float] = None):
+        """
+        Download a page as raw bytes, refusing non-HTML and stopping at the byte cap.
+
+        Content-Type and Content-Length are checked before the body is read, so PDFs
+        without a .pdf extension, videos and other binaries cost one round trip.
+
+        Args:
+            url (str): The URL to fetch
+            timeout (float): Request timeout, defaults to the scraper's timeout
+
+        Returns:
+            Tuple[bytes, str]: Body (at most max_bytes) and the charset to decode it with
+        """
+        if not self.transport.allowed(url):
+            raise RobotsDisallowedError(f"robots.txt disallows {url}")
+        with self.session.get(url, timeout=timeout or self.timeout, stream=True) as response:
+            response.raise_for_status()
+
+            content_type = response.headers.get('Content-Type', '')
+            media_type = content_type.split(';')[0].strip().lower()
+            if media_type and media_type not in HTML_CONTENT_TYPES:
+                raise SkippedContentError(f"Unsupported content type {media_type}")
+
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                raise SkippedContentError(f"Content-Length {content_length} exceeds {self.max_bytes} bytes")
+
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=16384):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= self.max_bytes:
+                    # Keep the head of the page; the parsers cope with truncated HTML
+                    break
+            body = b''.join(chunks)[:self.max_bytes]
+
+        if not media_type and body[:5] == b'%PDF-':
+            raise SkippedContentError("Body is a PDF")
+        return body, sniff_encoding(content_type, body[:4096])
+
+    def scrape_single_url(self, url: str, stop_event: Optional[threading.Event] = None) -> Dict:
         """
         Scrape a single URL and extract title, main content, and citations.
         
         Args:
             url (str): The URL to scrape
+            stop_event (threading.Event): When set, the result is no longer wanted and parsing is skipped
             
         Returns:
             Dict: JSON-like dictionary containing title, content, citations, and metadata
         """
+        check_cancelled("scrape")
+        start = time.perf_counter()
         try:
-            # Get the webpage
-            response = self.session.get(url, timeout=self.timeout)
-            response.raise_for_status()
-            
-            # Try newspaper3k first for better content extraction
-            article_data = self._extract_with_newspaper(url)
+            if stop_event is not None and stop_event.is_set():
+                return {'url': url, 'title': '', 'main_content': ''}
+
+            # In multi-node mode, a page any node scraped recently is not fetched again
+            cache = shared_cache("scrape", "SHARED_SCRAPE_TTL", 3600)
+            cached = cache.get(url) if cache else None
+            if cached is not None:
+                return {'url': url, 'title': cached['title'],
+                        'main_content': strip_boilerplate(url, cached['main_content'], learn=False)}
+
+            # Get the webpage, with a timeout sized to how fast this domain usually answers
+            timeout = self.scoreboard.timeout_for(url, self.timeout) if self.scoreboard else self.timeout
+            body, encoding = self.fetch_html(url, timeout)
+            latency = time.perf_counter() - start
+
+            # A cancelled run does not parse what it fetched
+            check_cancelled("scrape")
+            if stop_event is not None and stop_event.is_set():
+                return {'url': url, 'title': '', 'main_content': ''}
             
-            # Fallback to BeautifulSoup if newspaper fails
-            if not article_data['content'] or len(article_data['content']) < 100:
-                article_data = self._extract_with_beautifulsoup(response.text, url)
+            # Parse in the extraction pool; the network I/O above stays here
+            article_data = self.extraction_executor.extract(url, body, encoding)
             
             result = {
                 'url': url,
                 'title': article_data['title'],
-                'main_content': article_data['content']
+                # Paragraphs this site repeats on many pages (cookie notices, newsletter pitches) are dropped
+                'main_content': strip_boilerplate(url, article_data['content'])
             }
+            good = is_good_document(result)
+            record_scrape(url, len(body), bool(result['title'] and result['main_content']))
+            self._record_health(url, good, latency, result['main_content'], None if good else 'thin_content')
+            if good:
+                self._index(dict(result, publish_date=article_data.get('publish_date') or ''))
+                if cache:
+                    cache.set({'title': result['title'], 'main_content': result['main_content']}, url)
             
             return result
             
+        except ExtractionUnavailable as e:
+            # A problem of this process, not of the site: no domain-health penalty
+            print(f"Could not parse {url}: {e}")
+            return {'url': url, 'title': '', 'main_content': ''}
         except requests.exceptions.RequestException as e:
+            record_scrape(url, 0, False)
+            self._record_health(url, False, time.perf_counter() - start, '', self._failure_reason(e))
             return {
                 'url': url,
                 'title': '',
                 'main_content': ''
             }
         except Exception as e:
+            record_scrape(url, 0, False)
+            self._record_health(url, False, time.perf_counter() - start, '', self._failure_reason(e))
             return {
                 'url': url,
                 'title': '',
                 'main_content': ''
             }
-    
-    def _extract_with_newspaper(self, url: str) -> Dict:
-        """Extract content using newspaper3k library."""
+
+    def _failure_reason(self, error: Exception) -> str:
+        if isinstance(error, requests.exceptions.Timeout):
+            return 'timeout'
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return f'http_{error.response.status_code}'
+        if isinstance(error, requests.exceptions.ConnectionError):
+            return 'connection'
+        if isinstance(error, RobotsDisallowedError):
+            return 'robots'
+        if isinstance(error, SkippedContentError):
+            return 'skipped_content'
+        return 'error'
+
+    def _record_health(self, url: str, success: bool, latency: float, content: str, reason: Optional[str]) -> None:
+        if self.scoreboard is None:
+            return
         try:
-            article = Article(url)
-            article.download()
-            article.parse()
-            
-            return {
-                'title': article.title or '',
-                'content': article.text or '',
-                'publish_date': str(article.publish_date) if article.publish_date else ''
-            }
-        except:
-            return {'title': '', 'content': '', 'publish_date': ''}
-    
-    def _extract_with_beautifulsoup(self, html: str, url: str) -> Dict:
-        """Extract content using BeautifulSoup as a fallback method."""
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        # Extract title
-        title = self._extract_title(soup)
-        
-        # Try readability for main content if available
-        content = ""
-        if Document is not None:
-            try:
-                doc = Document(html)
-                content_html = doc.summary()
-                content_soup = BeautifulSoup(content_html, 'html.parser')
-                content = content_soup.get_text(strip=True, separator=' ')
-            except:
-                # Fallback content extraction
-                content = self._extract_main_content(soup)
-        else:
-            # Fallback content extraction when readability is not available
-            content = self._extract_main_content(soup)
-        
-        # Try to extract publish date
-        publish_date = self._extract_publish_date(soup)
-        
-        return {
-            'title': title,
-            'content': content,
-            'publish_date': publish_date
-        }
-    
-    def _extract_title(self, soup: BeautifulSoup) -> str:
-        """Extract the title from the webpage."""
-        # Try multiple title sources in order of preference
-        title_selectors = [
-            'h1',
-            'title',
-            '[property="og:title"]',
-            '[name="twitter:title"]',
-            '.entry-title',
-            '.post-title',
-            '.article-title'
-        ]
-        
-        for selector in title_selectors:
-            element = soup.select_one(selector)
-            if element:
-                title = element.get('content') if element.get('content') else element.get_text(strip=True)
-                if title and len(title) > 5:
-                    return title
-        
-        return "Untitled"
-    
-    def _extract_main_content(self, soup: BeautifulSoup) -> str:
-        """Extract main content from the webpage."""
-        # Remove unwanted elements
-        for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'form']):
-            element.decompose()
-        
-        # Try common content selectors
-        content_selectors = [
-            'article',
-            '[role="main"]',
-            '.entry-content',
-            '.post-content',
-            '.article-content',
-            '.content',
-            'main',
-            '.main-content'
-        ]
-        
-        for selector in content_selectors:
-            content_element = soup.select_one(selector)
-            if content_element:
-                text = content_element.get_text(strip=True, separator=' ')
-                if len(text) > 100:  # Only return if substantial content
-                    return text
-        
-        # Fallback: get text from body, excluding common non-content elements
-        body = soup.find('body')
-        if body:
-            # Remove common non-content sections
-            for unwanted in body.find_all(['nav', 'footer', 'header', 'aside', '.sidebar', '.widget']):
-                unwanted.decompose()
-            
-            paragraphs = body.find_all('p')
-            if paragraphs:
-                content = ' '.join([p.get_text(strip=True) for p in paragraphs if len(p.get_text(strip=True)) > 20])
-                return content
-        
-        return soup.get_text(strip=True, separator=' ')
-    
-    def _extract_publish_date(self, soup: BeautifulSoup) -> str:
-        """Extract publish date."""
-        date_selectors = [
-            '[property="article:published_time"]',
-            '[name="date"]',
-            '[pubdate]',
-            'time[datetime]',
-            '.date',
-            '.publish-date'
-        ]
-        
-        for selector in date_selectors:
-            element = soup.select_one(selector)
-            if element:
-                date = element.get('datetime') or element.get('content') or element.get_text(strip=True)
-                if date:
-                    return date
-        
-        return ""
+            self.scoreboard.record(url, success, latency, len(content.split()), reason)
+        except Exception as e:
+            print(f"Could not update domain health for {url}: {e}")
+
+    def _index(self, result: Dict) -> None:
+        if self.corpus is None:
+            return
+        try:
+            self.corpus.add(result)
+        except Exception as e:
+            print(f"Could not add {result['url']} to the corpus index: {e}")
     
     def scrape_multiple_urls(self, urls: List[str]) -> List[Dict]:
         """
@@ -211,15 +690,81 @@ class WebScraper:
         results = []
         
         for i, url in enumerate(urls):
+            check_cancelled("scrape")
             print(f"Scraping {i+1}/{len(urls)}: {url}")
             result = self.scrape_single_url(url)
             results.append(result)
             
             # Be respectful to servers
             if i < len(urls) - 1:
-                time.sleep(self.delay)
+                cancellable_sleep(self.delay, "scrape")
         
         return results
+
+    def scrape_quorum(self, urls: List[str], quorum: int, deadline: float = SCRAPE_DEADLINE_SECONDS) -> List[Dict]:
+        """
+        Scrape URLs concurrently and return as soon as `quorum` good documents arrive
+        or the deadline passes, abandoning the stragglers.
+
+        Args:
+            urls (List[str]): Candidate URLs, usually over-fetched from Search
+            quorum (int): Number of good documents (title and 100+ characters) needed
+            deadline (float): Seconds allowed for the whole stage
+
+        Returns:
+            List[Dict]: Results of the URLs that finished in time, in the order of `urls`
+        """
+        if not urls:
+            return []
+
+        results = {}
+        good = 0
+        stop_event = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(urls))))
+        futures = {
+            pool.submit(contextvars.copy_context().run, self.scrape_single_url, url, stop_event): url
+            for url in urls
+        }
+        # Cancelling the run wakes the loop below right away instead of after the next page
+        token = current_cancel_token()
+        waiting = list(futures) + ([token.future] if token is not None else [])
+        try:
+            for future in as_completed(waiting, timeout=deadline):
+                if future not in futures:
+                    token.check("scrape")
+                url = futures[future]
+                results[url] = future.result()
+                print(f"Scraped {len(results)}/{len(urls)}: {url}")
+                if is_good_document(results[url]):
+                    good += 1
+                    if good >= quorum:
+                        break
+                if len(results) == len(urls):
+                    break
+        except FutureTimeoutError:
+            print(f"Scrape deadline of {deadline}s reached with {good}/{quorum} good documents")
+        finally:
+            # Requests already in flight run out their own timeout, but are not parsed
+            stop_event.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        return [results[url] for url in urls if url in results]
+
+    def scrape(self, urls: List[str], quorum: Optional[int] = None, deadline: float = SCRAPE_DEADLINE_SECONDS) -> List[Dict]:
+        """
+        Scrape URLs with the configured SCRAPE_MODE.
+
+        Args:
+            urls (List[str]): URLs to scrape
+            quorum (int): Good documents needed; quorum mode only, defaults to all URLs
+            deadline (float): Seconds allowed in quorum mode
+
+        Returns:
+            List[Dict]: Scraped data for each finished URL
+        """
+        if SCRAPE_MODE == "quorum":
+            return self.scrape_quorum(urls, quorum or len(urls), deadline)
+        return self.scrape_multiple_urls(urls)
     
     def save_to_json(self, data: List[Dict], filename: str) -> None:
         """
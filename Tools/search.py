@@ -1,8 +1,22 @@
 from ddgs import DDGS
+from Tools.domainhealth import get_domain_scoreboard
+from Server.backend import shared_cache
+
+# Links to documents and media the scraper cannot use
+SKIPPED_EXTENSIONS = ('.pdf', '.doc', '.docx', '.ppt', '.pptx', '.xls', '.xlsx', '.zip',
+                      '.mp3', '.mp4', '.mov', '.avi', '.webm')
 
 class Search:
-    def __init__(self):
-        pass
+    def __init__(self, scoreboard=None):
+        """
+        Args:
+            scoreboard (DomainScoreboard): Domain health used to skip and order URLs, defaults to the shared scoreboard
+        """
+        self.scoreboard = scoreboard or get_domain_scoreboard()
+
+    def _rank(self, urls: list) -> list:
+        return self.scoreboard.rank(urls) if self.scoreboard else urls
+
     def search(self, topic, max_results=10) -> list:
         """ 
         Perform a DuckDuckGo search for the given topic and return list of urls.
@@ -14,13 +28,19 @@ class Search:
         Returns:
             List[str]: A list of URLs related to the search topic.
         """
-        with DDGS() as ddgs:
-          results = ddgs.text(topic, max_results=max_results)
-          urls = []
-          for item in results:
-              if "href" in item and not item["href"].lower().endswith(".pdf"):
-                  urls.append(item["href"])
-        return urls
+        # In multi-node mode, a query any node ran recently is not searched again
+        cache = shared_cache("search", "SHARED_SEARCH_TTL", 3600)
+        urls = cache.get("urls", topic, max_results) if cache else None
+        if urls is None:
+            with DDGS() as ddgs:
+              results = ddgs.text(topic, max_results=max_results)
+              urls = []
+              for item in results:
+                  if "href" in item and not item["href"].lower().split("?")[0].endswith(SKIPPED_EXTENSIONS):
+                      urls.append(item["href"])
+            if cache and urls:
+                cache.set(urls, "urls", topic, max_results)
+        return self._rank(urls)
     
     def search_complete(self, topic, max_results=10) -> list[dict]:
         """
@@ -34,12 +54,19 @@ class Search:
             dict: A list of dictionaries, each containing detailed information about a search result, such as title, href, and body, as provided by DDGS.
         """
 
+        cache = shared_cache("search", "SHARED_SEARCH_TTL", 3600)
+        cached = cache.get("complete", topic, max_results) if cache else None
+        if cached is not None:
+            return cached
+
         with DDGS() as ddgs:
             results = ddgs.text(topic, max_results=max_results)
             filtered_results = [
                 item for item in results
-                if "href" in item and not item["href"].lower().endswith(".pdf")
+                if "href" in item and not item["href"].lower().split("?")[0].endswith(SKIPPED_EXTENSIONS)
             ]
+            if cache and filtered_results:
+                cache.set(filtered_results, "complete", topic, max_results)
             return filtered_results
         
     def search_list(self, topic:list, max_results_per_topic=2 ) -> list:
@@ -57,7 +84,8 @@ class Search:
         urls = []
         for t in topic:
             urls.extend(self.search(t, max_results_per_topic))
-        return list(set(urls))
+        # Deduplicate keeping order, then order by domain health across all topics
+        return self._rank(list(dict.fromkeys(urls)))
     
     def search_list_complete(self, topic:list, max_results_per_topic=3 ) -> list[dict]:
         """
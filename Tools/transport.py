@@ -0,0 +1,337 @@
+import os
+import socket
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, List, Optional
+from urllib import robotparser
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+from Metrics.instrumentation import registry
+
+# Optional HTTP/2 support through httpx (pip install "httpx[http2]")
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+class DnsCache:
+    def __init__(self, ttl: float = 300.0):
+        """
+        Cache getaddrinfo results for the connections of the adapters that use it (DnsCachingAdapter).
+
+        Args:
+            ttl (float): Seconds a resolved address list is reused
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int, family: int) -> List[tuple]:
+        key = (host, port, family)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+        addresses = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (time.monotonic(), addresses)
+        return addresses
+
+    def invalidate(self, host: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == host]:
+                del self._entries[key]
+
+
+class _CachedDnsConnection:
+    """
+    Connection mixin that connects to an address from its pool's DnsCache.
+
+    Only the TCP connect uses the cached IP; TLS still verifies and sends SNI
+    for the original host name.
+    """
+    dns_cache: DnsCache = None
+
+    def _new_conn(self):
+        host = self._dns_host.strip("[]")
+        try:
+            addresses = self.dns_cache.resolve(host, self.port, allowed_gai_family())
+        except OSError:
+            return super()._new_conn()
+        original, error = self._dns_host, None
+        try:
+            for _, _, _, _, sockaddr in addresses:
+                self._dns_host = sockaddr[0]
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    error = e
+        finally:
+            self._dns_host = original
+        self.dns_cache.invalidate(host)
+        raise error
+
+
+class DnsCachingAdapter(HTTPAdapter):
+    def __init__(self, dns_cache: Optional[DnsCache] = None, **kwargs):
+        """
+        HTTPAdapter whose connection pools resolve host names through `dns_cache`.
+
+        Scoped to the sessions the adapter is mounted on; other urllib3 users in
+        the process resolve as usual.
+
+        Args:
+            dns_cache (DnsCache): Cache to resolve through, None resolves every connection
+            **kwargs: HTTPAdapter arguments
+        """
+        self.dns_cache = dns_cache
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self.dns_cache is None:
+            return
+        classes = {}
+        for scheme, pool_class, connection_class in (("http", HTTPConnectionPool, HTTPConnection),
+                                                     ("https", HTTPSConnectionPool, HTTPSConnection)):
+            connection = type(f"CachedDns{connection_class.__name__}", (_CachedDnsConnection, connection_class),
+                              {"dns_cache": self.dns_cache})
+            classes[scheme] = type(f"CachedDns{pool_class.__name__}", (pool_class,), {"ConnectionCls": connection})
+        self.poolmanager.pool_classes_by_scheme = classes
+
+
+class RobotsCache:
+    def __init__(self, session: requests.Session, ttl: float = 3600.0, timeout: float = 5.0):
+        """
+        robots.txt per host, fetched once through the shared session and reused.
+
+        Args:
+            session (requests.Session): Session used to fetch robots.txt
+            ttl (float): Seconds a parsed robots.txt is reused
+            timeout (float): Timeout for fetching robots.txt
+        """
+        self.session = session
+        self.ttl = ttl
+        self.timeout = timeout
+        self._parsers: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def allowed(self, url: str, user_agent: str = USER_AGENT) -> bool:
+        parsed = urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            entry = self._parsers.get(origin)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            parser = robotparser.RobotFileParser()
+            try:
+                response = self.session.get(f"{origin}/robots.txt", timeout=self.timeout)
+                if response.status_code in (401, 403):
+                    parser.disallow_all = True
+                elif response.status_code >= 400:
+                    parser.allow_all = True
+                else:
+                    parser.parse(response.text.splitlines())
+            except requests.exceptions.RequestException:
+                # Unreachable robots.txt does not block scraping
+                parser.allow_all = True
+            entry = (time.monotonic(), parser)
+            with self._lock:
+                self._parsers[origin] = entry
+        return entry[1].can_fetch(user_agent, url)
+
+
+class _HttpxRaw:
+    """Minimal urllib3-style raw body over an httpx streaming response, for requests.Response."""
+    def __init__(self, response):
+        self._response = response
+
+    def stream(self, chunk_size: int = 8192, decode_content: bool = True):
+        yield from self._response.iter_bytes(chunk_size)
+
+    def read(self, amt=None, decode_content: bool = True) -> bytes:
+        return self._response.read()
+
+    def close(self) -> None:
+        self._response.close()
+
+    def release_conn(self) -> None:
+        self._response.close()
+
+
+class Http2Adapter(BaseAdapter):
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 20):
+        """
+        requests transport adapter that sends through an HTTP/2-capable httpx client.
+
+        Args:
+            max_connections (int): Connections the httpx pool may hold
+            max_keepalive (int): Idle connections kept alive
+        """
+        super().__init__()
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+        )
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        httpx_request = self.client.build_request(
+            request.method, request.url, headers=dict(request.headers), content=request.body,
+            timeout=httpx.Timeout(read, connect=connect),
+        )
+        try:
+            httpx_response = self.client.send(httpx_request, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        response = requests.Response()
+        response.status_code = httpx_response.status_code
+        response.headers = CaseInsensitiveDict(httpx_response.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = _HttpxRaw(httpx_response)
+        response.reason = httpx_response.reason_phrase
+        response.url = str(httpx_response.url)
+        response.request = request
+        response.connection = self
+        if not stream:
+            response.content
+        return response
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class HttpTransport:
+    def __init__(self, pool_connections: int = 100, pool_maxsize: int = 10, http2: bool = False,
+                 dns_cache_ttl: float = 300.0, respect_robots: bool = False, robots_ttl: float = 3600.0):
+        """
+        Process-wide HTTP transport shared by WebScraper and FeaturedImageExtractor,
+        so keep-alive connections and TLS sessions are reused across jobs.
+
+        Args:
+            pool_connections (int): Hosts whose connection pools are kept
+            pool_maxsize (int): Keep-alive connections kept per host
+            http2 (bool): Send HTTPS through httpx with HTTP/2 when it is installed
+            dns_cache_ttl (float): Seconds DNS answers are reused, 0 disables the cache
+            respect_robots (bool): Whether scrapers should check robots.txt before fetching
+            robots_ttl (float): Seconds a host's robots.txt is reused
+        """
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT, 'Connection': 'keep-alive'})
+        # The session is shared by every job, so it keeps no cookies: a cookie set by one job's
+        # fetch must not go out with another's. Cookies still follow the redirects of one fetch
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.dns_cache = DnsCache(dns_cache_ttl) if dns_cache_ttl > 0 else None
+        self.adapter = DnsCachingAdapter(self.dns_cache, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.http2 = False
+        if http2:
+            if httpx is None:
+                print("HTTP/2 requested but httpx is not installed, using HTTP/1.1")
+            else:
+                try:
+                    self.session.mount('https://', Http2Adapter(max_connections=pool_connections, max_keepalive=pool_maxsize))
+                    self.http2 = True
+                except ImportError:
+                    print("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+
+        self.respect_robots = respect_robots
+        self.robots = RobotsCache(self.session, ttl=robots_ttl)
+
+    def allowed(self, url: str) -> bool:
+        """robots.txt check, always True unless respect_robots is on."""
+        return not self.respect_robots or self.robots.allowed(url)
+
+    def stats(self) -> Dict:
+        """Connection reuse per host for the HTTP/1.1 pools currently held."""
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{key.key_scheme}://{key.key_host}"
+            entry = hosts.setdefault(host, {"requests": 0, "connections_opened": 0})
+            entry["requests"] += pool.num_requests
+            entry["connections_opened"] += pool.num_connections
+        total_requests = sum(entry["requests"] for entry in hosts.values())
+        total_connections = sum(entry["connections_opened"] for entry in hosts.values())
+        return {
+            "requests": total_requests,
+            "connections_opened": total_connections,
+            "reuse_ratio": round(1 - total_connections / total_requests, 3) if total_requests else 0.0,
+            "dns_cache": {"hits": self.dns_cache.hits, "misses": self.dns_cache.misses} if self.dns_cache else None,
+            "http2": self.http2,
+            "hosts": hosts,
+        }
+
+    def render_metrics(self) -> List[str]:
+        stats = self.stats()
+        lines = [
+            "# HELP http_pool_requests Requests sent through the shared HTTP/1.1 connection pools",
+            "# TYPE http_pool_requests gauge",
+            f"http_pool_requests {stats['requests']}",
+            "# HELP http_pool_connections_opened Connections opened by the shared HTTP/1.1 connection pools",
+            "# TYPE http_pool_connections_opened gauge",
+            f"http_pool_connections_opened {stats['connections_opened']}",
+        ]
+        if stats["dns_cache"]:
+            lines += [
+                "# HELP http_dns_cache_lookups DNS cache lookups by result",
+                "# TYPE http_dns_cache_lookups gauge",
+                f'http_dns_cache_lookups{{result="hit"}} {stats["dns_cache"]["hits"]}',
+                f'http_dns_cache_lookups{{result="miss"}} {stats["dns_cache"]["misses"]}',
+            ]
+        return lines
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> HttpTransport:
+    """
+    Return the process-wide transport configured from the environment.
+
+    HTTP_POOL_CONNECTIONS: hosts whose pools are kept (default: 100)
+    HTTP_POOL_MAXSIZE: keep-alive connections per host (default: 10)
+    HTTP2: "on" to use HTTP/2 through httpx when installed (default: off)
+    HTTP_DNS_CACHE_TTL: seconds DNS answers are reused, 0 disables (default: 300)
+    RESPECT_ROBOTS_TXT: "on" to skip URLs disallowed by robots.txt (default: off)
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport(
+                pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", "100")),
+                pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", "10")),
+                http2=os.getenv("HTTP2", "off").lower() == "on",
+                dns_cache_ttl=float(os.getenv("HTTP_DNS_CACHE_TTL", "300")),
+                respect_robots=os.getenv("RESPECT_ROBOTS_TXT", "off").lower() == "on",
+            )
+            registry.register_collector(_transport.render_metrics)
+        return _transport
+
+
+def get_http_session() -> requests.Session:
+    return get_transport().session
@@ -0,0 +1,49 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Variants generated at the same time from one research pass
+VARIANT_CONCURRENCY = int(os.getenv("VARIANT_CONCURRENCY", "4"))
+
+
+def variant_instructions(instructions: Optional[str]) -> str:
+    """Prompt section for a variant's own instructions (tone, audience, format); empty when it has none."""
+    if not instructions or not instructions.strip():
+        return ""
+    return f"\n## VARIANT INSTRUCTIONS ##\n{instructions.strip()}\n"
+
+
+def write_variants(write: Callable[[Dict], Dict], variants: List[Dict],
+                   max_workers: int = VARIANT_CONCURRENCY) -> List[Dict]:
+    """
+    Write every variant of a post from the same research, a few at a time.
+
+    One failed variant does not fail the others; it comes back with an error
+    instead of blog_data.
+
+    Args:
+        write (Callable): Turns one variant spec into blog_data; called from worker threads
+        variants (List[Dict]): Specs with name, word_count, instructions and scrape_thumbnail
+        max_workers (int): Variants generated at the same time
+
+    Returns:
+        List[Dict]: One entry per variant, in request order, with name, word_count and blog_data
+    """
+    def run(variant: Dict) -> Dict:
+        try:
+            return {"blog_data": write(variant)}
+        except Exception as e:
+            print(f"Variant {variant['name']!r} failed: {e}")
+            return {"blog_data": None, "error": str(e)}
+
+    if not variants:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(variants)))) as pool:
+        # Copy the context so stage timings, metrics and the deadline still reach the current request
+        futures = [pool.submit(contextvars.copy_context().run, run, variant) for variant in variants]
+        outcomes = [future.result() for future in futures]
+    return [
+        {"name": variant["name"], "word_count": variant["word_count"], **outcome}
+        for variant, outcome in zip(variants, outcomes)
+    ]
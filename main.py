@@ -1,11 +1,82 @@
-from fastapi import FastAPI, Request
-from QuickResearch.quickresearch import run_quick_research
-from DeepResearch.deepresearch import run_deep_research
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, Request, HTTPException
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from Metrics.instrumentation import registry, track_request
+from Metrics.deadline import track_deadline
+from Metrics.tokens import resolve_budget, track_tokens
+from Metrics.profiling import get_profile_store, profile_job, should_profile
+from Server.singleflight import SingleFlight, TooManyWaitersError
+from Server.admission import AdmissionRejected, estimate_cost, get_admission_controller
+from Metrics.cancellation import DISCONNECTED, REQUESTED, Cancelled, cancel, register, run_cancellable, unregister
+from Server.resultcache import ResultCache, FRESH, STALE
+from Server.backend import MemoryBackend
+from Server.jobqueue import CANCELLED, DONE, FAILED, get_job_queue
+from Server.worker import Worker
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
+import asyncio
+import math
+import os
+import secrets
+import time
+import uuid
 load_dotenv()
 
-app = FastAPI()
+
+def warm_up_pipelines():
+    """Import both pipelines and compile the deep research graph ahead of the first request."""
+    from QuickResearch.quickresearch import run_quick_research
+    from DeepResearch.deepresearch import get_workflow
+    get_workflow()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # PIPELINE_WARMUP=startup loads everything before serving; the default "lazy"
+    # keeps cold starts fast and loads the pipelines on the first request
+    if os.getenv("PIPELINE_WARMUP", "lazy").lower() == "startup":
+        warm_up_pipelines()
+    # With JOB_BACKEND set, jobs go through the shared queue; this node can run some of them too
+    worker = None
+    if job_queue is not None:
+        default_workers = "2" if isinstance(job_queue.backend, MemoryBackend) else "0"
+        concurrency = int(os.getenv("API_JOB_WORKERS", default_workers))
+        if concurrency > 0:
+            worker = Worker(job_queue, run_queued_job, concurrency=concurrency)
+            worker.start()
+    yield
+    if worker is not None:
+        await run_in_threadpool(worker.stop)
+    # Gemini bills context caches until their TTL runs out, so delete ours on the way down
+    from Google_Genai.contextcache import get_context_cache
+    get_context_cache().clear()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Identical /generate_blog requests in flight share one pipeline run
+single_flight = SingleFlight.from_env()
+
+# Finished posts: RESULT_CACHE_MODE is "off", "ttl" (serve fresh entries only)
+# or "swr" (also serve stale entries and refresh them in the background)
+RESULT_CACHE_MODE = os.getenv("RESULT_CACHE_MODE", "ttl").lower()
+result_cache = ResultCache.from_env() if RESULT_CACHE_MODE != "off" else None
+# Reports about the run that produced a post, not about the requests later served from the cache
+PER_RUN_FIELDS = ("timings", "deadline", "admission", "tokens", "profile")
+_background_refreshes = set()
+
+# JOB_BACKEND (unset by default) sends pipeline runs through a queue shared by every node
+job_queue = get_job_queue()
+# How long a request waits for its queued job before answering 504 with the job id
+JOB_WAIT_SECONDS = float(os.getenv("JOB_WAIT_SECONDS", "900"))
+JOB_POLL_INTERVAL = 0.25
+# How often a request waiting for its run checks that the client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Pipeline runs wait for a slot and Gemini quota, or are turned away with 429 (ADMISSION_CONTROL=off disables)
+admission = get_admission_controller()
 
 class BlogRequest(BaseModel):
     topic: str
@@ -13,30 +84,396 @@ class BlogRequest(BaseModel):
     word_count: int = 1000
     scrape_thumbnail: bool = False
     method: str = "quick"
+    force_refresh: bool = False
+    # Oldest sources (and cached posts) acceptable, in hours; 0 researches on the web only
+    max_source_age_hours: Optional[float] = None
+    # Latency budget in seconds: sources, verification, model and image search are trimmed to fit
+    deadline_seconds: Optional[float] = None
+    # Gemini tokens (input plus output) the run may use: sources and verification are cut to
+    # fit. Defaults to JOB_TOKEN_BUDGET; 0 means unlimited
+    token_budget: Optional[int] = Field(None, ge=0)
+    # Profile this run (also requested with an "X-Profile: 1" header; either needs the admin token); profiled runs skip
+    # the result cache and coalescing, and the result links to the saved profile
+    profile: bool = False
+    # Id to cancel the run with (POST /jobs/{job_id}/cancel); a random one when unset
+    job_id: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$")
+
+class BlogVariant(BaseModel):
+    name: Optional[str] = None
+    # Unset fields fall back to the request's word_count and scrape_thumbnail
+    word_count: Optional[int] = None
+    scrape_thumbnail: Optional[bool] = None
+    # Extra prompt instructions for this variant, e.g. tone or audience
+    instructions: Optional[str] = None
+
+class BlogVariantsRequest(BlogRequest):
+    variants: List[BlogVariant]
 
 @app.get("/")
 async def root():
     return {"message": "AI Blogging Agents API is running", "status": "healthy"}
 
-@app.post("/generate_blog")
-async def generate_blog(request: BlogRequest):
-    if request.method == "quick":
-        result = run_quick_research(
-            topic=request.topic,
-            max_results=request.max_results,
-            word_count=request.word_count,
-            scrape_thumbnail=request.scrape_thumbnail
-        )
-    elif request.method == "deep":
-        result = run_deep_research(
-            topic=request.topic,
-            word_count=request.word_count,
-            scrape_thumbnail=request.scrape_thumbnail
-        )
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def is_admin(token: Optional[str]) -> bool:
+    """Whether `token` is the configured ADMIN_TOKEN; never true while ADMIN_TOKEN is unset."""
+    expected = os.getenv("ADMIN_TOKEN")
+    return bool(expected) and secrets.compare_digest(token or "", expected)
+
+def require_admin(token: Optional[str]):
+    """Admin endpoints need the ADMIN_TOKEN in an X-Admin-Token header, and are closed while it is unset."""
+    if not os.getenv("ADMIN_TOKEN"):
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    return {"profiles": await run_in_threadpool(get_profile_store().list)}
+
+@app.get("/admin/profiles/{job_id}")
+async def get_profile(job_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Summary of one profiled run, with its top allocation sites."""
+    require_admin(x_admin_token)
+    summary = await run_in_threadpool(get_profile_store().get, job_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return summary
+
+@app.get("/admin/profiles/{job_id}/folded")
+async def get_profile_stacks(job_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Sampled stacks in folded format, for flamegraph.pl or speedscope."""
+    require_admin(x_admin_token)
+    folded = await run_in_threadpool(get_profile_store().folded, job_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(folded)
+
+def wants_profile(request: BlogRequest, x_profile: Optional[str], x_admin_token: Optional[str]) -> BlogRequest:
+    """
+    Decide whether this request is profiled: asked for in the body or header, or sampled.
+
+    Asking is honoured only with the admin token, since profiling slows the whole
+    process down; PROFILE_SAMPLE_RATE applies to every request.
+    """
+    requested = request.profile or (x_profile or "").strip().lower() in ("1", "true", "yes", "on")
+    requested = requested and is_admin(x_admin_token)
+    return request.model_copy(update={"profile": should_profile(requested)})
+
+def attach_profile(result, profile):
+    if result is not None and profile is not None:
+        result["profile"] = {"job_id": profile["job_id"], "url": f"/admin/profiles/{profile['job_id']}"}
+
+def run_pipeline(request: BlogRequest):
+    """Run the requested pipeline synchronously and attach its timing breakdown."""
+    with profile_job(request.profile, topic=request.topic, method=request.method) as profile, \
+            track_request() as timings, track_deadline(request.deadline_seconds) as budget, \
+            track_tokens(request.token_budget) as usage:
+        if request.method == "quick":
+            from QuickResearch.quickresearch import run_quick_research
+            result = run_quick_research(
+                topic=request.topic,
+                max_results=request.max_results,
+                word_count=request.word_count,
+                scrape_thumbnail=request.scrape_thumbnail,
+                max_source_age_hours=request.max_source_age_hours
+            )
+        else:
+            from DeepResearch.deepresearch import run_deep_research
+            result = run_deep_research(
+                topic=request.topic,
+                word_count=request.word_count,
+                scrape_thumbnail=request.scrape_thumbnail,
+                max_source_age_hours=request.max_source_age_hours
+            )
+
+    if result is not None:
+        result["timings"] = timings.to_dict()
+        if budget is not None:
+            result["deadline"] = budget.report()
+        result["tokens"] = usage.report()
+    attach_profile(result, profile)
+
+    return result
+
+def run_queued_job(job: Dict):
+    """Run a job claimed from the shared queue; called by workers on any node."""
+    if job["kind"] == "variants":
+        request, run = BlogVariantsRequest(**job["payload"]), run_variants_pipeline
     else:
+        request, run = BlogRequest(**job["payload"]), run_pipeline
+    # Time spent in the queue counts against the caller's deadline
+    if request.deadline_seconds is not None:
+        waited = time.time() - job["enqueued_at"]
+        request = request.model_copy(update={"deadline_seconds": max(1.0, request.deadline_seconds - waited)})
+    return run(request)
+
+async def execute(kind: str, request: BlogRequest, run):
+    """
+    Run a pipeline once admission control lets it start, and attach the admission details.
+
+    The run can be cancelled by its job id until it finishes, and is cancelled when
+    everyone waiting for it goes away.
+    """
+    try:
+        # Queued jobs are counted by the worker that stops them
+        token = register(request.job_id or uuid.uuid4().hex, counted=job_queue is None)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        if admission is None:
+            return await dispatch(kind, request, run, token)
+        variants = getattr(request, "variants", None) or []
+        word_count = max([variant.word_count or request.word_count for variant in variants], default=request.word_count)
+        cost = estimate_cost(request.method, request.max_results, word_count, variants=max(1, len(variants)))
+        token_budget = resolve_budget(request.token_budget)
+        if token_budget is not None:
+            # The run is cut to its budget, so it cannot use more than that
+            cost["tokens"] = min(cost["tokens"], token_budget)
+        async with admission.admit(request.method, cost, request.deadline_seconds) as ticket:
+            if token.cancelled:
+                raise job_cancelled(token.job_id, token.reason)
+            if request.deadline_seconds is not None and ticket.queued:
+                # Time spent waiting comes out of the caller's budget
+                request = request.model_copy(update={"deadline_seconds": max(1.0, request.deadline_seconds - ticket.waited)})
+            result = await dispatch(kind, request, run, token)
+        if result is not None:
+            result["admission"] = ticket.report()
+        return result
+    except asyncio.CancelledError:
+        token.cancel(DISCONNECTED)
+        raise
+    finally:
+        unregister(token.job_id)
+
+def job_cancelled(job_id: str, reason: str) -> HTTPException:
+    # 499 "client closed request", as nginx logs it; a caller that cancelled its own job gets it too
+    return HTTPException(status_code=499, detail=f"Job {job_id} was cancelled ({reason})")
+
+def _discard_outcome(task: asyncio.Future):
+    if not task.cancelled():
+        task.exception()
+
+def admission_rejected(e: AdmissionRejected) -> HTTPException:
+    retry_after = math.ceil(e.retry_after)
+    return HTTPException(status_code=429, headers={"Retry-After": str(retry_after)},
+                         detail={"message": str(e), "retry_after_seconds": retry_after, "eta_seconds": round(e.eta, 1)})
+
+async def dispatch(kind: str, request: BlogRequest, run, token):
+    """Run a pipeline in this process, or queue it for any worker when JOB_BACKEND is set."""
+    job_id = token.job_id
+    if job_queue is None:
+        # The pipelines are blocking, so run them off the event loop. Shielded because a thread
+        # cannot be interrupted: when the caller goes away, the token stops it at its next cancellation point
+        work = asyncio.ensure_future(run_in_threadpool(run_cancellable, token, run, request))
+        try:
+            return await asyncio.shield(work)
+        except asyncio.CancelledError:
+            work.add_done_callback(_discard_outcome)
+            raise
+        except Cancelled:
+            raise job_cancelled(job_id, token.reason)
+
+    if request.job_id is not None and await run_in_threadpool(job_queue.get, job_id) is not None:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already exists")
+    await run_in_threadpool(job_queue.enqueue, kind, request.model_dump(), job_id)
+    give_up = time.monotonic() + JOB_WAIT_SECONDS
+    forwarded = False
+    try:
+        while True:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            if token.cancelled and not forwarded:
+                # Cancelled through this node; the worker running the job polls the queue for it
+                forwarded = True
+                await run_in_threadpool(job_queue.cancel, job_id, token.reason)
+            job = await run_in_threadpool(job_queue.get, job_id)
+            if job is None:
+                raise HTTPException(status_code=500, detail=f"Job {job_id} disappeared from the queue")
+            if job["status"] == DONE:
+                return job["result"]
+            if job["status"] == FAILED:
+                raise HTTPException(status_code=500, detail=f"Job {job_id} failed: {job['error']}")
+            if job["status"] == CANCELLED:
+                raise HTTPException(status_code=499, detail=f"Job {job_id} was {job['error'].lower()}")
+            if time.monotonic() > give_up:
+                raise HTTPException(status_code=504, detail={"message": "Job still running", "job_id": job_id,
+                                                             "status_url": f"/jobs/{job_id}"})
+    except asyncio.CancelledError:
+        # Nobody is waiting any more; stop the job wherever it runs
+        asyncio.get_running_loop().run_in_executor(None, job_queue.cancel, job_id, DISCONNECTED)
+        raise
+
+async def unless_disconnected(http_request: Request, work):
+    """Await `work`, cancelling it if the client disconnects first: nobody would read the answer."""
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print(f"Client disconnected from {http_request.url.path}")
+                task.cancel()
+                # Answered for the logs; the client is gone
+                raise HTTPException(status_code=499, detail="Client closed request")
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+@app.get("/admission")
+async def admission_status():
+    """Run slots, waiting requests and recent Gemini usage, for clients deciding when to send work."""
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.status()}
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Stop a queued or running job; the request waiting for it answers 499."""
+    cancelled = cancel(job_id, REQUESTED)
+    if job_queue is not None:
+        # The job may be waited for on another node, and runs on whichever worker claimed it
+        cancelled = await run_in_threadpool(job_queue.cancel, job_id, REQUESTED) or cancelled
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="No queued or running job with this id")
+    return {"job_id": job_id, "status": "cancelling"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a queued job, with its result once done (multi-node mode only)."""
+    job = await run_in_threadpool(job_queue.get, job_id) if job_queue is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("payload", None)
+    return job
+
+@app.post("/generate_blog")
+async def generate_blog(request: BlogRequest, http_request: Request, x_profile: Optional[str] = Header(None),
+                        x_admin_token: Optional[str] = Header(None)):
+    if request.method not in ("quick", "deep"):
         return {"error": "Invalid method specified. Use 'quick' or 'deep'."}
+    request = wants_profile(request, x_profile, x_admin_token)
+
+    cache_key = None
+    if result_cache is not None and not request.profile:
+        cache_key = ResultCache.key_for(request.topic, request.method, request.word_count, request.scrape_thumbnail)
+        if not request.force_refresh:
+            cached, state, age = await run_in_threadpool(result_cache.get, cache_key)
+            if request.max_source_age_hours is not None and age > request.max_source_age_hours * 3600:
+                state = None
+            if state == FRESH or (state == STALE and RESULT_CACHE_MODE == "swr"):
+                if state == STALE:
+                    refresh = asyncio.ensure_future(run_and_store(request, cache_key))
+                    _background_refreshes.add(refresh)
+                    refresh.add_done_callback(_finish_background_refresh)
+                cached["cache"] = {"status": state, "age_seconds": round(age, 1)}
+                return cached
 
+    try:
+        result = await unless_disconnected(http_request, run_and_store(request, cache_key))
+    except TooManyWaitersError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
+
+    if result is not None and cache_key is not None:
+        result["cache"] = {"status": "refreshed" if request.force_refresh else "miss", "age_seconds": 0.0}
     return result
 
+def _finish_background_refresh(task: asyncio.Task):
+    _background_refreshes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background refresh failed: {task.exception()}")
+
+async def run_and_store(request: BlogRequest, cache_key: str = None):
+    """Run the pipeline (sharing any identical run in flight) and cache a successful result."""
+    async def compute():
+        result = await execute("blog", request, run_pipeline)
+        # A post degraded to meet one caller's deadline or token budget is not cached for everyone else
+        degraded = result is not None and (result.get("deadline", {}).get("degraded")
+                                           or result.get("tokens", {}).get("degraded"))
+        if result is not None and cache_key is not None and not degraded:
+            stored = {field: value for field, value in result.items() if field not in PER_RUN_FIELDS}
+            await run_in_threadpool(result_cache.set, cache_key, stored)
+        return result
+
+    return await single_flight.run(coalescing_key(request), compute)
+
+def coalescing_key(request: BlogRequest):
+    """
+    Key under which identical requests in flight share one run, or None to run alone.
+
+    A profiled run is the caller's own; joining someone else's would leave it without a
+    profile. A run with a caller-chosen job_id must be cancellable by that id alone, and
+    cancelling it must not abort other callers' requests.
+    """
+    if request.profile or request.job_id:
+        return None
+    return single_flight.key_for(request)
+
+def run_variants_pipeline(request: BlogVariantsRequest):
+    """Research once, write every requested variant, and attach the timing breakdown."""
+    variants = [
+        {
+            "name": variant.name or f"variant-{index + 1}",
+            "word_count": variant.word_count or request.word_count,
+            "scrape_thumbnail": request.scrape_thumbnail if variant.scrape_thumbnail is None else variant.scrape_thumbnail,
+            "instructions": variant.instructions,
+        }
+        for index, variant in enumerate(request.variants)
+    ]
+    with profile_job(request.profile, topic=request.topic, method=request.method, variants=len(variants)) as profile, \
+            track_request() as timings, track_deadline(request.deadline_seconds) as budget, \
+            track_tokens(request.token_budget) as usage:
+        if request.method == "quick":
+            from QuickResearch.quickresearch import run_quick_research_variants
+            result = run_quick_research_variants(
+                topic=request.topic,
+                variants=variants,
+                max_results=request.max_results,
+                max_source_age_hours=request.max_source_age_hours
+            )
+        else:
+            from DeepResearch.deepresearch import run_deep_research_variants
+            result = run_deep_research_variants(
+                topic=request.topic,
+                variants=variants,
+                max_source_age_hours=request.max_source_age_hours
+            )
+
+    if result is not None:
+        result["timings"] = timings.to_dict()
+        if budget is not None:
+            result["deadline"] = budget.report()
+        result["tokens"] = usage.report()
+    attach_profile(result, profile)
+
+    return result
+
+@app.post("/generate_blog_variants")
+async def generate_blog_variants(request: BlogVariantsRequest, http_request: Request,
+                                 x_profile: Optional[str] = Header(None), x_admin_token: Optional[str] = Header(None)):
+    """Several posts on one topic (lengths, tones, thumbnails) from a single research pass."""
+    if request.method not in ("quick", "deep"):
+        return {"error": "Invalid method specified. Use 'quick' or 'deep'."}
+    if not request.variants:
+        return {"error": "Specify at least one variant."}
+    request = wants_profile(request, x_profile, x_admin_token)
+
+    # Variants are not cached; identical requests in flight still share one run
+    key = coalescing_key(request)
+    if key is not None:
+        key += (("variants", tuple(variant.model_dump_json() for variant in request.variants)),)
+    try:
+        return await unless_disconnected(
+            http_request, single_flight.run(key, lambda: execute("variants", request, run_variants_pipeline)))
+    except TooManyWaitersError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
+
 
 # uvicorn main:app --host 127.0.0.1 --port 8001 --reload
\ No newline at end of file